@@ -0,0 +1,318 @@
+"""Drive the API in-process against a synthetic repository and record timings.
+
+    uv run python benchmarks/run.py --files 5000 --changed-files 500
+    uv run python benchmarks/run.py --compare benchmarks/results/<earlier>.json
+
+Each scenario is requested once cold and then ``--iterations`` times warm.
+The report has latency percentiles, the git and hook processes spawned, and
+the process's peak RSS. Results are written as JSON under
+``benchmarks/results`` so a later run can be compared against them.
+"""
+
+import argparse
+import asyncio
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass, fields
+import json
+import os
+from pathlib import Path
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from synthetic import RepoSpec, generate
+
+RESULTS_DIR = Path(__file__).parent / "results"
+PRECOMMIT_CONFIG = ".pre-commit-config.yaml"
+
+# Stands in for prek: prints results for a few hooks over the given files.
+STUB_PREK = """#!/usr/bin/env python3
+import sys, time
+for name in ("format", "lint", "check yaml"):
+    time.sleep(float({delay!r}))
+    print(name + "." * (79 - len(name) - 6) + "Passed", flush=True)
+"""
+
+
+@dataclass
+class Scenario:
+    name: str
+    path: str
+    params: dict
+    # Runs before every request, e.g. to edit the worktree.
+    before: Callable[[], None] | None = None
+
+
+@dataclass
+class Result:
+    name: str
+    cold_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+    cold_spawns: dict
+    warm_spawns_per_request: float
+    peak_rss_mb: float
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class SpawnCounter:
+    """Counts subprocesses by program name by wrapping asyncio's spawners."""
+
+    def __init__(self):
+        self.counts: Counter[str] = Counter()
+        self._exec = asyncio.create_subprocess_exec
+        self._shell = asyncio.create_subprocess_shell
+
+    def install(self) -> None:
+        exec_, shell = self._exec, self._shell
+
+        async def counted_exec(program, *args, **kwargs):
+            self.counts[Path(str(program)).name] += 1
+            return await exec_(program, *args, **kwargs)
+
+        async def counted_shell(command, **kwargs):
+            self.counts[Path(str(command).split()[0]).name] += 1
+            return await shell(command, **kwargs)
+
+        asyncio.create_subprocess_exec = counted_exec
+        asyncio.create_subprocess_shell = counted_shell
+
+    def uninstall(self) -> None:
+        asyncio.create_subprocess_exec = self._exec
+        asyncio.create_subprocess_shell = self._shell
+
+    def snapshot(self) -> Counter[str]:
+        return Counter(self.counts)
+
+
+def scenarios(repo: Path, edited: Path) -> list[Scenario]:
+    original = edited.read_bytes()
+    counter = 0
+
+    def touch() -> None:
+        nonlocal counter
+        counter += 1
+        edited.write_bytes(original + f"# edit {counter}\n".encode())
+
+    commit = subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=repo, capture_output=True, text=True
+    ).stdout.strip()
+    result = [
+        Scenario("info", "/api/info", {}),
+        Scenario("commits page", "/api/commits", {"limit": 50}),
+        Scenario("branch search", "/api/branches", {"q": "branch"}),
+        Scenario("diff branch", "/api/diff", {}),
+        Scenario("diff branch main", "/api/diff", {"branch": "main"}),
+        Scenario("diff side branch", "/api/diff", {"branch": "branch-0"}),
+        Scenario("diff commit", "/api/diff", {"commit": commit}),
+    ]
+    for mode in ("__all__", "__staged__", "__unstaged__", "__uncommitted__"):
+        result.append(
+            Scenario(f"diff {mode.strip('_')}", "/api/diff", {"commit": mode})
+        )
+    result += [
+        Scenario(
+            "diff uncommitted after edit",
+            "/api/diff",
+            {"commit": "__uncommitted__"},
+            before=touch,
+        ),
+        Scenario("diff structured", "/api/diff", {"format": "structured"}),
+        Scenario("diff summary", "/api/diff/summary", {}),
+        Scenario("diff files page", "/api/diff/files", {"limit": 8}),
+        Scenario("checks", "/api/checks", {}),
+    ]
+    return result
+
+
+async def run_scenarios(
+    repo: Path, iterations: int, spawns: SpawnCounter
+) -> list[Result]:
+    # The app resolves the repository from the working directory on startup.
+    os.chdir(repo)
+    from towelie.app import app
+    from towelie.cache import CACHE_DIR_ENV
+
+    # A fresh disk cache, or cold requests would be served from a past run.
+    disk_cache = tempfile.TemporaryDirectory()
+    os.environ[CACHE_DIR_ENV] = disk_cache.name
+
+    edited = min((repo / "src").rglob("*.py"))
+    original = edited.read_bytes()
+    plan = scenarios(repo, edited)
+    results = []
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://bench", timeout=None
+            ) as client:
+                for scenario in plan:
+                    results.append(
+                        await run_scenario(client, scenario, iterations, spawns)
+                    )
+                    print(format_result(results[-1]), flush=True)
+    finally:
+        edited.write_bytes(original)
+        disk_cache.cleanup()
+    return results
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    iterations: int,
+    spawns: SpawnCounter,
+) -> Result:
+    async def timed() -> float:
+        if scenario.before is not None:
+            scenario.before()
+        start = time.perf_counter()
+        response = await client.get(scenario.path, params=scenario.params)
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+        return elapsed * 1000
+
+    before = spawns.snapshot()
+    cold = await timed()
+    cold_spawns = dict(spawns.snapshot() - before)
+
+    before = spawns.snapshot()
+    samples = [await timed() for _ in range(iterations)]
+    warm_spawns = sum((spawns.snapshot() - before).values())
+    return Result(
+        name=scenario.name,
+        cold_ms=cold,
+        p50_ms=percentile(samples, 50),
+        p90_ms=percentile(samples, 90),
+        p99_ms=percentile(samples, 99),
+        max_ms=max(samples),
+        cold_spawns=cold_spawns,
+        warm_spawns_per_request=warm_spawns / iterations,
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+def format_result(result: Result) -> str:
+    spawned = ",".join(f"{k}={v}" for k, v in sorted(result.cold_spawns.items()))
+    return (
+        f"{result.name:<28} cold {result.cold_ms:8.1f}  p50 {result.p50_ms:7.1f}"
+        f"  p90 {result.p90_ms:7.1f}  p99 {result.p99_ms:7.1f} ms"
+        f"  spawns cold [{spawned or '-'}] warm {result.warm_spawns_per_request:.1f}"
+        f"  rss {result.peak_rss_mb:.0f} MiB"
+    )
+
+
+def compare(previous: dict, current: dict) -> None:
+    before = {r["name"]: r for r in previous["results"]}
+    print(f"\nCompared with {previous['meta']['timestamp']}:")
+    for result in current["results"]:
+        old = before.get(result["name"])
+        if old is None:
+            continue
+        deltas = []
+        for key in ("cold_ms", "p50_ms", "p90_ms"):
+            change = (result[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            deltas.append(f"{key} {old[key]:.1f} -> {result[key]:.1f} ({change:+.0f}%)")
+        print(f"{result['name']:<28} " + "  ".join(deltas))
+
+
+def install_stub_prek(repo: Path, delay: float) -> Path:
+    bin_dir = Path(tempfile.mkdtemp(prefix="towelie-bench-bin-"))
+    prek = bin_dir / "prek"
+    prek.write_text(STUB_PREK.format(delay=delay))
+    prek.chmod(0o755)
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+    (repo / PRECOMMIT_CONFIG).write_text("repos: []\n")
+    return bin_dir
+
+
+def towelie_revision() -> str:
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the towelie API.")
+    for spec_field in fields(RepoSpec):
+        flag = "--" + spec_field.name.replace("_", "-")
+        parser.add_argument(flag, type=int, default=spec_field.default)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--hook-delay", type=float, default=0.05)
+    parser.add_argument(
+        "--repo-dir",
+        type=Path,
+        default=Path(tempfile.gettempdir()) / "towelie-bench",
+        help="where generated repositories are kept and reused",
+    )
+    parser.add_argument("--output", type=Path, help="results file to write")
+    parser.add_argument("--compare", type=Path, help="earlier results to diff")
+    args = parser.parse_args()
+    # Scenarios run from inside the generated repository.
+    previous = json.loads(args.compare.read_text()) if args.compare else None
+    if args.output is not None:
+        args.output = args.output.resolve()
+
+    spec = RepoSpec(**{f.name: getattr(args, f.name) for f in fields(RepoSpec)})
+    repo = args.repo_dir.resolve() / spec.slug
+    start = time.perf_counter()
+    generate(spec, repo)
+    print(f"repository {repo} ready in {time.perf_counter() - start:.1f}s")
+
+    install_stub_prek(repo, args.hook_delay)
+    spawns = SpawnCounter()
+    spawns.install()
+    try:
+        results = asyncio.run(run_scenarios(repo, args.iterations, spawns))
+    finally:
+        spawns.uninstall()
+        (repo / PRECOMMIT_CONFIG).unlink(missing_ok=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "towelie_revision": towelie_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "spec": spec.to_dict(),
+        },
+        "results": [vars(result) for result in results],
+    }
+    output = args.output or RESULTS_DIR / (
+        f"{spec.slug}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"results written to {output}")
+
+    if previous is not None:
+        compare(previous, report)
+
+
+if __name__ == "__main__":
+    main()
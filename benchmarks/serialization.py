@@ -0,0 +1,148 @@
+"""Compare FastAPI's default response serialization with ModelResponse.
+
+    uv run python benchmarks/serialization.py --size-mb 30
+
+FastAPI validates the returned model, dumps it to JSON-compatible Python
+objects and passes those to ``json.dumps``; ModelResponse has pydantic-core
+write the bytes directly. Both must produce identical bodies.
+"""
+
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, TypeAdapter
+
+from towelie.app import ModelResponse
+from towelie.models import (
+    Branch,
+    CommitInfo,
+    Diff,
+    DiffFile,
+    DiffHunk,
+    DiffResponse,
+    FileStatus,
+    ProjectInfoResponse,
+    StructuredDiff,
+    StructuredDiffResponse,
+)
+
+
+def fastapi_default(model: BaseModel) -> bytes:
+    adapter = TypeAdapter(type(model))
+    value = adapter.validate_python(model)
+    return bytes(JSONResponse(adapter.dump_python(value, mode="json")).body)
+
+
+def model_response(model: BaseModel) -> bytes:
+    return bytes(ModelResponse(model).body)
+
+
+def raw_diff(size: int) -> DiffResponse:
+    files, chunks, total = [], [], 0
+    while total < size:
+        name = f"src/module_{len(files)}.py"
+        lines = "".join(f"+    value_{i} = compute({i!r}, 'é')\n" for i in range(200))
+        chunk = f"diff --git a/{name} b/{name}\n@@ -0,0 +1,200 @@\n{lines}"
+        files.append(name)
+        chunks.append(chunk)
+        total += len(chunk)
+    return DiffResponse(diff=Diff(diff="".join(chunks), files=files))
+
+
+def structured_diff(size: int) -> StructuredDiffResponse:
+    files, total = [], 0
+    while total < size:
+        lines = [f"+    value_{i} = compute({i!r})" for i in range(200)]
+        total += sum(len(line) for line in lines)
+        name = f"src/module_{len(files)}.py"
+        files.append(
+            DiffFile(
+                old_path=name,
+                new_path=name,
+                status=FileStatus.ADDED,
+                binary=False,
+                additions=200,
+                deletions=0,
+                old_oid="0000000",
+                new_oid="1234567",
+                hunks=[
+                    DiffHunk(
+                        old_start=0,
+                        old_lines=0,
+                        new_start=1,
+                        new_lines=200,
+                        header="@@ -0,0 +1,200 @@",
+                        lines=lines,
+                    )
+                ],
+            )
+        )
+    return StructuredDiffResponse(diff=StructuredDiff(files=files))
+
+
+def project_info(branches: int) -> ProjectInfoResponse:
+    return ProjectInfoResponse(
+        project_name="bench",
+        current_branch="branch-0",
+        base_branch="main",
+        branches=[
+            Branch(
+                name=f"branch-{b}",
+                commits=[
+                    CommitInfo(hash=f"{b:020x}{c:020x}", label=f"commit {c}")
+                    for c in range(50)
+                ],
+            )
+            for b in range(branches)
+        ],
+    )
+
+
+def measure(encode, model: BaseModel, repeat: int) -> tuple[float, int]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encode(model)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    encode(model)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare response serialization paths."
+    )
+    parser.add_argument("--size-mb", type=float, default=30)
+    parser.add_argument("--branches", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    payloads = {
+        "raw diff": raw_diff(size),
+        "structured diff": structured_diff(size),
+        "info": project_info(args.branches),
+    }
+    print(f"{'payload':<16} {'path':<16} {'median ms':>10} {'peak MiB':>10}")
+    for name, model in payloads.items():
+        expected = fastapi_default(model)
+        assert model_response(model) == expected, f"{name}: bodies differ"
+        for path, encode in (
+            ("fastapi default", fastapi_default),
+            ("ModelResponse", model_response),
+        ):
+            median, peak = measure(encode, model, args.repeat)
+            print(
+                f"{name:<16} {path:<16} {median * 1000:>10.1f}"
+                f" {peak / 1024 / 1024:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Generate git repositories of a configurable shape for benchmarks.
+
+History is written with ``git fast-import`` so even large repositories take
+seconds to build. The checked-out ``feature`` branch diverges from ``main``
+and carries staged and unstaged edits, so every diff mode has work to do.
+"""
+
+from dataclasses import asdict, dataclass
+import os
+from pathlib import Path
+import random
+import subprocess
+
+WORDS = "alpha beta gamma delta value result index count items name".split()
+AUTHOR = "Bench <bench@example.com>"
+
+
+@dataclass(frozen=True)
+class RepoSpec:
+    files: int = 1000
+    file_lines: int = 100
+    # Commits on main after the initial import.
+    commits: int = 50
+    # Side branches besides main and feature.
+    branches: int = 10
+    # Files the feature branch changes, and lines changed in each.
+    changed_files: int = 100
+    lines_per_change: int = 20
+    binary_files: int = 10
+    binary_size: int = 64 * 1024
+    # Files edited in the worktree; the first half of them is also staged.
+    uncommitted_files: int = 20
+    seed: int = 0
+
+    @property
+    def slug(self) -> str:
+        return (
+            f"f{self.files}-l{self.file_lines}-c{self.commits}-b{self.branches}"
+            f"-ch{self.changed_files}x{self.lines_per_change}-bin{self.binary_files}"
+            f"-u{self.uncommitted_files}-s{self.seed}"
+        )
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def text_path(index: int) -> str:
+    return f"src/pkg_{index % 20}/module_{index}.py"
+
+
+def binary_path(index: int) -> str:
+    return f"assets/blob_{index}.bin"
+
+
+class _Content:
+    def __init__(self, spec: RepoSpec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.files: dict[str, list[str]] = {}
+
+    def line(self, file_index: int, number: int) -> str:
+        words = " ".join(self.rng.choice(WORDS) for _ in range(6))
+        return f"value_{number} = compute({file_index}, '{words}')"
+
+    def initial(self, index: int) -> bytes:
+        lines = [self.line(index, n) for n in range(self.spec.file_lines)]
+        self.files[text_path(index)] = lines
+        return _join(lines)
+
+    def change(self, path: str, count: int) -> bytes:
+        lines = self.files[path]
+        for _ in range(min(count, len(lines))):
+            number = self.rng.randrange(len(lines))
+            lines[number] = self.line(-1, number) + "  # changed"
+        return _join(lines)
+
+    def binary(self) -> bytes:
+        return self.rng.randbytes(self.spec.binary_size)
+
+
+def _join(lines: list[str]) -> bytes:
+    return ("\n".join(lines) + "\n").encode()
+
+
+class _Stream:
+    """Builder for a ``git fast-import`` input stream."""
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.marks = 0
+        self.time = 1_700_000_000
+
+    def commit(
+        self,
+        ref: str,
+        message: str,
+        parent: int | None,
+        changes: dict[str, bytes],
+    ) -> int:
+        self.marks += 1
+        self.time += 60
+        header = [
+            f"commit {ref}",
+            f"mark :{self.marks}",
+            f"committer {AUTHOR} {self.time} +0000",
+            f"data {len(message.encode())}",
+            message,
+        ]
+        if parent is not None:
+            header.append(f"from :{parent}")
+        self.chunks.append(("\n".join(header) + "\n").encode())
+        for path, data in changes.items():
+            self.chunks.append(f"M 100644 inline {path}\ndata {len(data)}\n".encode())
+            self.chunks.append(data + b"\n")
+        self.chunks.append(b"\n")
+        return self.marks
+
+    def reset(self, ref: str, mark: int) -> None:
+        self.chunks.append(f"reset {ref}\nfrom :{mark}\n\n".encode())
+
+    def data(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+def _git(repo: Path, *args: str, input: bytes | None = None) -> None:
+    env = {**os.environ, "GIT_AUTHOR_NAME": "Bench", "GIT_COMMITTER_NAME": "Bench"}
+    subprocess.run(
+        ["git", *args], cwd=repo, input=input, check=True, env=env, capture_output=True
+    )
+
+
+def generate(spec: RepoSpec, repo: Path) -> Path:
+    """Create the repository at ``repo``; reused if it was built before."""
+    marker = repo / ".git" / "towelie-bench-spec"
+    if marker.exists() and marker.read_text() == spec.slug:
+        return repo
+    if repo.exists() and any(repo.iterdir()):
+        raise FileExistsError(f"{repo} exists and is not a benchmark repo")
+
+    repo.mkdir(parents=True, exist_ok=True)
+    _git(repo, "init", "-q", "-b", "main")
+    content = _Content(spec)
+    stream = _Stream()
+    rng = content.rng
+
+    initial = {text_path(i): content.initial(i) for i in range(spec.files)}
+    initial.update({binary_path(i): content.binary() for i in range(spec.binary_files)})
+    main = stream.commit("refs/heads/main", "initial import", None, initial)
+
+    paths = sorted(content.files)
+    per_commit = max(1, spec.files // 100)
+    for number in range(spec.commits):
+        changed = rng.sample(paths, min(per_commit, len(paths)))
+        main = stream.commit(
+            "refs/heads/main",
+            f"main change {number}",
+            main,
+            {path: content.change(path, 3) for path in changed},
+        )
+
+    for number in range(spec.branches):
+        changed = rng.sample(paths, min(3, len(paths)))
+        # Side branches fork from main and must not leak into later commits.
+        saved = {path: list(content.files[path]) for path in changed}
+        stream.commit(
+            f"refs/heads/branch-{number}",
+            f"branch {number} change",
+            main,
+            {path: content.change(path, 3) for path in changed},
+        )
+        content.files.update(saved)
+
+    feature_paths = rng.sample(paths, min(spec.changed_files, len(paths)))
+    feature = main
+    stream.reset("refs/heads/feature", main)
+    batches = [feature_paths[i::5] for i in range(5)]
+    for number, batch in enumerate(batches):
+        changes = {path: content.change(path, spec.lines_per_change) for path in batch}
+        if number == 0 and spec.binary_files:
+            changes[binary_path(0)] = content.binary()
+        if changes:
+            feature = stream.commit(
+                "refs/heads/feature", f"feature step {number}", feature, changes
+            )
+
+    _git(repo, "fast-import", "--quiet", input=stream.data())
+    _git(repo, "checkout", "-q", "-f", "feature")
+
+    population = feature_paths or paths
+    edited = rng.sample(population, min(spec.uncommitted_files, len(population)))
+    for path in edited:
+        (repo / path).write_bytes(content.change(path, spec.lines_per_change))
+    staged = edited[: len(edited) // 2]
+    if staged:
+        _git(repo, "add", "--", *staged)
+
+    marker.write_text(spec.slug)
+    return repo
@@ -1,37 +1,126 @@
 import asyncio
+import base64
+import codecs
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
 from contextlib import asynccontextmanager
-from dataclasses import dataclass
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import cache
+import hashlib
+import heapq
+import json
 import os
 from pathlib import Path
+import shlex
+import signal
 import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING, cast
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-
+from pydantic import BaseModel
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from towelie import startup
+from towelie.branches import HEADS, REF_FORMAT, BranchIndex, RefScan, parse_refs
+from towelie.cache import (
+    CACHE_DIR_ENV,
+    MISSING,
+    DiskCache,
+    RepoState,
+    ResultCache,
+    ScopedCache,
+    stat_token,
+)
+from towelie.checks import (
+    NO_FILES,
+    PASSED,
+    PRECOMMIT_CONFIG,
+    CheckJob,
+    CheckJobManager,
+    HookOutputParser,
+    HookResult,
+    blob_hash,
+    config_hash,
+    format_hook_results,
+    object_hash,
+    parse_hook_results,
+    whole_repo_hooks,
+)
+from towelie.classify import ATTRIBUTES, CollapseRules, parse_check_attr
+from towelie.comments import (
+    CURRENT_SCOPE,
+    Anchor,
+    CommentStore,
+    LineMap,
+    StoredComment,
+    line_count,
+)
+from towelie.executor import GitExecutor, GitResult, begin_request
+from towelie.gitpool import GitObjectPool
+from towelie.highlight import Highlighter, LineSpans, Span, language_for
+from towelie.metrics import Metrics, begin_timings
 from towelie.models import (
     AppOptionsPayload,
     Branch,
+    BranchMatch,
+    BranchSearchResponse,
+    CheckHookEvent,
     ChecksResponse,
     CheckStatus,
+    CollapseReason,
+    Comment,
+    CommentPayload,
+    CommentsResponse,
+    CommentTextPayload,
     CommitInfo,
+    CommitPageResponse,
     Diff,
+    DiffFile,
+    DiffFileSummary,
+    DiffFormat,
+    DiffHunk,
     DiffResponse,
+    DiffSide,
+    DiffSummaryResponse,
+    FileLinesResponse,
+    FileStatus,
+    MetricsResponse,
     ParsedCheck,
     ProjectInfoResponse,
+    RepoEntry,
+    ReposResponse,
+    StructuredDiff,
+    StructuredDiffResponse,
 )
 from towelie.options import AppOptions, DiffOptions, OptionsStore, PromptOptions
+from towelie.patch import (
+    DIFF_FORMAT,
+    FilePatch,
+    FileStat,
+    Hunk,
+    LineIndex,
+    PatchParser,
+    iter_lines,
+    parse_patch,
+    parse_raw_patch,
+    parse_summary,
+    patch_stats,
+    patches_size,
+)
+from towelie.repos import REPOS_ENV, find_git_root, repo_slug
+from towelie.watcher import RepoWatcher, WatchHub
 
-dev_mode = os.environ.get("TOWELIE_DEV") == "1"
-
+if TYPE_CHECKING:
+    from fastapi.templating import Jinja2Templates
 
-def _log_cmd(cmd):
-    if not dev_mode:
-        return
-    if isinstance(cmd, (list, tuple)):
-        print(f"  $ {' '.join(str(c) for c in cmd)}", file=sys.stderr)
-    else:
-        print(f"  $ {cmd}", file=sys.stderr)
+dev_mode = os.environ.get("TOWELIE_DEV") == "1"
+# Every subprocess is timed here; dev mode also logs each one as it ends.
+METRICS = Metrics(log=dev_mode)
 
 
 @dataclass
@@ -46,300 +135,1307 @@ STAGED = "__staged__"
 UNSTAGED = "__unstaged__"
 
 
+@dataclass(frozen=True)
+class DiffTarget:
+    """Revisions handed to ``git diff`` plus the fingerprint its output depends on."""
+
+    args: tuple[str, ...]
+    key: tuple
+    # Diffed against the worktree; the key then ends with the worktree token.
+    live: bool = False
+    # Args name commits by full sha only, so git's output for them never
+    # changes and may be kept on disk across restarts.
+    immutable: bool = False
+
+
+FULL_SHA_LEN = 40
+# Commits per page in /api/info and /api/commits.
+COMMIT_PAGE_SIZE = 100
+MAX_COMMIT_PAGE_SIZE = 1000
+# Branches /api/info lists besides the current, base and requested ones.
+INFO_BRANCHES = 50
+BRANCH_SEARCH_LIMIT = 20
+MAX_BRANCH_SEARCH_LIMIT = 200
+# Responses smaller than this aren't worth compressing.
+GZIP_MIN_SIZE = 1024
+# Streamed responses opt out of gzip, which would hold every record back
+# until its buffer fills.
+STREAM_HEADERS = {
+    "Cache-Control": "no-store",
+    "Content-Encoding": "identity",
+    "X-Accel-Buffering": "no",
+}
+# ETags only hold within one server process: watcher generations restart
+# from zero, so a new process must never match a tag from an old one.
+_ETAG_SALT = os.urandom(16)
+# Lines of context around each change; more is fetched with /api/file/lines.
+DIFF_CONTEXT = 3
+# Past this many changed paths a full re-diff beats a long pathspec.
+MAX_SPLICE_PATHS = 256
+STREAM_CHUNK_SIZE = 64 * 1024
+EVENTS_HEARTBEAT = 15.0
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+def _is_full_sha(rev: str) -> bool:
+    return len(rev) == FULL_SHA_LEN and all(c in "0123456789abcdef" for c in rev)
+
+
+@dataclass(frozen=True)
+class CommitCursor:
+    """Position in ``git log base..tip``, handed to clients as an opaque string.
+
+    The tip and base are pinned by sha, so later pages continue the listing
+    the first one came from even if the branch moves in between.
+    """
+
+    tip: str
+    base: str
+    offset: int
+
+    def encode(self) -> str:
+        raw = f"{self.tip}:{self.base}:{self.offset}".encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, cursor: str) -> "CommitCursor":
+        """Raises ValueError for anything ``encode`` did not produce."""
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        tip, _, rest = raw.partition(":")
+        base, _, offset = rest.partition(":")
+        if not (_is_full_sha(tip) and _is_full_sha(base) and offset.isdigit()):
+            raise ValueError(f"invalid commit cursor: {cursor!r}")
+        return cls(tip=tip, base=base, offset=int(offset))
+
+
+@dataclass
+class LiveDiff:
+    """Last diff of a worktree target, kept so edits can be re-diffed per file."""
+
+    signatures: dict[str, tuple[int, int, int, int] | None]
+    patches: list[FilePatch]
+
+
+def _write_versions(paths: tuple[Path, Path], versions: tuple[bytes, bytes]) -> None:
+    for path, data in zip(paths, versions):
+        path.write_bytes(data)
+
+
+def _walk_by_date(
+    tip: str, dates: dict[str, int], parents: dict[str, list[str]]
+) -> Iterator[str]:
+    """Yield commits reachable from ``tip`` in ``git log``'s default order.
+
+    Git pops the newest commit first and breaks date ties by insertion
+    order; only commits present in ``dates`` are visited.
+    """
+    if tip not in dates:
+        return
+    seen = {tip}
+    queue = [(-dates[tip], 0, tip)]
+    counter = 1
+    while queue:
+        _, _, commit = heapq.heappop(queue)
+        yield commit
+        for parent in parents[commit]:
+            if parent in dates and parent not in seen:
+                seen.add(parent)
+                heapq.heappush(queue, (-dates[parent], counter, parent))
+                counter += 1
+
+
 @dataclass
 class Project:
     git_root: Path
+    cache: ResultCache | ScopedCache = field(default_factory=ResultCache)
+    runner: GitExecutor = field(default_factory=lambda: GitExecutor(metrics=METRICS))
+    objects: GitObjectPool = field(init=False, repr=False)
+    watcher: RepoWatcher | None = field(default=None, init=False, repr=False)
+    highlighter: Highlighter = field(default_factory=Highlighter, repr=False)
+    watch_hub: WatchHub | None = field(default=None, repr=False)
+    disk: DiskCache | None = field(default=None, repr=False)
+    comments: CommentStore = field(default_factory=CommentStore, repr=False)
+    # Shared by a registry's projects, so one check run executes at a time.
+    check_slots: asyncio.Semaphore | None = field(default=None, repr=False)
+    checks: "CheckJobManager[HookResult | CheckResult]" = field(init=False, repr=False)
+    _state: RepoState | None = field(default=None, init=False, repr=False)
+    _branches: BranchIndex = field(default_factory=BranchIndex, init=False, repr=False)
+    _branches_lock: asyncio.Lock = field(
+        default_factory=asyncio.Lock, init=False, repr=False
+    )
+    _branches_epoch: int | None = field(default=None, init=False, repr=False)
+    _refs_memo: tuple[int, tuple] | None = field(default=None, init=False, repr=False)
+    _watching: "asyncio.Task[RepoWatcher] | None" = field(
+        default=None, init=False, repr=False
+    )
 
-    async def get_base_branch(self) -> str:
-        for branch in ("main", "master"):
-            _log_cmd(["git", "rev-parse", "--verify", branch])
+    def __post_init__(self):
+        self.objects = GitObjectPool(self.git_root, metrics=self.runner.metrics)
+        self.checks = CheckJobManager(self.stream_checks, slots=self.check_slots)
+
+    async def start_watching(self) -> RepoWatcher:
+        # Concurrent first callers, e.g. prefetch and /api/events, must end
+        # up sharing one watcher.
+        if self._watching is None:
+            self._watching = asyncio.create_task(self._start_watcher())
+        return await asyncio.shield(self._watching)
+
+    async def _start_watcher(self) -> RepoWatcher:
+        watcher = RepoWatcher(
+            await self.repo_state(), self._tracked_files, hub=self.watch_hub
+        )
+        await watcher.start()
+        self.watcher = watcher
+        return watcher
+
+    async def close(self) -> None:
+        self.checks.close()
+        if self._watching is not None and not self._watching.done():
+            self._watching.cancel()
+        if self.watcher is not None:
+            await self.watcher.close()
+        await self.objects.close()
+
+    async def prefetch(self) -> None:
+        """Warm what a freshly opened page asks for first: the branch info
+        and the summary of the current branch's diff."""
+        base, current = await asyncio.gather(
+            self.get_base_branch(), self.get_current_branch()
+        )
+        target = await self.get_diff_target(current, base, None)
+        names = await self.featured_branches(current, base)
+        await asyncio.gather(
+            self.get_branch_commits(base, names), self.get_diff_summary(target)
+        )
+
+    async def _git(self, *args: str, input: bytes | None = None) -> GitResult:
+        return await self.runner.run(
+            self.git_root, args, input=input, epoch=self._epoch()
+        )
+
+    def _epoch(self) -> int | None:
+        """Counter bumped on every repository change, when inotify provides one."""
+        if self.watcher is not None and self.watcher.mode == "inotify":
+            return self.watcher.current_generation()
+        return None
+
+    async def _git_stream(self, *args: str) -> AsyncIterator[bytes]:
+        """Yield git's stdout in chunks as it is produced.
+
+        The process is killed if the consumer stops early, e.g. because the
+        HTTP client went away. A process slot is held to spawn git and for
+        each read, not while the consumer handles a chunk: git just blocks
+        on the full pipe meanwhile, and other commands can use the slot.
+        """
+        cmd = ["git", *args]
+        start = time.perf_counter()
+        async with self.runner.slot():
             proc = await asyncio.create_subprocess_exec(
-                "git",
-                "rev-parse",
-                "--verify",
-                branch,
+                *cmd,
+                cwd=self.git_root,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        assert proc.stdout is not None
+        received = 0
+        try:
+            while True:
+                async with self.runner.slot():
+                    chunk = await proc.stdout.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                yield chunk
+            await proc.wait()
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            self.runner.metrics.record_command(
+                cmd, time.perf_counter() - start, received, proc.returncode or 0
+            )
+
+    async def _cached[T](
+        self,
+        key: tuple,
+        compute: Callable[[], Awaitable[T]],
+        size: Callable[[T], int] | None = None,
+    ) -> T:
+        value = self.cache.get(key)
+        if value is MISSING:
+            value = await compute()
+            self.cache.put(key, value, size(value) if size is not None else None)
+        return cast(T, value)
+
+    async def repo_state(self) -> RepoState:
+        if self._state is None:
+            result = await self._git(
+                "rev-parse", "--absolute-git-dir", "--git-common-dir"
             )
-            await proc.communicate()
-            if proc.returncode == 0:
-                return branch
-        return "main"
+            git_dir, common_dir = result.stdout.decode().splitlines()[:2]
+            self._state = RepoState(
+                git_root=self.git_root,
+                git_dir=Path(git_dir),
+                common_dir=(self.git_root / common_dir).resolve(),
+            )
+        return self._state
+
+    async def _tracked_files(self) -> list[str]:
+        state = await self.repo_state()
+
+        async def compute() -> list[str]:
+            result = await self._git("ls-files", "-z")
+            return [p for p in result.stdout.decode().split("\0") if p]
+
+        return await self._cached(("ls-files", state.index_token()), compute)
+
+    async def _worktree_token(self) -> bytes | int:
+        # inotify bumps the generation on every write, which saves stat-ing
+        # every tracked file; polling lags by an interval so it can't be used.
+        epoch = self._epoch()
+        if epoch is not None:
+            return epoch
+        state = await self.repo_state()
+        tracked = await self._tracked_files()
+        return await asyncio.to_thread(state.worktree_token, tracked)
+
+    async def _refs_token(self, state: RepoState) -> tuple:
+        """``state.refs_token()``, walked at most once per watcher generation.
+
+        The walk stats every ref file, which adds up with thousands of
+        branches, so it runs off the loop; inotify bumps the generation
+        whenever one of them changes.
+        """
+        epoch = self._epoch()
+        if epoch is None:
+            return await asyncio.to_thread(state.refs_token)
+        if self._refs_memo is None or self._refs_memo[0] != epoch:
+            self._refs_memo = (epoch, await asyncio.to_thread(state.refs_token))
+        return self._refs_memo[1]
+
+    async def info_token(self) -> tuple:
+        """Fingerprint of everything /api/info reports: HEAD and the refs."""
+        state = await self.repo_state()
+        return ("info", await self._refs_token(state))
+
+    async def get_base_branch(self) -> str:
+        state = await self.repo_state()
+
+        async def compute() -> str:
+            for branch in ("main", "master"):
+                if await self.objects.resolve(branch) is not None:
+                    return branch
+            return "main"
+
+        return await self._cached(
+            ("base-branch", await self._refs_token(state)), compute
+        )
 
     def _has_precommit_config(self) -> bool:
-        return (self.git_root / ".pre-commit-config.yaml").exists()
+        return (self.git_root / PRECOMMIT_CONFIG).exists()
 
     @property
     def check_command(self) -> CheckCommand | None:
         if self._has_precommit_config():
-            return CheckCommand(command="prek -a")
+            return CheckCommand(command="prek run --files")
         return None
 
     async def get_current_branch(self) -> str:
-        _log_cmd(["git", "branch", "--show-current"])
-        proc = await asyncio.create_subprocess_exec(
-            "git",
-            "branch",
-            "--show-current",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        stdout, _ = await proc.communicate()
-        return stdout.decode().strip()
+        state = await self.repo_state()
 
-    async def get_uncommitted_diff(self) -> Diff:
-        _log_cmd(["git", "diff", "HEAD", "--unified=10"])
-        diff_proc = await asyncio.create_subprocess_exec(
-            "git",
-            "diff",
-            "HEAD",
-            "--unified=10",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        _log_cmd(["git", "diff", "--cached", "--name-only"])
-        staged_files = await asyncio.create_subprocess_exec(
-            "git",
-            "diff",
-            "--cached",
-            "--name-only",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+        async def compute() -> str:
+            result = await self._git("branch", "--show-current")
+            return result.stdout.decode().strip()
+
+        return await self._cached(("current-branch", state.head_token()), compute)
+
+    async def uncommitted_target(self) -> DiffTarget:
+        state = await self.repo_state()
+        key = (
+            "uncommitted",
+            await self._refs_token(state),
+            state.index_token(),
+            await self._worktree_token(),
         )
-        _log_cmd(["git", "diff", "--name-only"])
-        unstaged_files = await asyncio.create_subprocess_exec(
-            "git",
-            "diff",
-            "--name-only",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+        return DiffTarget(args=("HEAD",), key=key, live=True)
+
+    async def staged_target(self) -> DiffTarget:
+        state = await self.repo_state()
+        key = ("staged", await self._refs_token(state), state.index_token())
+        return DiffTarget(args=("--cached",), key=key)
+
+    async def unstaged_target(self) -> DiffTarget:
+        state = await self.repo_state()
+        key = ("unstaged", state.index_token(), await self._worktree_token())
+        return DiffTarget(args=(), key=key, live=True)
+
+    async def commit_target(self, commit: str) -> DiffTarget:
+        # A full SHA names an immutable commit, so it needs no ref fingerprint.
+        sha = commit if _is_full_sha(commit) else await self.objects.resolve(commit)
+        if sha is not None:
+            return DiffTarget(
+                args=(f"{sha}^", sha), key=("commit", sha), immutable=True
+            )
+        state = await self.repo_state()
+        key = ("commit", commit, await self._refs_token(state))
+        return DiffTarget(args=(f"{commit}^", commit), key=key)
+
+    async def branch_target(self, branch: str, base: str) -> DiffTarget:
+        state = await self.repo_state()
+        key: tuple = ("branch", branch, base, await self._refs_token(state))
+        if branch == await self.get_current_branch():
+            # The current branch is diffed against the worktree.
+            key += (state.index_token(), await self._worktree_token())
+            return DiffTarget(args=("--merge-base", base), key=key, live=True)
+
+        async def compute() -> tuple[str | None, str | None]:
+            return await asyncio.gather(
+                self.objects.resolve(base), self.objects.resolve(branch)
+            )
+
+        # Pinned by sha, the merge-base...tip diff outlives the refs moving.
+        base_sha, tip_sha = await self._cached(
+            ("branch-tips", branch, base, await self._refs_token(state)), compute
         )
-        diff_out, _ = await diff_proc.communicate()
-        staged_files_out, _ = await staged_files.communicate()
-        unstaged_files_out, _ = await unstaged_files.communicate()
-        files = set()
-        for f in staged_files_out.decode().strip().split("\n"):
-            if f:
-                files.add(f)
-        for f in unstaged_files_out.decode().strip().split("\n"):
-            if f:
-                files.add(f)
-        return Diff(diff=diff_out.decode(), files=sorted(files))
+        if base_sha is not None and tip_sha is not None:
+            return DiffTarget(
+                args=(f"{base_sha}...{tip_sha}",), key=key, immutable=True
+            )
+        return DiffTarget(args=(f"{base}...{branch}",), key=key)
+
+    async def get_diff_target(
+        self, branch: str, base: str, commit: str | None
+    ) -> DiffTarget:
+        if commit == UNCOMMITTED:
+            return await self.uncommitted_target()
+        if commit == STAGED:
+            return await self.staged_target()
+        if commit == UNSTAGED:
+            return await self.unstaged_target()
+        if not commit or commit == ALL_CHANGES:
+            return await self.branch_target(branch, base)
+        return await self.commit_target(commit)
+
+    async def get_uncommitted_diff(self) -> Diff:
+        return await self._get_live_diff(await self.uncommitted_target())
 
     async def get_staged_diff(self) -> Diff:
-        _log_cmd(["git", "diff", "--cached", "--unified=10"])
-        diff_proc = await asyncio.create_subprocess_exec(
-            "git",
-            "diff",
-            "--cached",
-            "--unified=10",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        _log_cmd(["git", "diff", "--cached", "--name-only"])
-        files_proc = await asyncio.create_subprocess_exec(
-            "git",
-            "diff",
-            "--cached",
-            "--name-only",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        diff_out, _ = await diff_proc.communicate()
-        files_out, _ = await files_proc.communicate()
-        files = [f for f in files_out.decode().strip().split("\n") if f]
-        return Diff(diff=diff_out.decode(), files=files)
+        return await self._get_simple_diff(await self.staged_target())
 
     async def get_unstaged_diff(self) -> Diff:
-        _log_cmd(["git", "diff", "--unified=10"])
-        diff_proc = await asyncio.create_subprocess_exec(
-            "git",
-            "diff",
-            "--unified=10",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        _log_cmd(["git", "diff", "--name-only"])
-        files_proc = await asyncio.create_subprocess_exec(
-            "git",
-            "diff",
-            "--name-only",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        diff_out, _ = await diff_proc.communicate()
-        files_out, _ = await files_proc.communicate()
-        files = [f for f in files_out.decode().strip().split("\n") if f]
-        return Diff(diff=diff_out.decode(), files=files)
+        return await self._get_live_diff(await self.unstaged_target())
 
     async def get_commit_diff(self, commit: str) -> Diff:
-        _log_cmd(["git", "diff", f"{commit}^", commit, "--unified=10"])
-        diff_proc = await asyncio.create_subprocess_exec(
-            "git",
+        return await self._get_simple_diff(await self.commit_target(commit))
+
+    async def _get_simple_diff(self, target: DiffTarget) -> Diff:
+        """Patch and file list from one git call: raw records, then the patch."""
+
+        async def compute() -> Diff:
+            output = await self._diff(
+                target, "--raw", "-z", "-p", f"--unified={DIFF_CONTEXT}"
+            )
+            stats, text = parse_raw_patch(output)
+            return Diff(diff=text, files=sorted(stat.path for stat in stats))
+
+        return await self._cached(target.key, compute)
+
+    async def _diff(
+        self, target: DiffTarget, *options: str, paths: list[str] | None = None
+    ) -> bytes:
+        """Output of ``git diff`` for ``target``, limited to ``paths`` if given.
+
+        Output for an immutable target is also kept in the disk cache, so it
+        survives restarts; the in-memory cache still sits in front of it.
+        """
+        args = ("diff", *DIFF_FORMAT, *target.args, *options)
+        if paths:
+            args = ("--literal-pathspecs", *args, "--", *paths)
+        if not target.immutable or self.disk is None:
+            return (await self._git(*args)).stdout
+
+        state = await self.repo_state()
+        # Attributes and config can change what git prints for the same
+        # commits, so repositories don't share entries.
+        key = (str(state.common_dir), args)
+        output = await asyncio.to_thread(self.disk.get, key)
+        if output is None:
+            result = await self._git(*args)
+            output = result.stdout
+            if result.returncode == 0:
+                await asyncio.to_thread(self.disk.put, key, output)
+        return output
+
+    async def get_branch_diff(self, branch: str, base: str) -> Diff:
+        return await self.get_diff(await self.branch_target(branch, base))
+
+    async def get_diff(self, target: DiffTarget) -> Diff:
+        if target.live:
+            return await self._get_live_diff(target)
+        return await self._get_simple_diff(target)
+
+    async def _get_live_diff(self, target: DiffTarget) -> Diff:
+        """Diff against the worktree, re-diffing only files whose stat changed.
+
+        The previous per-file patches are kept under the target's key minus
+        the worktree token; tracked files whose stat signature differs since
+        then are diffed again and spliced in.
+        """
+        state = await self.repo_state()
+
+        async def compute() -> Diff:
+            live_key = ("live",) + target.key[:-1]
+            tracked = await self._tracked_files()
+            # Stat before diffing: a write racing the diff then shows up as a
+            # changed signature next time instead of being missed.
+            signatures = await asyncio.to_thread(state.file_signatures, tracked)
+            previous = self.cache.get(live_key)
+            if isinstance(previous, LiveDiff):
+                changed = {
+                    path
+                    for path in signatures.keys() | previous.signatures.keys()
+                    if signatures.get(path) != previous.signatures.get(path)
+                }
+                patches = await self._splice_patches(target, previous.patches, changed)
+            else:
+                result = await self._git(
+                    "diff", *DIFF_FORMAT, *target.args, f"--unified={DIFF_CONTEXT}"
+                )
+                patches = parse_patch(result.stdout.decode())
+
+            live = LiveDiff(signatures=signatures, patches=patches)
+            # A path, a four-int tuple and a dict slot per tracked file.
+            size = patches_size(patches) + sum(len(p) + 250 for p in signatures)
+            self.cache.put(live_key, live, size)
+            return Diff(
+                diff="".join(patch.text for patch in patches),
+                files=sorted(patch.path for patch in patches),
+            )
+
+        return await self._cached(target.key, compute)
+
+    async def _splice_patches(
+        self, target: DiffTarget, patches: list[FilePatch], changed: set[str]
+    ) -> list[FilePatch]:
+        if not changed:
+            return patches
+        # Both names of a rename must be in the pathspec or git reports an
+        # add and a delete instead.
+        pathspec = set(changed)
+        for patch in patches:
+            if patch.status in ("R", "C") and (
+                patch.old_path in changed or patch.new_path in changed
+            ):
+                pathspec.update((patch.old_path, patch.new_path))
+        if len(pathspec) > MAX_SPLICE_PATHS:
+            result = await self._git(
+                "diff", *DIFF_FORMAT, *target.args, f"--unified={DIFF_CONTEXT}"
+            )
+            return parse_patch(result.stdout.decode())
+
+        result = await self._git(
+            "--literal-pathspecs",
             "diff",
-            f"{commit}^",
-            commit,
-            "--unified=10",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+            *DIFF_FORMAT,
+            *target.args,
+            f"--unified={DIFF_CONTEXT}",
+            "--",
+            *sorted(pathspec),
         )
-        _log_cmd(["git", "diff", f"{commit}^", commit, "--name-only"])
-        files_proc = await asyncio.create_subprocess_exec(
-            "git",
-            "diff",
-            f"{commit}^",
-            commit,
-            "--name-only",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+        kept = [
+            patch
+            for patch in patches
+            if patch.old_path not in pathspec and patch.new_path not in pathspec
+        ]
+        fresh = parse_patch(result.stdout.decode())
+        # Git emits files in byte order of their path.
+        return sorted(kept + fresh, key=lambda patch: patch.path.encode())
+
+    async def get_diff_summary(self, target: DiffTarget) -> list[FileStat]:
+        async def compute() -> list[FileStat]:
+            output = await self._diff(target, "--raw", "--numstat", "-z")
+            return parse_summary(output)
+
+        return await self._cached(target.key + ("summary",), compute)
+
+    async def get_collapsed(
+        self,
+        target: DiffTarget,
+        rules: CollapseRules,
+        stats: list[FileStat] | None = None,
+    ) -> dict[str, CollapseReason]:
+        """Files of ``target``'s diff to ship as stats only, by path, with why.
+
+        Pass ``stats`` when the patch is already at hand; otherwise they
+        come from the summary's own diff.
+        """
+        if stats is None:
+            stats = await self.get_diff_summary(target)
+        state = await self.repo_state()
+
+        async def compute() -> dict[str, CollapseReason]:
+            attributes, sizes = await asyncio.gather(
+                self._attributes([stat.path for stat in stats], attributes_token),
+                self._version_sizes(stats),
+            )
+            collapsed = {}
+            for stat in stats:
+                reason = rules.classify(
+                    stat, attributes.get(stat.path, {}), sizes.get(stat.path, 0)
+                )
+                if reason is not None:
+                    collapsed[stat.path] = reason
+            return collapsed
+
+        # Only the top-level attribute files are fingerprinted; an edit to a
+        # nested .gitattributes shows up once the server restarts.
+        attributes_token = (
+            stat_token(self.git_root / ".gitattributes"),
+            stat_token(state.common_dir / "info" / "attributes"),
+        )
+        key = target.key + ("collapsed", rules, attributes_token)
+        return await self._cached(key, compute)
+
+    async def _attributes(
+        self, paths: list[str], token: tuple
+    ) -> dict[str, dict[str, str]]:
+        # Cached apart from the diff: editing a file changes a live diff's
+        # key, but rarely which files it touches.
+        async def compute() -> dict[str, dict[str, str]]:
+            if not paths:
+                return {}
+            result = await self._git(
+                "check-attr",
+                "-z",
+                "--stdin",
+                *ATTRIBUTES,
+                input="".join(f"{path}\0" for path in paths).encode(),
+            )
+            return parse_check_attr(result.stdout)
+
+        return await self._cached(("attributes", tuple(paths), token), compute)
+
+    async def _version_sizes(self, stats: list[FileStat]) -> dict[str, int]:
+        """Size of the larger version of each file, which bounds its patch.
+
+        Blobs are sized with one ``cat-file --batch-check``; worktree
+        versions, which have no blob yet, are stat-ed.
+        """
+        oids = sorted(
+            {
+                oid
+                for stat in stats
+                for oid in (stat.old_oid, stat.new_oid)
+                if oid.strip("0")
+            }
         )
-        diff_stdout, _ = await diff_proc.communicate()
-        files_stdout, _ = await files_proc.communicate()
-        files = [f for f in files_stdout.decode().strip().split("\n") if f]
-        return Diff(diff=diff_stdout.decode(), files=files)
 
-    async def get_branch_diff(self, branch: str, base: str) -> Diff:
-        _log_cmd(["git", "merge-base", base, branch])
-        proc = await asyncio.create_subprocess_exec(
-            "git",
-            "merge-base",
-            base,
-            branch,
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+        async def compute() -> dict[str, int]:
+            if not oids:
+                return {}
+            result = await self._git(
+                "cat-file",
+                "--batch-check=%(objectsize)",
+                input="".join(f"{oid}\n" for oid in oids).encode(),
+            )
+            # One line per input in order; unknown objects say "missing".
+            return {
+                oid: int(line)
+                for oid, line in zip(oids, result.stdout.decode().splitlines())
+                if line.isdigit()
+            }
+
+        # Objects never change, so neither do their sizes.
+        blob_sizes = await self._cached(("blob-sizes", tuple(oids)), compute)
+
+        def worktree_sizes(paths: list[str]) -> dict[str, int]:
+            tokens = {path: stat_token(self.git_root / path) for path in paths}
+            return {path: token[1] for path, token in tokens.items() if token}
+
+        on_disk = await asyncio.to_thread(
+            worktree_sizes,
+            [
+                stat.new_path
+                for stat in stats
+                if stat.status != "D" and not stat.new_oid.strip("0")
+            ],
         )
-        stdout, _ = await proc.communicate()
-        merge_base_ref = stdout.decode().strip()
-
-        cmd = ["git", "diff", merge_base_ref, "--unified=10"]
-        if branch != await self.get_current_branch():
-            cmd.insert(3, branch)
-
-        _log_cmd(cmd)
-        diff_proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+        sizes = {}
+        for stat in stats:
+            sizes[stat.path] = max(
+                blob_sizes.get(stat.old_oid, 0),
+                blob_sizes.get(stat.new_oid, 0),
+                on_disk.get(stat.new_path, 0),
+            )
+        return sizes
+
+    async def get_file_patches(
+        self, target: DiffTarget, paths: list[str]
+    ) -> list[FilePatch]:
+        """Patches for just ``paths``; pass both names of a renamed file."""
+        if not paths:
+            return []
+
+        async def compute() -> list[FilePatch]:
+            output = await self._diff(target, f"--unified={DIFF_CONTEXT}", paths=paths)
+            return parse_patch(output.decode())
+
+        key = target.key + ("files", tuple(sorted(paths)))
+        return await self._cached(key, compute, patches_size)
+
+    async def stream_file_patches(self, target: DiffTarget) -> AsyncIterator[FilePatch]:
+        """Parse the diff while git is still writing it, one file at a time."""
+        parser = PatchParser()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pending = ""
+        async for chunk in self._git_stream(
+            "diff", *DIFF_FORMAT, *target.args, f"--unified={DIFF_CONTEXT}"
+        ):
+            pending += decoder.decode(chunk)
+            lines = pending.split("\n")
+            pending = lines.pop()
+            for line in lines:
+                done = parser.feed(line + "\n")
+                if done is not None:
+                    yield done
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            done = parser.feed(pending)
+            if done is not None:
+                yield done
+        last = parser.finish()
+        if last is not None:
+            yield last
+
+    def parse_diff(self, target: DiffTarget, diff: Diff) -> list[FilePatch]:
+        """Patches of ``diff``, which must be ``target``'s."""
+        # Keyed on the target: keying on the text would keep a second copy
+        # of it alive, uncounted, and rehash every rebuilt live diff.
+        key = target.key + ("parsed",)
+        files = self.cache.get(key)
+        if files is MISSING:
+            files = parse_patch(diff.diff)
+            self.cache.put(key, files, patches_size(files))
+        return cast(list[FilePatch], files)
+
+    async def _read_worktree(self, path: str) -> bytes | None:
+        file_path = (self.git_root / path).resolve()
+        if not file_path.is_relative_to(self.git_root.resolve()):
+            return None
+        try:
+            return await asyncio.to_thread(file_path.read_bytes)
+        except OSError:
+            return None
+
+    async def _blob_source(self, oid: str, path: str) -> tuple[str, bytes] | None:
+        """Full SHA and contents of one side of a patch."""
+        if not oid or not oid.strip("0"):
+            return None
+        found = await self.objects.read(oid)
+        if found is not None:
+            info, data = found
+            return (info.sha, data) if info.type == "blob" else None
+        # Worktree contents are hashed by git diff but never written to the
+        # object database, so read them from disk if they still match.
+        data = await self._read_worktree(path)
+        if data is None:
+            return None
+        sha = object_hash(data)
+        return (sha, data) if sha.startswith(oid) else None
+
+    async def _highlight_blob(self, oid: str, path: str) -> LineSpans | None:
+        lang = language_for(path)
+        if lang is None:
+            return None
+        source = await self._blob_source(oid, path)
+        if source is None:
+            return None
+        sha, data = source
+
+        async def compute() -> LineSpans | None:
+            return await self.highlighter.highlight(lang, data)
+
+        # Blobs never change, so a file is only tokenized again once evicted.
+        return await self._cached(("highlight", sha, lang), compute)
+
+    async def get_line_index(
+        self, path: str, oid: str | None = None, rev: str | None = None
+    ) -> tuple[str, LineIndex] | None:
+        """A file at a blob, at a revision, or in the worktree, indexed by line."""
+        if oid is not None:
+            source = await self._blob_source(oid, path)
+        elif rev is not None:
+            found = await self.objects.read(f"{rev}:{path}")
+            source = (
+                (found[0].sha, found[1])
+                if found is not None and found[0].type == "blob"
+                else None
+            )
+        else:
+            data = await self._read_worktree(path)
+            source = (object_hash(data), data) if data is not None else None
+        if source is None:
+            return None
+        sha, data = source
+
+        async def compute() -> LineIndex:
+            return await asyncio.to_thread(LineIndex.build, data)
+
+        return sha, await self._cached(("line-index", sha), compute)
+
+    async def enclosing_definition(
+        self, path: str, index: LineIndex, start: int, end: int
+    ) -> tuple[int, int] | None:
+        lang = language_for(path)
+        if lang is None:
+            return None
+        return await self.highlighter.enclosing_definition(lang, index.data, start, end)
+
+    async def highlight_patch(
+        self, patch: FilePatch
+    ) -> tuple[LineSpans | None, LineSpans | None]:
+        """Token spans for every line of the old and new side of a patch."""
+        if patch.binary or not patch.hunks:
+            return None, None
+        old, new = await asyncio.gather(
+            self._highlight_blob(patch.old_oid, patch.old_path),
+            self._highlight_blob(patch.new_oid, patch.new_path),
         )
-        diff_stdout, _ = await diff_proc.communicate()
-
-        is_current = branch == await self.get_current_branch()
-        _log_cmd(["git", "diff", f"{base}...{branch}", "--name-only"])
-        files_proc = await asyncio.create_subprocess_exec(
-            "git",
-            "diff",
-            f"{base}...{branch}",
-            "--name-only",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+        return old, new
+
+    async def get_comments(
+        self, target: DiffTarget, scope: str, paths: list[str] | None = None
+    ) -> list[Comment]:
+        """Comments of ``scope``, on the lines ``target``'s diff shows them.
+
+        Comments written on another version of their file are moved through
+        the line map between the two versions. Moves are stored, so only
+        comments on files that changed since they were last listed cost a
+        diff, and only files that have comments are looked at.
+        """
+        stored = await asyncio.to_thread(
+            self.comments.find, str(self.git_root), scope, paths
         )
-        files_stdout, _ = await files_proc.communicate()
-        files = set()
-        for f in files_stdout.decode().strip().split("\n"):
-            if f:
-                files.add(f)
-        if is_current:
-            _log_cmd(["git", "diff", "HEAD", "--name-only"])
-            head_proc = await asyncio.create_subprocess_exec(
-                "git",
-                "diff",
-                "HEAD",
-                "--name-only",
-                cwd=self.git_root,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
+        if not stored:
+            return []
+        stats = {stat.path: stat for stat in await self.get_diff_summary(target)}
+        by_side: dict[tuple[str, DiffSide], list[StoredComment]] = {}
+        for comment in stored:
+            if comment.path in stats:
+                by_side.setdefault((comment.path, comment.side), []).append(comment)
+
+        async def place(
+            path: str, side: DiffSide, comments: list[StoredComment]
+        ) -> dict[str, Anchor]:
+            version = await self._file_version(stats[path], side)
+            if version is None:
+                return {}
+            return await self._anchor_comments(comments, *version)
+
+        anchors: dict[str, Anchor] = {}
+        for placed in await asyncio.gather(
+            *(place(path, side, group) for (path, side), group in by_side.items())
+        ):
+            anchors.update(placed)
+        return [to_comment(comment, anchors.get(comment.id)) for comment in stored]
+
+    async def _anchor_comments(
+        self, comments: list[StoredComment], sha: str, data: bytes | None
+    ) -> dict[str, Anchor]:
+        """Place comments on one side of one file in version ``sha``."""
+        unanchored = [comment.id for comment in comments if not comment.blob]
+        if unanchored:
+            # Written before the file was in a diff; pin them to this version.
+            await asyncio.to_thread(self.comments.adopt, unanchored, sha, data)
+            for comment in comments:
+                comment.blob = comment.blob or sha
+        anchors = {
+            comment.id: Anchor(comment.start_line, comment.end_line)
+            for comment in comments
+            if comment.blob == sha
+        }
+        moved = [comment for comment in comments if comment.blob != sha]
+        if not moved:
+            return anchors
+        known = await asyncio.to_thread(
+            self.comments.anchors, sha, [comment.id for comment in moved]
+        )
+        fresh = {}
+        for comment in moved:
+            if comment.id in known:
+                continue
+            line_map = await self._line_map(comment.blob, sha, data)
+            fresh[comment.id] = (
+                line_map.anchor(comment.start_line, comment.end_line)
+                if line_map is not None
+                else Anchor(comment.start_line, comment.end_line, outdated=True)
             )
-            head_stdout, _ = await head_proc.communicate()
-            for f in head_stdout.decode().strip().split("\n"):
-                if f:
-                    files.add(f)
-        return Diff(diff=diff_stdout.decode(), files=sorted(files))
+        if fresh:
+            await asyncio.to_thread(self.comments.save_anchors, sha, fresh)
+        return anchors | known | fresh
+
+    async def _line_map(
+        self, old_sha: str, new_sha: str, new_data: bytes | None
+    ) -> LineMap | None:
+        async def compute() -> LineMap | None:
+            old = await self._version_data(old_sha)
+            new = (
+                new_data if new_data is not None else await self._version_data(new_sha)
+            )
+            if old is None or new is None:
+                return None
+            # Snapshots aren't in the object database, so both versions go
+            # through files; git's diff stays linear where difflib's wasn't.
+            with tempfile.TemporaryDirectory(prefix="towelie-") as directory:
+                paths = (Path(directory) / "old", Path(directory) / "new")
+                await asyncio.to_thread(_write_versions, paths, (old, new))
+                result = await self._git(
+                    "diff",
+                    *DIFF_FORMAT,
+                    "--no-index",
+                    "--text",
+                    "--unified=0",
+                    *map(str, paths),
+                )
+            # --no-index exits with 1 when the files differ.
+            if result.returncode not in (0, 1):
+                return None
+            hunks = [
+                hunk
+                for patch in parse_patch(result.stdout.decode(errors="replace"))
+                for hunk in patch.hunks
+            ]
+            return LineMap.from_hunks(hunks, line_count(old), line_count(new))
+
+        return await self._cached(("line-map", old_sha, new_sha), compute)
+
+    async def _file_version(
+        self, stat: FileStat, side: DiffSide
+    ) -> tuple[str, bytes | None] | None:
+        """Full sha of one side of a changed file, if that side exists.
+
+        A worktree version comes with its contents, since git never stores
+        it; comments anchored to it keep a snapshot.
+        """
+        oid = stat.old_oid if side == DiffSide.OLD else stat.new_oid
+        if oid.strip("0"):
+            info = await self.objects.info(oid)
+            return (info.sha, None) if info is not None else None
+        if side == DiffSide.OLD or stat.status == "D":
+            return None
+        data = await self._read_worktree(stat.new_path)
+        return (object_hash(data), data) if data is not None else None
+
+    async def _version_data(self, sha: str) -> bytes | None:
+        found = await self.objects.read(sha)
+        if found is not None and found[0].type == "blob":
+            return found[1]
+        return await asyncio.to_thread(self.comments.snapshot, sha)
+
+    async def add_comment(
+        self, target: DiffTarget, scope: str, payload: CommentPayload
+    ) -> Comment:
+        """Store a comment, anchored to the file version ``target`` shows."""
+        stats = {stat.path: stat for stat in await self.get_diff_summary(target)}
+        stat = stats.get(payload.path)
+        version = await self._file_version(stat, payload.side) if stat else None
+        blob, snapshot = version or ("", None)
+        stored = await asyncio.to_thread(
+            self.comments.add,
+            str(self.git_root),
+            scope,
+            payload.path,
+            payload.side,
+            payload.start_line,
+            payload.end_line,
+            payload.text,
+            blob,
+            snapshot,
+        )
+        return to_comment(stored)
 
-    async def get_branches(self) -> list[str]:
-        _log_cmd(["git", "branch", "--format=%(refname:short)"])
-        proc = await asyncio.create_subprocess_exec(
-            "git",
-            "branch",
-            "--format=%(refname:short)",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+    async def update_comment(self, comment_id: str, text: str) -> Comment | None:
+        stored = await asyncio.to_thread(
+            self.comments.update, str(self.git_root), comment_id, text
         )
-        stdout, _ = await proc.communicate()
-        return [b for b in stdout.decode().strip().split("\n") if b]
+        return to_comment(stored) if stored is not None else None
 
-    async def get_commits(
-        self,
-        branch: str,
-        base: str,
-    ) -> list[CommitInfo]:
-        is_current = branch == await self.get_current_branch()
-        commits: list[CommitInfo] = [CommitInfo(hash=ALL_CHANGES, label="All changes")]
+    async def remove_comment(self, comment_id: str) -> bool:
+        return await asyncio.to_thread(
+            self.comments.remove, str(self.git_root), comment_id
+        )
+
+    async def clear_comments(self, scope: str) -> int:
+        return await asyncio.to_thread(self.comments.clear, str(self.git_root), scope)
+
+    async def branch_index(self) -> BranchIndex:
+        """The local branches, brought up to date with the refs on disk.
+
+        Only branches whose loose ref changed since the last call are
+        listed again, so this stays cheap in repositories with thousands.
+        """
+        state = await self.repo_state()
+        async with self._branches_lock:
+            epoch = self._epoch()
+            if epoch is not None and epoch == self._branches_epoch:
+                return self._branches
+            # Scanned before listing: a ref moving in between is then seen
+            # as changed next time rather than missed.
+            scan = await asyncio.to_thread(RefScan.of, state.common_dir)
+            names = self._branches.changed(scan)
+            if names is None:
+                result = await self._git(
+                    "for-each-ref", f"--format={REF_FORMAT}", HEADS
+                )
+                self._branches.rebuild(parse_refs(result.stdout), scan)
+            elif names:
+                result = await self._git(
+                    "for-each-ref",
+                    f"--format={REF_FORMAT}",
+                    *(HEADS + name for name in sorted(names)),
+                )
+                self._branches.update(names, parse_refs(result.stdout), scan)
+            self._branches_epoch = epoch
+            return self._branches
+
+    async def get_branch_tips(self) -> list[tuple[str, str]]:
+        index = await self.branch_index()
+        return [(name, index.entries[name].sha) for name in sorted(index.entries)]
+
+    async def get_branches(self) -> list[str]:
+        return sorted((await self.branch_index()).entries)
+
+    async def featured_branches(self, *wanted: str) -> list[str]:
+        """The branches /api/info lists, sorted by name.
+
+        Those of ``wanted`` that exist, then the most recently committed
+        until there are INFO_BRANCHES.
+        """
+        index = await self.branch_index()
+        names = {name for name in wanted if name in index}
+        for entry in index.recent():
+            if len(names) >= INFO_BRANCHES:
+                break
+            names.add(entry.name)
+        return sorted(names)
+
+    def _special_commits(self, is_current: bool) -> list[CommitInfo]:
+        commits = [CommitInfo(hash=ALL_CHANGES, label="All changes")]
         if is_current:
             commits.append(CommitInfo(hash=STAGED, label="Staged changes"))
             commits.append(CommitInfo(hash=UNSTAGED, label="Unstaged changes"))
             commits.append(CommitInfo(hash=UNCOMMITTED, label="Staged + unstaged"))
-        _log_cmd(["git", "log", f"{base}..{branch}", "--pretty=format:%H%x00%s"])
-        proc = await asyncio.create_subprocess_exec(
-            "git",
-            "log",
-            f"{base}..{branch}",
-            "--pretty=format:%H%x00%s",
-            cwd=self.git_root,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        stdout, _ = await proc.communicate()
-        for line in stdout.decode().split("\n"):
-            if not line:
-                continue
-            full_hash, subject = line.split("\x00", 1)
-            short_hash = full_hash[:7]
-            commits.append(CommitInfo(hash=full_hash, label=f"{short_hash} {subject}"))
         return commits
 
-    async def run_checks(self) -> "CheckResult":
+    async def get_commit_page(
+        self,
+        branch: str,
+        base: str,
+        cursor: CommitCursor | None = None,
+        limit: int = COMMIT_PAGE_SIZE,
+    ) -> tuple[list[CommitInfo], CommitCursor | None]:
+        """One page of ``git log base..branch`` and the cursor of the next.
+
+        Without a cursor this is the page ``get_branch_commits`` embeds,
+        pseudo-commits included; a cursor carries its own tip and base.
+        """
+        commits: list[CommitInfo] = []
+        if cursor is None:
+            commits = self._special_commits(branch == await self.get_current_branch())
+            tip, base_sha = await asyncio.gather(
+                self.objects.resolve(branch), self.objects.resolve(base)
+            )
+            if tip is None or base_sha is None:
+                return commits, None
+            cursor = CommitCursor(tip=tip, base=base_sha, offset=0)
+
+        async def compute() -> list[CommitInfo]:
+            result = await self._git(
+                "log",
+                f"--skip={cursor.offset}",
+                f"--max-count={limit + 1}",
+                "--pretty=format:%H%x00%s",
+                cursor.tip,
+                f"^{cursor.base}",
+            )
+            page = []
+            for line in result.stdout.decode().split("\n"):
+                if not line:
+                    continue
+                full_hash, subject = line.split("\x00", 1)
+                page.append(
+                    CommitInfo(hash=full_hash, label=f"{full_hash[:7]} {subject}")
+                )
+            return page
+
+        # Both ends are shas, so a page never changes once computed.
+        key = ("commit-page", cursor.tip, cursor.base, cursor.offset, limit)
+        page = await self._cached(key, compute)
+        next_cursor = None
+        if len(page) > limit:
+            next_cursor = CommitCursor(
+                tip=cursor.tip, base=cursor.base, offset=cursor.offset + limit
+            )
+        return commits + page[:limit], next_cursor
+
+    async def get_branch_commits(
+        self, base: str, names: list[str], limit: int = COMMIT_PAGE_SIZE
+    ) -> list[Branch]:
+        """First page of commits on each of the branches ``names`` not on ``base``.
+
+        Equivalent to calling ``get_commit_page`` for each branch, but a
+        single log walk serves them all, so the number of git processes does
+        not grow with the number of branches. The walk also yields each
+        branch's total for the commit selector.
+        """
+        state = await self.repo_state()
+        current_branch = await self.get_current_branch()
+        index = await self.branch_index()
+        tips = [(name, index.entries[name].sha) for name in names if name in index]
+        base_sha = await self.objects.resolve(base)
+
+        async def compute() -> list[Branch]:
+            revs = "".join(f"{sha}\n" for _, sha in tips if sha)
+            result = await self._git(
+                "log",
+                "--stdin",
+                "--pretty=format:%H%x00%P%x00%ct%x00%s",
+                input=f"^{base}\n{revs}".encode(),
+            )
+            dates: dict[str, int] = {}
+            parents: dict[str, list[str]] = {}
+            labels: dict[str, str] = {}
+            for line in result.stdout.decode().split("\n"):
+                if not line:
+                    continue
+                full_hash, parent_hashes, date, subject = line.split("\x00", 3)
+                dates[full_hash] = int(date)
+                parents[full_hash] = parent_hashes.split()
+                labels[full_hash] = f"{full_hash[:7]} {subject}"
+
+            branches = []
+            for name, sha in tips:
+                reachable = list(_walk_by_date(sha, dates, parents))
+                commits = self._special_commits(name == current_branch)
+                commits.extend(
+                    CommitInfo(hash=commit, label=labels[commit])
+                    for commit in reachable[:limit]
+                )
+                next_cursor = None
+                if len(reachable) > limit and base_sha is not None:
+                    next_cursor = CommitCursor(tip=sha, base=base_sha, offset=limit)
+                branches.append(
+                    Branch(
+                        name=name,
+                        commits=commits,
+                        total_commits=len(reachable),
+                        next_cursor=next_cursor.encode() if next_cursor else None,
+                    )
+                )
+            return branches
+
+        key = (
+            "branch-commits",
+            base,
+            tuple(names),
+            limit,
+            await self._refs_token(state),
+        )
+        return await self._cached(key, compute)
+
+    async def submit_checks(
+        self, paths: list[str]
+    ) -> "CheckJob[HookResult | CheckResult]":
+        """Start a check run over ``paths``, or join the identical one in flight."""
+        state = await self.repo_state()
+        token = (state.index_token(), await self._worktree_token())
+        return self.checks.submit(paths, token)
+
+    async def run_checks(self, paths: list[str]) -> "CheckResult":
+        job = await self.submit_checks(paths)
+        result = CheckResult(status=CheckStatus.PASS)
+        async for event in job.events():
+            if isinstance(event, CheckResult):
+                result = event
+        return result
+
+    async def stream_checks(
+        self, paths: list[str]
+    ) -> AsyncIterator["HookResult | CheckResult"]:
+        """Run the hooks over ``paths``, yielding each hook's result as it lands.
+
+        Passing and skipped hook results are cached per file, keyed on the
+        file's blob hash and the hash of the pre-commit config, so only
+        files without a cached result for every hook are checked again.
+        Hooks that look past the files they're given are cached once for
+        the whole selection instead, keyed on the index and worktree, and
+        when one of those is stale every file is passed again so it sees
+        the same selection. Every hook is still reported, and the overall
+        ``CheckResult`` comes last.
+        """
         if not self.check_command:
             msg = (
                 "No .pre-commit-config.yaml found in repository.\n"
                 "Set up pre-commit hooks to enable checks.\n"
                 "See: https://github.com/j178/prek/"
             )
-            return CheckResult(status=CheckStatus.NO_CHECKS, output=msg)
-        _log_cmd(self.check_command.command)
+            yield CheckResult(status=CheckStatus.NO_CHECKS, output=msg)
+            return
+
+        config = config_hash(self.git_root)
+        blobs, whole = await asyncio.to_thread(
+            lambda: (
+                {path: blob_hash(self.git_root / path) for path in paths},
+                whole_repo_hooks(self.git_root),
+            )
+        )
+        checkable = sorted(path for path, blob in blobs.items() if blob is not None)
+        if not checkable:
+            yield CheckResult(
+                status=CheckStatus.NO_FILES, output="No files to check.\n"
+            )
+            return
+
+        cached: dict[str, dict[str, str]] = {}
+        for path in checkable:
+            statuses = self.cache.get(("check-pass", config, path, blobs[path]))
+            cached[path] = cast(dict, statuses) if statuses is not MISSING else {}
+        selection: dict[str, str] = {}
+        selection_key: tuple = ()
+        if whole:
+            state = await self.repo_state()
+            tree = (state.index_token(), await self._worktree_token())
+            selection_key = ("check-pass-selection", config, tree, tuple(checkable))
+            statuses = self.cache.get(selection_key)
+            if statuses is not MISSING:
+                selection = cast(dict[str, str], statuses)
+
+        hooks = self.cache.get(("check-hooks", config))
+        known = cast(list[str], hooks) if hooks is not MISSING else None
+        if known is None or not selection.keys() >= whole.intersection(known):
+            stale = checkable
+        else:
+            per_file = set(known) - whole
+            stale = [path for path in checkable if not cached[path].keys() >= per_file]
+
+        def merged(name: str, ran: HookResult | None) -> HookResult:
+            if ran is not None and ran.failed:
+                return ran
+            if name in whole:
+                statuses = [selection[name]] if name in selection else []
+            else:
+                statuses = [s[name] for s in cached.values() if name in s]
+            status = PASSED if PASSED in statuses else next(iter(statuses), NO_FILES)
+            return HookResult(
+                name=name,
+                status=status,
+                duration=ran.duration if ran is not None else 0.0,
+                cached=ran is None,
+            )
+
+        if not stale:
+            results = [merged(name, None) for name in known or []]
+            for result in results:
+                yield result
+            yield CheckResult(
+                status=CheckStatus.PASS, output=format_hook_results(results)
+            )
+            return
+
+        parser = HookOutputParser()
+        reported: dict[str, HookResult] = {}
+        raw: list[str] = []
+        returncode = 0
+        error = ""
+        async for chunk in self._stream_check_command(stale):
+            if isinstance(chunk, tuple):
+                returncode, error = chunk
+                ready = parser.finish()
+            else:
+                raw.append(chunk)
+                ready = parser.feed(chunk)
+            for result in ready:
+                if result.running:
+                    yield result
+                    continue
+                if not result.failed and result.name in whole:
+                    selection = {**selection, result.name: result.status}
+                    self.cache.put(selection_key, selection)
+                elif not result.failed:
+                    for path in stale:
+                        cached[path] = {**cached[path], result.name: result.status}
+                        key = ("check-pass", config, path, blobs[path])
+                        self.cache.put(key, cached[path])
+                reported[result.name] = merged(result.name, result)
+                yield reported[result.name]
+
+        status = CheckStatus.FAIL if returncode != 0 else CheckStatus.PASS
+        if not parser.results:
+            # Nothing parseable, e.g. prek is missing; pass its output through.
+            yield CheckResult(status=status, output="".join(raw), error=error)
+            return
+        self.cache.put(("check-hooks", config), [r.name for r in parser.results])
+        yield CheckResult(
+            status=status,
+            output=format_hook_results(list(reported.values())),
+            error=error,
+        )
+
+    async def _stream_check_command(
+        self, paths: list[str]
+    ) -> AsyncIterator[str | tuple[int, str]]:
+        """Yield the check command's stdout as it is written, then its exit
+        code and stderr.
+
+        The command runs in its own process group, which is killed along
+        with every hook it spawned if the consumer stops early.
+        """
+        assert self.check_command is not None
+        command = self.check_command.command
+        start = time.perf_counter()
         if self.check_command.shell:
             proc = await asyncio.create_subprocess_shell(
-                self.check_command.command,
+                f"{command} {shlex.join(paths)}",
                 cwd=self.git_root,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
             )
         else:
             proc = await asyncio.create_subprocess_exec(
-                *self.check_command.command,
+                *shlex.split(command),
+                *paths,
                 cwd=self.git_root,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+        assert proc.stdout is not None and proc.stderr is not None
+        stderr = asyncio.ensure_future(proc.stderr.read())
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        received = 0
+        try:
+            while chunk := await proc.stdout.read(STREAM_CHUNK_SIZE):
+                received += len(chunk)
+                yield decoder.decode(chunk)
+            yield decoder.decode(b"", final=True)
+            await proc.wait()
+            self.runner.metrics.record_command(
+                command, time.perf_counter() - start, received, proc.returncode or 0
             )
-        stdout, stderr = await proc.communicate()
-        output = stdout.decode()
-        error = stderr.decode()
-        if proc.returncode == 0:
-            return CheckResult(status=CheckStatus.PASS, output=output)
-        return CheckResult(status=CheckStatus.FAIL, output=output, error=error)
+            yield proc.returncode or 0, (await stderr).decode()
+        finally:
+            if proc.returncode is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+                self.runner.metrics.record_command(
+                    command, time.perf_counter() - start, received, proc.returncode or 0
+                )
+            stderr.cancel()
 
 
 @dataclass
@@ -349,22 +1445,101 @@ class CheckResult:
     error: str = ""
 
 
+@dataclass
+class ProjectRegistry:
+    """Every repository the server hosts, keyed by the id used in its URLs.
+
+    Projects share one git process limit, one check run at a time, one
+    cache budget, one disk cache, one highlighter pool and one inotify
+    instance, so each extra worktree costs little more than its own cat-file
+    workers. The first one added is the default.
+    """
+
+    cache: ResultCache = field(default_factory=ResultCache)
+    runner: GitExecutor = field(default_factory=lambda: GitExecutor(metrics=METRICS))
+    highlighter: Highlighter = field(default_factory=Highlighter)
+    watch_hub: WatchHub = field(default_factory=WatchHub)
+    disk: DiskCache | None = None
+    comments: CommentStore = field(default_factory=CommentStore)
+    check_slots: asyncio.Semaphore = field(default_factory=asyncio.Semaphore)
+    projects: dict[str, Project] = field(default_factory=dict)
+
+    def add(self, git_root: Path) -> Project:
+        for project in self.projects.values():
+            if project.git_root == git_root:
+                return project
+        repo_id = repo_slug(git_root, set(self.projects))
+        project = Project(
+            git_root=git_root,
+            cache=self.cache.scoped(repo_id),
+            runner=self.runner,
+            highlighter=self.highlighter,
+            watch_hub=self.watch_hub,
+            disk=self.disk,
+            comments=self.comments,
+            check_slots=self.check_slots,
+        )
+        self.projects[repo_id] = project
+        return project
+
+    def get(self, repo_id: str) -> Project | None:
+        return self.projects.get(repo_id)
+
+    def id_of(self, project: Project) -> str:
+        return next(key for key, value in self.projects.items() if value is project)
+
+    @property
+    def default(self) -> Project:
+        return next(iter(self.projects.values()))
+
+    async def close(self) -> None:
+        await asyncio.gather(*(project.close() for project in self.projects.values()))
+        self.comments.close()
+        self.highlighter.close()
+        self.watch_hub.close()
+
+
+# The project addressed by the request's /r/<id> prefix; None for the default.
+current_project: ContextVar[Project | None] = ContextVar(
+    "current_project", default=None
+)
+
+
 @dataclass
 class AppContext:
-    project: Project
+    projects: ProjectRegistry
     options_store: OptionsStore
 
+    @property
+    def project(self) -> Project:
+        """The project the current request is for."""
+        return current_project.get() or self.projects.default
+
+
+REPO_PREFIX = "/r/"
+
+
+def configured_roots() -> list[Path]:
+    """Roots passed by the CLI; empty means serve the working directory's."""
+    value = os.environ.get(REPOS_ENV, "")
+    return [Path(root) for root in value.split(os.pathsep) if root]
+
 
 async def get_git_root() -> Path:
-    _log_cmd(["git", "rev-parse", "--show-toplevel"])
+    root = find_git_root(Path.cwd())
+    if root is not None:
+        return root
+    cmd = ["git", "rev-parse", "--show-toplevel"]
+    start = time.perf_counter()
     proc = await asyncio.create_subprocess_exec(
-        "git",
-        "rev-parse",
-        "--show-toplevel",
+        *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE,
     )
     stdout, _ = await proc.communicate()
+    METRICS.record_command(
+        cmd, time.perf_counter() - start, len(stdout), proc.returncode or 0
+    )
     if proc.returncode != 0:
         print("Error: not a git repository", file=sys.stderr)
         sys.exit(1)
@@ -379,27 +1554,105 @@ def _asset_version(file_name: str) -> int:
         return 0
 
 
+@cache
+def page_templates() -> "Jinja2Templates":
+    # Jinja is only needed once a page is requested, not to start serving.
+    from fastapi.templating import Jinja2Templates
+
+    return Jinja2Templates(directory=Path(__file__).parent / "templates")
+
+
 APP_CONTEXT: AppContext
 
 
+async def warm_up(project: Project) -> None:
+    """Start watching and prefetch the first page's data while the browser
+    opens; requests arriving meanwhile join the git commands already running."""
+    with startup.phase("start watcher"):
+        await project.start_watching()
+    with startup.phase("prefetch info and diff summary"):
+        await project.prefetch()
+    startup.report()
+
+
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     global APP_CONTEXT
-    project = Project(git_root=await get_git_root())
-    APP_CONTEXT = AppContext(
-        project=project,
-        options_store=OptionsStore(),
-    )
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    registry = ProjectRegistry(disk=DiskCache(Path(cache_dir) if cache_dir else None))
+    with startup.phase("find repositories"):
+        for root in configured_roots() or [await get_git_root()]:
+            registry.add(root)
+    APP_CONTEXT = AppContext(projects=registry, options_store=OptionsStore())
+    warming = asyncio.create_task(warm_up(registry.default))
     yield
+    warming.cancel()
+    await registry.close()
+
+
+class RepoRouting:
+    """Serves each hosted repository under ``/r/<id>/``.
+
+    The prefix becomes the request's root path, so routes match as if the
+    app were mounted there, and the project it names is made current for
+    the request. Unprefixed URLs address the default repository.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(REPO_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        repo_id, slash, _ = scope["path"][len(REPO_PREFIX) :].partition("/")
+        project = APP_CONTEXT.projects.get(repo_id)
+        if project is None:
+            response = Response("Unknown repository", status_code=404)
+            await response(scope, receive, send)
+            return
+        if not slash:
+            await RedirectResponse(scope["path"] + "/")(scope, receive, send)
+            return
+        root_path = scope.get("root_path", "") + REPO_PREFIX + repo_id
+        token = current_project.set(project)
+        try:
+            await self.app({**scope, "root_path": root_path}, receive, send)
+        finally:
+            current_project.reset(token)
 
 
 app = FastAPI(lifespan=lifespan)
-templates = Jinja2Templates(directory=Path(__file__).parent / "templates")
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=5)
 app.mount(
     "/static", StaticFiles(directory=Path(__file__).parent / "static"), name="static"
 )
 
 
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    # Subprocesses started while handling the request are charged to it. For
+    # streamed responses only those run before the headers go out are listed.
+    timings = begin_timings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    route = getattr(request.scope.get("route"), "path", None)
+    METRICS.record_request(route or "(unrouted)", elapsed, response.status_code >= 500)
+    header = f"app;dur={elapsed * 1000:.1f}"
+    if timings.commands:
+        header = f"{header}, {timings.server_timing()}"
+    response.headers["Server-Timing"] = header
+    return response
+
+
+@app.middleware("http")
+async def prioritize_newer_requests(request: Request, call_next):
+    # Git commands queued for this request start before older requests' ones.
+    begin_request()
+    return await call_next(request)
+
+
 @app.middleware("http")
 async def dev_no_store_cache(request: Request, call_next):
     response = await call_next(request)
@@ -413,27 +1666,225 @@ async def dev_no_store_cache(request: Request, call_next):
     return response
 
 
+# Added last so it runs first: everything inside sees the rewritten scope.
+app.add_middleware(RepoRouting)
+
+
 def parse_check_output(raw: CheckResult) -> list[ParsedCheck]:
     if raw.status == CheckStatus.NO_CHECKS:
         return []
 
-    results: list[ParsedCheck] = []
-    for line in raw.output.splitlines():
-        line = line.strip()
-        if not line or "." not in line:
-            continue
+    return [
+        ParsedCheck(name=result.name, passed="pass" in result.status.lower())
+        for result in parse_hook_results(raw.output)
+    ]
+
+
+def hunk_tokens(
+    hunk: Hunk, lines: list[str], old: LineSpans | None, new: LineSpans | None
+) -> list[list[Span]]:
+    """Pick each diff line's spans from the side of the file it belongs to."""
+
+    def at(spans: LineSpans | None, number: int) -> list[Span]:
+        if spans is None or not 0 < number <= len(spans):
+            return []
+        return spans[number - 1]
+
+    old_number, new_number = hunk.old_start, hunk.new_start
+    tokens = []
+    for line in lines:
+        marker = line[:1]
+        if marker == "-":
+            tokens.append(at(old, old_number))
+            old_number += 1
+        elif marker == "+":
+            tokens.append(at(new, new_number))
+            new_number += 1
+        elif marker == " ":
+            tokens.append(at(new, new_number) or at(old, old_number))
+            old_number += 1
+            new_number += 1
+        else:
+            tokens.append([])
+    return tokens
+
+
+def to_diff_file(
+    patch: FilePatch,
+    highlights: tuple[LineSpans | None, LineSpans | None] = (None, None),
+    collapsed: CollapseReason | None = None,
+) -> DiffFile:
+    old, new = highlights
+    hunks = []
+    for hunk in patch.hunks if collapsed is None else []:
+        header, *lines = iter_lines(patch.hunk_text(hunk))
+        lines = [line.rstrip("\n") for line in lines]
+        hunks.append(
+            DiffHunk(
+                old_start=hunk.old_start,
+                old_lines=hunk.old_lines,
+                new_start=hunk.new_start,
+                new_lines=hunk.new_lines,
+                header=header.rstrip("\n"),
+                lines=lines,
+                tokens=(
+                    hunk_tokens(hunk, lines, old, new)
+                    if old is not None or new is not None
+                    else None
+                ),
+            )
+        )
+    return DiffFile(
+        old_path=patch.old_path,
+        new_path=patch.new_path,
+        status=FileStatus(patch.status),
+        binary=patch.binary,
+        additions=patch.additions,
+        deletions=patch.deletions,
+        old_oid=patch.old_oid,
+        new_oid=patch.new_oid,
+        hunks=hunks,
+        collapsed=collapsed,
+    )
+
+
+async def to_diff_files(
+    patches: list[FilePatch],
+    highlight: bool,
+    collapsed: dict[str, CollapseReason] | None = None,
+) -> list[DiffFile]:
+    """Structured files; those in ``collapsed`` keep their stats but no hunks."""
+    collapsed = collapsed or {}
+    if not highlight:
+        return [to_diff_file(p, collapsed=collapsed.get(p.path)) for p in patches]
+
+    async def convert(patch: FilePatch) -> DiffFile:
+        reason = collapsed.get(patch.path)
+        if reason is not None:
+            return to_diff_file(patch, collapsed=reason)
+        return to_diff_file(patch, await APP_CONTEXT.project.highlight_patch(patch))
+
+    return list(await asyncio.gather(*(convert(patch) for patch in patches)))
+
+
+def collapsed_file(stat: FileStat, reason: CollapseReason) -> DiffFile:
+    """A file's stats, standing in for a patch that was left out."""
+    return DiffFile(
+        old_path=stat.old_path,
+        new_path=stat.new_path,
+        status=FileStatus(stat.status),
+        binary=stat.binary,
+        additions=stat.additions,
+        deletions=stat.deletions,
+        old_oid=stat.old_oid,
+        new_oid=stat.new_oid,
+        hunks=[],
+        collapsed=reason,
+    )
+
+
+def to_comment(comment: StoredComment, anchor: Anchor | None = None) -> Comment:
+    """The API view of a comment, on ``anchor``'s lines if it was moved."""
+    anchor = anchor or Anchor(comment.start_line, comment.end_line)
+    return Comment(
+        id=comment.id,
+        path=comment.path,
+        side=comment.side,
+        start_line=anchor.start_line,
+        end_line=anchor.end_line,
+        text=comment.text,
+        created_at=comment.created_at,
+        updated_at=comment.updated_at,
+        outdated=anchor.outdated,
+    )
+
+
+def diff_file_path(file: DiffFile) -> str:
+    return file.old_path if file.status == FileStatus.DELETED else file.new_path
+
+
+def collapse_rules() -> CollapseRules:
+    return CollapseRules.from_options(APP_CONTEXT.options_store.load().diff)
+
+
+def make_etag(*parts: object) -> str:
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=16, salt=_ETAG_SALT)
+    return f'"{digest.hexdigest()}"'
 
-        name = line.split(".")[0].strip()
-        status_part = line.split(".")[-1].strip()
-        if name:
-            results.append(ParsedCheck(name=name, passed="pass" in status_part.lower()))
 
-    return results
+def check_etag(request: Request, response: Response, *parts: object) -> bool:
+    """Tag the response with an ETag of ``parts``; True if the client has it.
+
+    The parts are the state tokens a response is cached under, so the check
+    costs a few stats and never runs git.
+    """
+    etag = make_etag(*parts)
+    response.headers["ETag"] = etag
+    # Let the browser keep the body but revalidate it on every use.
+    response.headers["Cache-Control"] = "no-cache"
+    header = request.headers.get("if-none-match", "")
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in tags or "*" in tags
+
+
+def not_modified(response: Response) -> Response:
+    return Response(status_code=304, headers=dict(response.headers))
+
+
+class ModelResponse(Response):
+    """JSON body written by pydantic-core straight from a response model.
+
+    FastAPI's default path dumps the model to dicts and runs them through
+    ``json.dumps``, copying a large patch twice more on the way. The models
+    are validated when they are built, so this sends the same document.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: BaseModel) -> bytes:
+        return content.__pydantic_serializer__.to_json(content)
+
+
+def model_response(model: BaseModel, response: Response) -> ModelResponse:
+    """Send ``model`` with the headers set on the endpoint's ``response``."""
+    return ModelResponse(model, headers=dict(response.headers))
+
+
+def server_root(request: Request) -> str:
+    """Root path of the server itself, without the request's /r/<id> prefix."""
+    repo_id = APP_CONTEXT.projects.id_of(APP_CONTEXT.project)
+    return request.scope.get("root_path", "").removesuffix(REPO_PREFIX + repo_id)
+
+
+def repo_entries(root_path: str) -> list[RepoEntry]:
+    registry = APP_CONTEXT.projects
+    return [
+        RepoEntry(
+            id=repo_id,
+            name=project.git_root.name,
+            path=str(project.git_root),
+            url=f"{root_path}{REPO_PREFIX}{repo_id}/",
+            default=project is registry.default,
+        )
+        for repo_id, project in registry.projects.items()
+    ]
 
 
 def build_page_context(request: Request) -> dict:
+    project = APP_CONTEXT.project
+    registry = APP_CONTEXT.projects
+    repo_id = registry.id_of(project)
     view = {
-        "project_name": APP_CONTEXT.project.git_root.name,
+        "project_name": project.git_root.name,
+        "repo_id": repo_id,
+        # Links and API calls are relative, so they stay within this repo's
+        # prefix.
+        "base_href": request.scope.get("root_path", "") + "/",
+        # The default repo keeps the comment storage key it always had.
+        "comment_scope": "" if project is registry.default else repo_id,
+        "repos": (
+            repo_entries(server_root(request)) if len(registry.projects) > 1 else []
+        ),
         "js_version": str(_asset_version("main.js")),
         "css_version": str(_asset_version("output.css")),
     }
@@ -446,28 +1897,96 @@ def build_page_context(request: Request) -> dict:
 
 @app.get("/")
 async def index_page(request: Request):
-    return templates.TemplateResponse("index.html", build_page_context(request))
+    return page_templates().TemplateResponse("index.html", build_page_context(request))
 
 
 @app.get("/options")
 async def options_page(request: Request):
-    return templates.TemplateResponse("options.html", build_page_context(request))
+    return page_templates().TemplateResponse(
+        "options.html", build_page_context(request)
+    )
 
 
 @app.get("/api/info", response_model=ProjectInfoResponse)
-async def get_info():
-    base = str(await APP_CONTEXT.project.get_base_branch())
-    branches = []
-    for branch in await APP_CONTEXT.project.get_branches():
-        commits = await APP_CONTEXT.project.get_commits(branch, base)
-        branches.append(Branch(name=branch, commits=commits))
-
-    return ProjectInfoResponse(
-        project_name=APP_CONTEXT.project.git_root.name,
-        current_branch=await APP_CONTEXT.project.get_current_branch(),
+async def get_info(request: Request, response: Response, branch: str | None = None):
+    """The branches to offer and the first page of each one's commits.
+
+    Repositories can have thousands of branches, so only the current, the
+    base and ``branch`` are listed with the most recent others.
+    """
+    project = APP_CONTEXT.project
+    if check_etag(request, response, await project.info_token(), branch):
+        return not_modified(response)
+    base, current_branch = await asyncio.gather(
+        project.get_base_branch(),
+        project.get_current_branch(),
+    )
+    names = await project.featured_branches(current_branch, base, branch or "")
+    branches = await project.get_branch_commits(base, names)
+
+    info = ProjectInfoResponse(
+        project_name=project.git_root.name,
+        current_branch=current_branch,
         base_branch=base,
         branches=branches,
+        total_branches=len(await project.branch_index()),
     )
+    return model_response(info, response)
+
+
+@app.get("/api/branches", response_model=BranchSearchResponse)
+async def search_branches(
+    q: str = "",
+    limit: int = Query(BRANCH_SEARCH_LIMIT, ge=1, le=MAX_BRANCH_SEARCH_LIMIT),
+) -> Response:
+    """Local branches matching ``q``, best matches first, for the branch picker."""
+    index = await APP_CONTEXT.project.branch_index()
+    matches, total = index.search(q, limit)
+    found = BranchSearchResponse(
+        branches=[
+            BranchMatch(name=entry.name, committed=entry.committed) for entry in matches
+        ],
+        total=total,
+    )
+    return ModelResponse(found)
+
+
+@app.get("/api/commits", response_model=CommitPageResponse)
+async def get_commits(
+    branch: str | None = None,
+    base: str | None = None,
+    cursor: str | None = None,
+    limit: int = Query(COMMIT_PAGE_SIZE, ge=1, le=MAX_COMMIT_PAGE_SIZE),
+) -> Response:
+    """A page of the commits on ``branch`` but not ``base``, newest first.
+
+    /api/info embeds the first page of every branch; pass a ``next_cursor``
+    from there or from an earlier page to continue.
+    """
+    position = None
+    if cursor is not None:
+        try:
+            position = CommitCursor.decode(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor") from None
+    project = APP_CONTEXT.project
+    commits, next_position = await project.get_commit_page(
+        branch or await project.get_current_branch(),
+        base or await project.get_base_branch(),
+        position,
+        limit,
+    )
+    page = CommitPageResponse(
+        commits=commits,
+        next_cursor=next_position.encode() if next_position else None,
+    )
+    return ModelResponse(page)
+
+
+@app.get("/api/repos", response_model=ReposResponse)
+async def get_repos(request: Request) -> Response:
+    """The repositories and worktrees this server hosts."""
+    return ModelResponse(ReposResponse(repos=repo_entries(server_root(request))))
 
 
 @app.get("/api/options")
@@ -479,17 +1998,21 @@ async def get_options() -> AppOptions:
 async def update_options(payload: AppOptionsPayload) -> AppOptions:
     options = AppOptions(
         prompt=PromptOptions(template=payload.prompt.template),
-        diff=DiffOptions(style=payload.diff.style),
+        diff=DiffOptions(
+            style=payload.diff.style,
+            collapse_globs=[
+                g.strip() for g in payload.diff.collapse_globs if g.strip()
+            ],
+            max_file_bytes=payload.diff.max_file_bytes,
+            max_changed_lines=payload.diff.max_changed_lines,
+        ),
     )
     return APP_CONTEXT.options_store.save(options)
 
 
-@app.get("/api/diff")
-async def diff(
-    branch: str | None = None,
-    base: str | None = None,
-    commit: str | None = None,
-) -> DiffResponse:
+async def resolve_selection(
+    branch: str | None, base: str | None, commit: str | None
+) -> tuple[str, str]:
     current_branch = await APP_CONTEXT.project.get_current_branch()
     effective_branch = branch or current_branch
     effective_base = base or await APP_CONTEXT.project.get_base_branch()
@@ -500,29 +2023,381 @@ async def diff(
             status_code=400,
             detail="Staged/unstaged/uncommitted filters are only available for the current branch",
         )
-    elif commit == UNCOMMITTED:
-        result = await APP_CONTEXT.project.get_uncommitted_diff()
-    elif commit == STAGED:
-        result = await APP_CONTEXT.project.get_staged_diff()
-    elif commit == UNSTAGED:
-        result = await APP_CONTEXT.project.get_unstaged_diff()
-    elif not commit or commit == ALL_CHANGES:
-        result = await APP_CONTEXT.project.get_branch_diff(
-            effective_branch, effective_base
+    return effective_branch, effective_base
+
+
+@app.get("/api/diff", response_model=DiffResponse | StructuredDiffResponse)
+async def diff(
+    request: Request,
+    response: Response,
+    branch: str | None = None,
+    base: str | None = None,
+    commit: str | None = None,
+    format: DiffFormat = DiffFormat.RAW,
+    highlight: bool = False,
+    full: bool = False,
+) -> DiffResponse | StructuredDiffResponse | Response:
+    """The whole diff. Generated, oversized and binary files only get their
+    stats unless ``full`` is set; see ``CollapseRules``."""
+    effective_branch, effective_base = await resolve_selection(branch, base, commit)
+    project = APP_CONTEXT.project
+    target = await project.get_diff_target(effective_branch, effective_base, commit)
+    rules = None if full else collapse_rules()
+    if check_etag(request, response, target.key, format, highlight, rules):
+        return not_modified(response)
+
+    result = await project.get_diff(target)
+    collapsed: dict[str, CollapseReason] = {}
+    if rules is not None:
+        # Stats come from the patch itself: a second, full-tree numstat diff
+        # would undo the live diff's per-file re-diffing.
+        stats = patch_stats(project.parse_diff(target, result), worktree=target.live)
+        collapsed = await project.get_collapsed(target, rules, stats)
+    if format == DiffFormat.STRUCTURED:
+        files = project.parse_diff(target, result)
+        structured = StructuredDiffResponse(
+            diff=StructuredDiff(files=await to_diff_files(files, highlight, collapsed))
         )
-    else:
-        result = await APP_CONTEXT.project.get_commit_diff(commit)
+        return model_response(structured, response)
 
-    response = DiffResponse(diff=result)
-    return response
+    if collapsed:
+        shown = [
+            p for p in project.parse_diff(target, result) if p.path not in collapsed
+        ]
+        result = Diff(diff="".join(p.text for p in shown), files=result.files)
+    return model_response(DiffResponse(diff=result, collapsed=collapsed), response)
 
 
-@app.get("/api/checks")
-async def checks() -> ChecksResponse:
-    results = await APP_CONTEXT.project.run_checks()
-    response = ChecksResponse(
-        status=results.status,
-        checks=parse_check_output(results),
-        error=results.error,
+@app.get("/api/diff/summary", response_model=DiffSummaryResponse)
+async def diff_summary(
+    request: Request,
+    response: Response,
+    branch: str | None = None,
+    base: str | None = None,
+    commit: str | None = None,
+) -> DiffSummaryResponse | Response:
+    effective_branch, effective_base = await resolve_selection(branch, base, commit)
+    target = await APP_CONTEXT.project.get_diff_target(
+        effective_branch, effective_base, commit
     )
-    return response
+    rules = collapse_rules()
+    if check_etag(request, response, target.key, "summary", rules):
+        return not_modified(response)
+    stats = await APP_CONTEXT.project.get_diff_summary(target)
+    collapsed = await APP_CONTEXT.project.get_collapsed(target, rules)
+    summary = DiffSummaryResponse(
+        files=[
+            DiffFileSummary(
+                old_path=stat.old_path,
+                new_path=stat.new_path,
+                status=FileStatus(stat.status),
+                binary=stat.binary,
+                additions=stat.additions,
+                deletions=stat.deletions,
+                collapsed=collapsed.get(stat.path),
+            )
+            for stat in stats
+        ]
+    )
+    return model_response(summary, response)
+
+
+@app.get("/api/diff/stream")
+async def diff_stream(
+    branch: str | None = None,
+    base: str | None = None,
+    commit: str | None = None,
+    highlight: bool = False,
+    full: bool = False,
+) -> StreamingResponse:
+    """Structured diff as NDJSON, one file per line, without buffering the patch.
+
+    Collapsed files come without hunks unless ``full`` is set.
+    """
+    effective_branch, effective_base = await resolve_selection(branch, base, commit)
+    project = APP_CONTEXT.project
+    target = await project.get_diff_target(effective_branch, effective_base, commit)
+    collapsed = {} if full else await project.get_collapsed(target, collapse_rules())
+
+    async def records() -> AsyncIterator[str]:
+        async for patch in project.stream_file_patches(target):
+            [file] = await to_diff_files([patch], highlight, collapsed)
+            yield file.model_dump_json() + "\n"
+
+    return StreamingResponse(
+        records(), media_type="application/x-ndjson", headers=STREAM_HEADERS
+    )
+
+
+@app.get("/api/file/lines")
+async def file_lines(
+    path: str,
+    start: int = Query(ge=1),
+    end: int = Query(ge=1),
+    oid: str | None = None,
+    rev: str | None = None,
+    snap: bool = False,
+) -> FileLinesResponse:
+    """Lines of a file, to widen a hunk's context without re-diffing.
+
+    The file is read at blob ``oid`` (as printed in a patch's index line),
+    at revision ``rev``, or from the worktree. With ``snap`` the range grows
+    to cover the enclosing function or class when a grammar is installed.
+    """
+    project = APP_CONTEXT.project
+    found = await project.get_line_index(path, oid=oid, rev=rev)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"{path} not found")
+    sha, index = found
+    if snap:
+        span = await project.enclosing_definition(path, index, start, end)
+        if span is not None:
+            start, end = min(start, span[0]), max(end, span[1])
+    end = min(end, index.line_count)
+    return FileLinesResponse(
+        path=path,
+        oid=sha,
+        start=start,
+        end=end,
+        total_lines=index.line_count,
+        lines=index.lines(start, end),
+    )
+
+
+@app.get("/api/events")
+async def events(request: Request) -> StreamingResponse:
+    """Server-sent change events so clients refetch only what changed."""
+    watcher = await APP_CONTEXT.project.start_watching()
+    queue = watcher.subscribe()
+
+    async def stream() -> AsyncIterator[str]:
+        try:
+            yield f"retry: 2000\nevent: hello\ndata: {watcher.generation}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), timeout=EVENTS_HEARTBEAT
+                    )
+                except TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: change\ndata: {json.dumps(event.to_dict())}\n\n"
+        finally:
+            watcher.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers=STREAM_HEADERS,
+    )
+
+
+@app.get("/api/diff/files", response_model=DiffResponse | StructuredDiffResponse)
+async def diff_files(
+    request: Request,
+    response: Response,
+    branch: str | None = None,
+    base: str | None = None,
+    commit: str | None = None,
+    path: list[str] = Query(default=[]),
+    offset: int = Query(default=0, ge=0),
+    limit: int | None = Query(default=None, ge=1),
+    format: DiffFormat = DiffFormat.RAW,
+    highlight: bool = False,
+    full: bool = False,
+) -> DiffResponse | StructuredDiffResponse | Response:
+    """Patches for the requested paths, or for a page of the summary's files.
+
+    Requested paths always get their patch. Pages leave collapsed files out
+    unless ``full`` is set, listing them in ``collapsed`` instead.
+    """
+    effective_branch, effective_base = await resolve_selection(branch, base, commit)
+    project = APP_CONTEXT.project
+    target = await project.get_diff_target(effective_branch, effective_base, commit)
+    paged = not path and limit is not None
+    rules = collapse_rules() if paged and not full else None
+    etag_parts = (target.key, tuple(path), offset, limit, format, highlight, rules)
+    if check_etag(request, response, *etag_parts):
+        return not_modified(response)
+
+    paths = list(path)
+    stubs: list[DiffFile] = []
+    collapsed: dict[str, CollapseReason] = {}
+    if not path and limit is not None:
+        stats = await project.get_diff_summary(target)
+        page = stats[offset : offset + limit]
+        if rules is not None:
+            found = await project.get_collapsed(target, rules)
+            collapsed = {s.path: found[s.path] for s in page if s.path in found}
+        for stat in page:
+            if stat.path in collapsed:
+                stubs.append(collapsed_file(stat, collapsed[stat.path]))
+                continue
+            paths.append(stat.new_path)
+            if stat.old_path != stat.new_path:
+                paths.append(stat.old_path)
+
+    patches = await project.get_file_patches(target, paths)
+    if format == DiffFormat.STRUCTURED:
+        files = await to_diff_files(patches, highlight)
+        if stubs:
+            # Back into git's order, which is byte order of the path.
+            files = sorted(files + stubs, key=lambda f: diff_file_path(f).encode())
+        structured = StructuredDiffResponse(diff=StructuredDiff(files=files))
+        return model_response(structured, response)
+    raw = DiffResponse(
+        diff=Diff(
+            diff="".join(p.text for p in patches),
+            files=[p.path for p in patches],
+        ),
+        collapsed=collapsed,
+    )
+    return model_response(raw, response)
+
+
+def comment_scope(branch: str | None) -> str:
+    """Comments belong to a branch, not to the commit being viewed."""
+    return branch or CURRENT_SCOPE
+
+
+async def comment_target(
+    branch: str | None, base: str | None, commit: str | None
+) -> DiffTarget:
+    effective_branch, effective_base = await resolve_selection(branch, base, commit)
+    return await APP_CONTEXT.project.get_diff_target(
+        effective_branch, effective_base, commit
+    )
+
+
+@app.get("/api/comments", response_model=CommentsResponse)
+async def list_comments(
+    branch: str | None = None,
+    base: str | None = None,
+    commit: str | None = None,
+    path: list[str] = Query(default=[]),
+) -> CommentsResponse:
+    """The selected branch's comments, on the lines the selected diff shows.
+
+    With ``path``, only comments on those files, e.g. the ones just edited.
+    """
+    target = await comment_target(branch, base, commit)
+    comments = await APP_CONTEXT.project.get_comments(
+        target, comment_scope(branch), path or None
+    )
+    return CommentsResponse(comments=comments)
+
+
+@app.post("/api/comments", response_model=Comment)
+async def add_comment(
+    payload: CommentPayload,
+    branch: str | None = None,
+    base: str | None = None,
+    commit: str | None = None,
+) -> Comment:
+    """Comment on lines of the selected diff's version of a file."""
+    target = await comment_target(branch, base, commit)
+    return await APP_CONTEXT.project.add_comment(target, comment_scope(branch), payload)
+
+
+@app.patch("/api/comments/{comment_id}", response_model=Comment)
+async def update_comment(comment_id: str, payload: CommentTextPayload) -> Comment:
+    comment = await APP_CONTEXT.project.update_comment(comment_id, payload.text)
+    if comment is None:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    return comment
+
+
+@app.delete("/api/comments/{comment_id}", status_code=204)
+async def delete_comment(comment_id: str) -> Response:
+    if not await APP_CONTEXT.project.remove_comment(comment_id):
+        raise HTTPException(status_code=404, detail="Comment not found")
+    return Response(status_code=204)
+
+
+@app.delete("/api/comments", status_code=204)
+async def clear_comments(branch: str | None = None) -> Response:
+    await APP_CONTEXT.project.clear_comments(comment_scope(branch))
+    return Response(status_code=204)
+
+
+async def checked_paths(
+    branch: str | None, base: str | None, commit: str | None
+) -> list[str]:
+    """Files of the selected diff that still exist, which is what checks cover."""
+    effective_branch, effective_base = await resolve_selection(branch, base, commit)
+    target = await APP_CONTEXT.project.get_diff_target(
+        effective_branch, effective_base, commit
+    )
+    stats = await APP_CONTEXT.project.get_diff_summary(target)
+    return [stat.new_path for stat in stats if stat.status != FileStatus.DELETED]
+
+
+def to_check_response(result: CheckResult) -> ChecksResponse:
+    return ChecksResponse(
+        status=result.status,
+        checks=parse_check_output(result),
+        error=result.error,
+    )
+
+
+@app.get("/api/checks", response_model=ChecksResponse)
+async def checks(
+    request: Request,
+    branch: str | None = None,
+    base: str | None = None,
+    commit: str | None = None,
+) -> ChecksResponse | Response:
+    """Checks scoped to the files of the selected diff."""
+    paths = await checked_paths(branch, base, commit)
+    run = asyncio.create_task(APP_CONTEXT.project.run_checks(paths))
+    # Plain responses aren't cancelled when the client goes away, so poll;
+    # leaving the run lets it be killed once nobody else is watching it.
+    while not run.done():
+        await asyncio.wait({run}, timeout=DISCONNECT_POLL_INTERVAL)
+        if not run.done() and await request.is_disconnected():
+            run.cancel()
+            return Response(status_code=499)
+    return to_check_response(run.result())
+
+
+@app.get("/api/checks/stream")
+async def checks_stream(
+    request: Request,
+    branch: str | None = None,
+    base: str | None = None,
+    commit: str | None = None,
+) -> StreamingResponse:
+    """Server-sent hook results as each hook finishes, then the full response."""
+    job = await APP_CONTEXT.project.submit_checks(
+        await checked_paths(branch, base, commit)
+    )
+
+    async def stream() -> AsyncIterator[str]:
+        async for event in job.events():
+            if await request.is_disconnected():
+                return
+            if isinstance(event, CheckResult):
+                data = to_check_response(event).model_dump_json()
+                yield f"event: done\ndata: {data}\n\n"
+                continue
+            hook = CheckHookEvent(
+                name=event.name,
+                status=event.status,
+                passed="pass" in event.status.lower(),
+                duration=round(event.duration, 3),
+                cached=event.cached,
+                details="\n".join(event.details),
+            )
+            yield f"event: hook\ndata: {hook.model_dump_json()}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers=STREAM_HEADERS,
+    )
+
+
+@app.get("/api/debug/metrics", response_model=MetricsResponse)
+async def get_metrics() -> Response:
+    """Latency histograms of every git/check command and API route so far."""
+    return ModelResponse(METRICS.snapshot())
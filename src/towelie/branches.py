@@ -0,0 +1,143 @@
+from dataclasses import dataclass, field
+import os
+from pathlib import Path
+
+from towelie.cache import stat_token
+
+HEADS = "refs/heads/"
+# Full refnames, so a branch can't be confused with a tag of the same name.
+REF_FORMAT = "%(refname)%00%(objectname)%00%(committerdate:unix)"
+# Past this many changed branches, listing all of them beats naming each.
+MAX_INCREMENTAL_REFS = 256
+
+Signature = tuple[int, int, int, int]
+
+
+@dataclass(frozen=True)
+class BranchEntry:
+    name: str
+    sha: str
+    # Committer date of the tip, in seconds since the epoch.
+    committed: int
+
+
+def parse_refs(output: bytes) -> list[BranchEntry]:
+    """Parse ``git for-each-ref --format=REF_FORMAT`` output."""
+    entries = []
+    for line in output.decode(errors="replace").splitlines():
+        refname, _, rest = line.partition("\x00")
+        sha, _, date = rest.partition("\x00")
+        if not refname.startswith(HEADS) or not sha:
+            continue
+        entries.append(
+            BranchEntry(
+                name=refname.removeprefix(HEADS),
+                sha=sha,
+                committed=int(date) if date.isdigit() else 0,
+            )
+        )
+    return entries
+
+
+@dataclass(frozen=True)
+class RefScan:
+    """Stat signatures of packed-refs and of every loose branch ref."""
+
+    packed: Signature | None
+    loose: dict[str, Signature] = field(default_factory=dict)
+
+    @classmethod
+    def of(cls, common_dir: Path) -> "RefScan":
+        heads = common_dir / HEADS
+        loose = {}
+        for dirpath, _, filenames in os.walk(heads):
+            for filename in filenames:
+                if filename.endswith(".lock"):
+                    continue
+                path = Path(dirpath) / filename
+                signature = stat_token(path)
+                if signature is not None:
+                    loose[path.relative_to(heads).as_posix()] = signature
+        return cls(packed=stat_token(common_dir / "packed-refs"), loose=loose)
+
+
+class BranchIndex:
+    """Local branches, searchable by prefix and substring, newest first.
+
+    Built once from ``git for-each-ref``. Afterwards each ``RefScan`` is
+    compared with the one the index was last brought up to date with, so
+    only branches whose loose ref changed have to be listed again; a
+    rewritten packed-refs file means a full rebuild.
+    """
+
+    def __init__(self):
+        self.entries: dict[str, BranchEntry] = {}
+        self._scan: RefScan | None = None
+        self._recent: list[tuple[str, BranchEntry]] | None = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def changed(self, scan: RefScan) -> set[str] | None:
+        """Branches to list again to catch up with ``scan``; None to rebuild."""
+        if self._scan is None or scan.packed != self._scan.packed:
+            return None
+        before, after = self._scan.loose, scan.loose
+        names = {
+            name
+            for name in before.keys() | after.keys()
+            if before.get(name) != after.get(name)
+        }
+        return names if len(names) <= MAX_INCREMENTAL_REFS else None
+
+    def rebuild(self, entries: list[BranchEntry], scan: RefScan) -> None:
+        self.entries = {entry.name: entry for entry in entries}
+        self._scan = scan
+        self._recent = None
+
+    def update(
+        self, names: set[str], entries: list[BranchEntry], scan: RefScan
+    ) -> None:
+        """Replace ``names`` with ``entries``; names without one were deleted."""
+        for name in names:
+            self.entries.pop(name, None)
+        for entry in entries:
+            # for-each-ref patterns also match refs below a name, e.g. a/b for a.
+            if entry.name in names:
+                self.entries[entry.name] = entry
+        self._scan = scan
+        if names:
+            self._recent = None
+
+    def recent(self) -> list[BranchEntry]:
+        """Every branch, most recently committed first."""
+        return [entry for _, entry in self._by_recency()]
+
+    def _by_recency(self) -> list[tuple[str, BranchEntry]]:
+        if self._recent is None:
+            ordered = sorted(
+                self.entries.values(), key=lambda entry: (-entry.committed, entry.name)
+            )
+            self._recent = [(entry.name.lower(), entry) for entry in ordered]
+        return self._recent
+
+    def search(self, query: str, limit: int) -> tuple[list[BranchEntry], int]:
+        """Up to ``limit`` branches matching ``query`` and how many match in all.
+
+        Matching ignores case. Names that start with the query, or have a
+        path component that does, rank above other substring matches; each
+        group is ordered newest first. An empty query matches every branch.
+        """
+        needle = query.strip().lower()
+        prefixed: list[BranchEntry] = []
+        contained: list[BranchEntry] = []
+        for name, entry in self._by_recency():
+            if name.startswith(needle) or f"/{needle}" in name:
+                prefixed.append(entry)
+            elif needle in name:
+                contained.append(entry)
+        matches = prefixed + contained
+        return matches[:limit], len(matches)
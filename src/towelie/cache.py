@@ -0,0 +1,250 @@
+from collections import OrderedDict
+from collections.abc import Hashable, Iterable, Iterator
+from dataclasses import dataclass
+import hashlib
+import os
+from pathlib import Path
+import zlib
+
+DEFAULT_CACHE_BUDGET = 64 * 1024 * 1024
+DEFAULT_DISK_CACHE_BUDGET = 512 * 1024 * 1024
+# Overrides where DiskCache keeps its entries, e.g. for benchmarks.
+CACHE_DIR_ENV = "TOWELIE_CACHE_DIR"
+
+MISSING = object()
+
+
+def estimate_size(value: object) -> int:
+    """Rough number of bytes a cached value keeps alive."""
+    if isinstance(value, str):
+        return len(value) + 49
+    if isinstance(value, bytes):
+        return len(value) + 33
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return 56 + sum(estimate_size(item) + 8 for item in value)
+    if isinstance(value, dict):
+        return 64 + sum(
+            estimate_size(k) + estimate_size(v) + 16 for k, v in value.items()
+        )
+    attrs = getattr(value, "__dict__", None)
+    if attrs is not None:
+        return 48 + estimate_size(attrs)
+    # Slotted records, e.g. the parsed patches, have no __dict__.
+    slots = getattr(type(value), "__slots__", ())
+    if slots:
+        names = (slots,) if isinstance(slots, str) else slots
+        return 32 + sum(estimate_size(getattr(value, name, None)) + 8 for name in names)
+    return 32
+
+
+class ResultCache:
+    """LRU cache of query results, evicted once the byte budget is exceeded."""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BUDGET):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[Hashable, tuple[object, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> object:
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Hashable, value: object, size: int | None = None) -> None:
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        self.discard(key)
+        self._entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= evicted
+
+    def discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    def scoped(self, scope: Hashable) -> "ScopedCache":
+        return ScopedCache(self, scope)
+
+
+class ScopedCache:
+    """View of a ResultCache whose keys are private to one scope.
+
+    Projects served from one process each get a view, so they compete for
+    a single byte budget without being able to see each other's entries.
+    """
+
+    def __init__(self, cache: ResultCache, scope: Hashable):
+        self.cache = cache
+        self.scope = scope
+
+    def get(self, key: Hashable) -> object:
+        return self.cache.get((self.scope, key))
+
+    def put(self, key: Hashable, value: object, size: int | None = None) -> None:
+        self.cache.put((self.scope, key), value, size)
+
+    def discard(self, key: Hashable) -> None:
+        self.cache.discard((self.scope, key))
+
+
+class DiskCache:
+    """Content-addressed store of immutable results under ``~/.towelie/cache``.
+
+    Entries are files named by a hash of their key and compressed with zlib.
+    Each is written to a temporary file and renamed into place, so readers,
+    including other towelie processes, never see a partial one. Reading an
+    entry bumps its mtime; once the directory outgrows ``max_bytes`` the
+    least recently used entries are removed until a quarter is free again.
+
+    Only hand it values that can never change for their key. All methods
+    block on disk and belong in a worker thread.
+    """
+
+    def __init__(
+        self, root: Path | None = None, max_bytes: int = DEFAULT_DISK_CACHE_BUDGET
+    ):
+        self.root = root or Path.home() / ".towelie" / "cache"
+        self.max_bytes = max_bytes
+        # Bytes on disk, counted on the first write; other processes'
+        # writes are only noticed when eviction rescans the directory.
+        self.size: int | None = None
+
+    def path_for(self, key: Hashable) -> Path:
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=20).hexdigest()
+        return self.root / digest[:2] / digest[2:]
+
+    def get(self, key: Hashable) -> bytes | None:
+        path = self.path_for(key)
+        try:
+            data = zlib.decompress(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error):
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: Hashable, value: bytes) -> None:
+        data = zlib.compress(value, 1)
+        if len(data) > self.max_bytes // 4:
+            return
+        path = self.path_for(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            return
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self._entries())
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict(self.max_bytes * 3 // 4)
+
+    def evict(self, target_bytes: int) -> None:
+        """Remove the least recently used entries until ``target_bytes`` remain."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(size for _, size, _ in entries)
+        for path, entry_size, _ in entries:
+            if size <= target_bytes:
+                break
+            path.unlink(missing_ok=True)
+            size -= entry_size
+        self.size = size
+
+    def _entries(self) -> Iterator[tuple[Path, int, float]]:
+        """Path, size and mtime of every file, including temporary files
+        left behind by a crashed writer."""
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = Path(dirpath) / name
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+
+def stat_token(path: Path) -> tuple[int, int, int, int] | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+
+@dataclass
+class RepoState:
+    """Cheap fingerprints of the on-disk git state, computed without spawning git.
+
+    Results cached under these tokens go stale exactly when HEAD, a ref,
+    the index or a tracked file changes.
+    """
+
+    git_root: Path
+    git_dir: Path
+    common_dir: Path
+
+    def head_token(self) -> bytes:
+        try:
+            return (self.git_dir / "HEAD").read_bytes()
+        except OSError:
+            return b""
+
+    def refs_token(self) -> tuple:
+        parts: list[object] = [
+            self.head_token(),
+            stat_token(self.common_dir / "packed-refs"),
+        ]
+        for dirpath, _, filenames in os.walk(self.common_dir / "refs"):
+            for name in filenames:
+                path = Path(dirpath) / name
+                parts.append((str(path), stat_token(path)))
+        return tuple(parts)
+
+    def index_token(self) -> tuple[int, int, int, int] | None:
+        return stat_token(self.git_dir / "index")
+
+    def file_signatures(
+        self, tracked: Iterable[str]
+    ) -> dict[str, tuple[int, int, int, int] | None]:
+        """Stat signature of each tracked file; None if it no longer exists."""
+        signatures = {}
+        for rel in tracked:
+            try:
+                st = os.lstat(self.git_root / rel)
+            except OSError:
+                signatures[rel] = None
+                continue
+            signatures[rel] = (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+        return signatures
+
+    def worktree_token(self, tracked: Iterable[str]) -> bytes:
+        digest = hashlib.blake2b(digest_size=16)
+        for signature in self.file_signatures(tracked).values():
+            if signature is None:
+                digest.update(b"-")
+            else:
+                digest.update(b"%d:%d:%d:%d;" % signature)
+        return digest.digest()
@@ -0,0 +1,317 @@
+import asyncio
+from collections.abc import AsyncIterator, Callable, Hashable
+from dataclasses import dataclass, field
+import hashlib
+from pathlib import Path
+import re
+import time
+from typing import TYPE_CHECKING, cast
+
+if TYPE_CHECKING:
+    from tree_sitter import Node
+
+PRECOMMIT_CONFIG = ".pre-commit-config.yaml"
+
+# prek and pre-commit print "<name>....<result>" padded to this width.
+LINE_WIDTH = 79
+
+HOOK_LINE = re.compile(
+    r"^(?P<name>[^.\n]+?)\.{3,}(?P<status>(?:\(.*\))?(?:Passed|Failed|Skipped))\s*$"
+)
+# The name and dots are printed before a hook runs, the result after it.
+HOOK_STARTED = re.compile(r"^(?P<name>[^.\n]+?)\.{3,}$")
+
+PASSED = "Passed"
+FAILED = "Failed"
+NO_FILES = "(no files to check)Skipped"
+
+
+@dataclass
+class HookResult:
+    name: str
+    # Empty while the hook is still running.
+    status: str
+    # Output printed under a failing hook: its id, exit code and messages.
+    details: list[str] = field(default_factory=list)
+    # Wall-clock seconds; zero for results served from the cache.
+    duration: float = 0.0
+    cached: bool = False
+
+    @property
+    def running(self) -> bool:
+        return not self.status
+
+    @property
+    def failed(self) -> bool:
+        return self.status.endswith(FAILED)
+
+    def format(self) -> str:
+        dots = "." * max(LINE_WIDTH - len(self.name) - len(self.status), 3)
+        return "\n".join([f"{self.name}{dots}{self.status}", *self.details])
+
+
+class HookOutputParser:
+    """Turns prek output into hook results as it arrives, timing each hook.
+
+    ``feed`` returns results that are ready: a running marker when a hook's
+    name appears, and the finished result once its status line is complete.
+    A failing hook is held back until the next hook starts or ``finish`` is
+    called, because its details are printed after the status line.
+    """
+
+    def __init__(self):
+        self.results: list[HookResult] = []
+        self._buffer = ""
+        self._pending: HookResult | None = None
+        self._started_name = ""
+        self._mark = time.monotonic()
+
+    def feed(self, text: str) -> list[HookResult]:
+        ready: list[HookResult] = []
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        for line in lines:
+            self._feed_line(line, ready)
+
+        started = HOOK_STARTED.match(self._buffer.strip())
+        if started and started["name"] != self._started_name:
+            self._flush_pending(ready)
+            self._started_name = started["name"]
+            self._mark = time.monotonic()
+            ready.append(HookResult(name=started["name"], status=""))
+        return ready
+
+    def finish(self) -> list[HookResult]:
+        ready: list[HookResult] = []
+        if self._buffer:
+            self._feed_line(self._buffer, ready)
+            self._buffer = ""
+        self._flush_pending(ready)
+        return ready
+
+    def _feed_line(self, line: str, ready: list[HookResult]) -> None:
+        match = HOOK_LINE.match(line.strip())
+        if not match:
+            if self.results and line.strip():
+                self.results[-1].details.append(line)
+            return
+
+        self._flush_pending(ready)
+        now = time.monotonic()
+        result = HookResult(
+            name=match["name"], status=match["status"], duration=now - self._mark
+        )
+        self._mark = now
+        self._started_name = ""
+        self.results.append(result)
+        if result.failed:
+            self._pending = result
+        else:
+            ready.append(result)
+
+    def _flush_pending(self, ready: list[HookResult]) -> None:
+        if self._pending is not None:
+            ready.append(self._pending)
+            self._pending = None
+
+
+def parse_hook_results(output: str) -> list[HookResult]:
+    parser = HookOutputParser()
+    parser.feed(output)
+    parser.finish()
+    return parser.results
+
+
+def format_hook_results(results: list[HookResult]) -> str:
+    return "".join(f"{result.format()}\n" for result in results)
+
+
+def object_hash(data: bytes) -> str:
+    """Hash contents the way ``git hash-object`` does, without spawning git."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def blob_hash(path: Path) -> str | None:
+    try:
+        data = path.read_bytes()
+    except OSError:
+        return None
+    return object_hash(data)
+
+
+def config_hash(git_root: Path) -> str | None:
+    try:
+        data = (git_root / PRECOMMIT_CONFIG).read_bytes()
+    except OSError:
+        return None
+    return hashlib.sha1(data).hexdigest()
+
+
+def _scalar(node: "Node | None") -> str | None:
+    if node is None or node.type != "flow_node" or node.named_child_count != 1:
+        return None
+    scalar = node.named_children[0]
+    text = (scalar.text or b"").decode(errors="replace")
+    if scalar.type in ("double_quote_scalar", "single_quote_scalar"):
+        return text[1:-1]
+    return text if scalar.type == "plain_scalar" else None
+
+
+def whole_repo_hooks(git_root: Path) -> frozenset[str]:
+    """Names and ids of the hooks that don't only check the files passed in.
+
+    These set ``pass_filenames: false`` or ``always_run: true``, e.g. a type
+    checker over the whole project, so their result depends on more than
+    the files' contents. Only the repository's own config is read: a remote
+    hook that defaults to either in its manifest counts as per file.
+    """
+    try:
+        data = (git_root / PRECOMMIT_CONFIG).read_bytes()
+    except OSError:
+        return frozenset()
+    from tree_sitter import Language, Parser
+    import tree_sitter_yaml
+
+    root = Parser(Language(tree_sitter_yaml.language())).parse(data).root_node
+    hooks = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        stack.extend(node.named_children)
+        if node.type not in ("block_mapping", "flow_mapping"):
+            continue
+        fields = {}
+        for pair in node.named_children:
+            key = _scalar(pair.child_by_field_name("key"))
+            value = _scalar(pair.child_by_field_name("value"))
+            if key is not None and value is not None:
+                fields[key] = value
+        if "id" not in fields:
+            continue
+        if (
+            fields.get("pass_filenames", "").lower() == "false"
+            or fields.get("always_run", "").lower() == "true"
+        ):
+            hooks.update(fields[k] for k in ("id", "name") if k in fields)
+    return frozenset(hooks)
+
+
+_END = object()
+
+
+class CheckJob[E]:
+    """One check run whose events are shared by every client watching it.
+
+    Late subscribers get the events published so far replayed first. The
+    run is cancelled once its last subscriber leaves, and subscribers of a
+    superseded job carry on with the job that replaced it.
+    """
+
+    def __init__(
+        self,
+        manager: "CheckJobManager[E]",
+        paths: tuple[str, ...],
+        state: Hashable,
+    ):
+        self.manager = manager
+        self.paths = paths
+        self.state = state
+        self.done = False
+        self.superseded_by: CheckJob[E] | None = None
+        self._history: list[E] = []
+        self._subscribers: set[asyncio.Queue[object]] = set()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        # A done callback also fires for a task cancelled before it started.
+        self._task.add_done_callback(self._finish)
+
+    def cancel(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def events(self) -> AsyncIterator[E]:
+        job: CheckJob[E] | None = self
+        while job is not None:
+            queue = job._subscribe()
+            try:
+                while (event := await queue.get()) is not _END:
+                    yield cast(E, event)
+            finally:
+                job._unsubscribe(queue)
+            job = job.superseded_by
+
+    async def _run(self) -> None:
+        async with self.manager.slots:
+            async for event in self.manager.run(list(self.paths)):
+                self._publish(event)
+
+    def _finish(self, _: asyncio.Task) -> None:
+        self.done = True
+        self._publish(_END)
+        self.manager._finished(self)
+
+    def _publish(self, event: object) -> None:
+        if event is not _END:
+            self._history.append(cast(E, event))
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    def _subscribe(self) -> asyncio.Queue[object]:
+        queue: asyncio.Queue[object] = asyncio.Queue()
+        for event in self._history:
+            queue.put_nowait(event)
+        if self.done:
+            queue.put_nowait(_END)
+        self._subscribers.add(queue)
+        return queue
+
+    def _unsubscribe(self, queue: asyncio.Queue[object]) -> None:
+        self._subscribers.discard(queue)
+        if not self._subscribers and self.superseded_by is None:
+            # Nobody is waiting for the result any more.
+            self.cancel()
+
+
+class CheckJobManager[E]:
+    """Single-flight scheduler for check runs.
+
+    A request for the same files in the same worktree state attaches to the
+    run already in flight. One made after the worktree changed cancels the
+    stale run. At most ``max_running`` runs execute at once, which bounds
+    the CPU that hook processes can take; managers given the same ``slots``
+    share that bound.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[list[str]], AsyncIterator[E]],
+        max_running: int = 1,
+        slots: asyncio.Semaphore | None = None,
+    ):
+        self.run = run
+        self.slots = slots or asyncio.Semaphore(max_running)
+        self._jobs: dict[tuple[str, ...], CheckJob[E]] = {}
+
+    def submit(self, paths: list[str], state: Hashable) -> CheckJob[E]:
+        key = tuple(sorted(paths))
+        current = self._jobs.get(key)
+        if current is not None and not current.done and current.state == state:
+            return current
+
+        job = CheckJob(self, key, state)
+        self._jobs[key] = job
+        if current is not None and not current.done:
+            current.superseded_by = job
+            current.cancel()
+        job.start()
+        return job
+
+    def _finished(self, job: CheckJob[E]) -> None:
+        if self._jobs.get(job.paths) is job:
+            del self._jobs[job.paths]
+
+    def close(self) -> None:
+        for job in list(self._jobs.values()):
+            job.cancel()
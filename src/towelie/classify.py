@@ -0,0 +1,82 @@
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from pathlib import PurePosixPath
+
+from towelie.models import CollapseReason
+from towelie.options import DiffOptions
+from towelie.patch import FileStat
+
+# Read with ``git check-attr``. Files with ``-diff`` need no lookup: git
+# already reports them as binary in the numstat.
+GENERATED_ATTR = "linguist-generated"
+VENDORED_ATTR = "linguist-vendored"
+ATTRIBUTES = (GENERATED_ATTR, VENDORED_ATTR)
+
+_ATTR_SET = ("set", "true")
+_ATTR_UNSET = ("unset", "false")
+
+
+def matches_glob(path: str, globs: tuple[str, ...]) -> bool:
+    """Whether ``path`` matches a glob, gitignore style.
+
+    A glob without a slash matches the file name in any directory; one with
+    a slash matches the whole path, with ``**`` spanning directories.
+    """
+    name = path.rsplit("/", 1)[-1]
+    for glob in globs:
+        if "/" in glob:
+            if PurePosixPath(path).full_match(glob.lstrip("/")):
+                return True
+        elif fnmatchcase(name, glob):
+            return True
+    return False
+
+
+def parse_check_attr(output: bytes) -> dict[str, dict[str, str]]:
+    """Parse ``git check-attr -z`` output into attribute values per path."""
+    fields = output.decode(errors="replace").split("\0")
+    attributes: dict[str, dict[str, str]] = {}
+    for i in range(0, len(fields) - 2, 3):
+        path, name, value = fields[i : i + 3]
+        attributes.setdefault(path, {})[name] = value
+    return attributes
+
+
+@dataclass(frozen=True)
+class CollapseRules:
+    """Which files a diff ships as stats only, until they are asked for."""
+
+    globs: tuple[str, ...]
+    max_file_bytes: int
+    max_changed_lines: int
+
+    @classmethod
+    def from_options(cls, options: DiffOptions) -> "CollapseRules":
+        return cls(
+            globs=tuple(options.collapse_globs),
+            max_file_bytes=options.max_file_bytes,
+            max_changed_lines=options.max_changed_lines,
+        )
+
+    def classify(
+        self, stat: FileStat, attributes: dict[str, str], size: int
+    ) -> CollapseReason | None:
+        """Why ``stat``'s patch should be collapsed, or None to show it.
+
+        ``size`` is the larger of the file's two versions in bytes. An
+        explicit ``linguist-generated`` or ``linguist-vendored`` attribute
+        wins over the globs, so ``.gitattributes`` can also un-collapse.
+        """
+        if stat.binary:
+            return CollapseReason.BINARY
+        generated = attributes.get(GENERATED_ATTR, "unspecified")
+        if generated in _ATTR_SET:
+            return CollapseReason.GENERATED
+        if attributes.get(VENDORED_ATTR) in _ATTR_SET:
+            return CollapseReason.VENDORED
+        if generated not in _ATTR_UNSET and matches_glob(stat.path, self.globs):
+            return CollapseReason.GENERATED
+        changed = stat.additions + stat.deletions
+        if changed > self.max_changed_lines or size > self.max_file_bytes:
+            return CollapseReason.LARGE
+        return None
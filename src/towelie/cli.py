@@ -3,11 +3,12 @@ import os
 import subprocess
 import threading
 import time
-import webbrowser
 import socket
 import signal
 from pathlib import Path
-import urllib.request
+
+from towelie import startup
+from towelie.repos import REPOS_ENV, git_toplevel, list_worktrees
 
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
@@ -30,36 +31,70 @@ def stop_process(proc: subprocess.Popen):
             pass
 
 
+def open_browser(url: str):
+    import webbrowser
+
+    # Launching a browser can block for a while; serving must not wait on it.
+    threading.Thread(target=webbrowser.open, args=(url,), daemon=True).start()
+
+
 def open_when_ready(port: int):
-    url = f"http://localhost:{port}"
+    """Open the browser once something accepts connections on ``port``.
+
+    Only for --dev, where uvicorn's reloader owns the socket and the server
+    runs in a child process that can't say when it is up.
+    """
     while True:
         try:
-            urllib.request.urlopen(url, timeout=1)
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
             break
-        except Exception:
+        except OSError:
             time.sleep(0.2)
-    webbrowser.open(url)
+    open_browser(f"http://localhost:{port}")
 
 
-def find_available_port(
+def bind_available_port(
     start_port: int, host: str = "127.0.0.1", attempts: int = 50
-) -> int:
+) -> socket.socket:
     for offset in range(attempts):
         port = start_port + offset
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            try:
-                sock.bind((host, port))
-            except OSError:
-                continue
-            return port
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((host, port))
+        except OSError:
+            sock.close()
+            continue
+        return sock
     raise RuntimeError(
         f"Unable to find an open port starting at {start_port} after {attempts} attempts."
     )
 
 
-def dev():
+def find_available_port(
+    start_port: int, host: str = "127.0.0.1", attempts: int = 50
+) -> int:
+    with bind_available_port(start_port, host, attempts) as sock:
+        return sock.getsockname()[1]
+
+
+def resolve_roots(paths: list[str], worktrees: bool) -> list[Path]:
+    """Worktree roots to serve, in order; the first is the default."""
+    roots: list[Path] = []
+    for raw in paths or ["."]:
+        path = Path(raw)
+        root = git_toplevel(path) if path.is_dir() else None
+        if root is None:
+            raise SystemExit(f"Error: {raw} is not a git repository")
+        for found in list_worktrees(root) if worktrees else [root]:
+            if found not in roots:
+                roots.append(found)
+    return roots
+
+
+def dev(roots: list[Path]):
     os.environ["TOWELIE_DEV"] = "1"
+    os.environ[REPOS_ENV] = os.pathsep.join(map(str, roots))
     import uvicorn
 
     print("Starting frontend watchers...")
@@ -76,30 +111,68 @@ def dev():
         stop_process(frontend_watch)
 
 
-def run():
-    import uvicorn
+def run(roots: list[Path]):
+    os.environ[REPOS_ENV] = os.pathsep.join(map(str, roots))
+    with startup.phase("bind socket"):
+        # Listening before the app is even imported means nothing can take
+        # the port meanwhile, and early connections wait in the backlog.
+        sock = bind_available_port(4242)
+        sock.listen(128)
+    port = sock.getsockname()[1]
+    url = f"http://localhost:{port}"
 
-    port = find_available_port(4242)
-    print(f"\n  towelie → http://localhost:{port}\n")
-    threading.Thread(target=open_when_ready, args=(port,), daemon=True).start()
-    uvicorn.run("towelie.app:app", host="127.0.0.1", port=port)
+    if startup.PROFILE is not None:
+        startup.PROFILE.import_modules()
+    with startup.phase("import app"):
+        import uvicorn
+
+        from towelie.app import app
+
+    class Server(uvicorn.Server):
+        async def startup(self, sockets: list[socket.socket] | None = None):
+            await super().startup(sockets=sockets)
+            if self.started:
+                startup.mark("server accepting connections")
+                open_browser(url)
+
+    print(f"\n  towelie → {url}\n")
+    Server(uvicorn.Config(app, host="127.0.0.1", port=port)).run(sockets=[sock])
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="towelie - Local code review for AI agents"
     )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="Repositories or worktrees to serve (default: the current one)",
+    )
+    parser.add_argument(
+        "--worktrees",
+        action="store_true",
+        help="Also serve every other worktree of the given repositories",
+    )
     parser.add_argument(
         "--dev",
         action="store_true",
         help="Run in development mode with Bun and Tailwind watchers",
     )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Print how long each startup phase and import takes",
+    )
     args = parser.parse_args()
 
+    if args.profile_startup:
+        startup.enable()
+    with startup.phase("find repositories"):
+        roots = resolve_roots(args.paths, args.worktrees)
     if args.dev:
-        dev()
+        dev(roots)
     else:
-        run()
+        run(roots)
 
 
 if __name__ == "__main__":
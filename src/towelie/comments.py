@@ -0,0 +1,356 @@
+from bisect import bisect_right
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+import threading
+import time
+from typing import TYPE_CHECKING
+import uuid
+
+from towelie.models import DiffSide
+from towelie.patch import Hunk
+
+if TYPE_CHECKING:
+    import sqlite3
+
+# Scope of comments made while viewing the checked-out branch, whichever
+# branch that is.
+CURRENT_SCOPE = "current"
+# Anchors kept per comment; older ones are recomputed if asked for again.
+MAX_ANCHORS_PER_COMMENT = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comments (
+    id TEXT PRIMARY KEY,
+    repo TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    path TEXT NOT NULL,
+    side TEXT NOT NULL,
+    start_line INTEGER NOT NULL,
+    end_line INTEGER NOT NULL,
+    -- Full sha of the file version the lines refer to; empty until the
+    -- file shows up in a diff.
+    blob TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comments_by_path ON comments (repo, scope, path);
+CREATE INDEX IF NOT EXISTS comments_by_blob ON comments (blob);
+CREATE TABLE IF NOT EXISTS anchors (
+    comment_id TEXT NOT NULL REFERENCES comments (id) ON DELETE CASCADE,
+    blob TEXT NOT NULL,
+    start_line INTEGER NOT NULL,
+    end_line INTEGER NOT NULL,
+    outdated INTEGER NOT NULL,
+    PRIMARY KEY (comment_id, blob)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    sha TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+"""
+
+_COLUMNS = (
+    "id, repo, scope, path, side, start_line, end_line, blob, text, "
+    "created_at, updated_at"
+)
+
+
+@dataclass
+class StoredComment:
+    id: str
+    repo: str
+    scope: str
+    path: str
+    side: DiffSide
+    start_line: int
+    end_line: int
+    blob: str
+    text: str
+    created_at: int
+    updated_at: int
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "StoredComment":
+        fields = list(row)
+        fields[4] = DiffSide(fields[4])
+        return cls(*fields)
+
+
+@dataclass(frozen=True)
+class Anchor:
+    """Where a comment's lines are in some version of its file."""
+
+    start_line: int
+    end_line: int
+    # The commented lines were changed or removed in that version.
+    outdated: bool = False
+
+
+@dataclass(frozen=True)
+class LineMap:
+    """Where each line of one version of a file went in another.
+
+    Built from the hunks of a zero-context diff between the versions, as
+    difflib-style opcodes: lines in an unchanged block keep their offset
+    within it, lines in a changed block land on the first line that
+    replaced them.
+    """
+
+    opcodes: Sequence[tuple[str, int, int, int, int]]
+    starts: list[int]
+    new_line_count: int
+
+    @classmethod
+    def from_hunks(
+        cls, hunks: Iterable[Hunk], old_line_count: int, new_line_count: int
+    ) -> "LineMap":
+        opcodes = []
+        old_at = new_at = 0
+        for hunk in hunks:
+            # An empty side's start names the line before the hunk.
+            i1 = hunk.old_start - 1 if hunk.old_lines else hunk.old_start
+            j1 = hunk.new_start - 1 if hunk.new_lines else hunk.new_start
+            if i1 > old_at:
+                opcodes.append(("equal", old_at, i1, new_at, j1))
+            i2, j2 = i1 + hunk.old_lines, j1 + hunk.new_lines
+            tag = (
+                "replace" if i2 > i1 and j2 > j1 else "delete" if i2 > i1 else "insert"
+            )
+            opcodes.append((tag, i1, i2, j1, j2))
+            old_at, new_at = i2, j2
+        if old_line_count > old_at:
+            opcodes.append(("equal", old_at, old_line_count, new_at, new_line_count))
+        return cls(
+            opcodes=opcodes,
+            starts=[opcode[1] for opcode in opcodes],
+            new_line_count=new_line_count,
+        )
+
+    def line(self, number: int) -> tuple[int, bool]:
+        """New number of old line ``number``, and whether it was changed."""
+        last = max(self.new_line_count, 1)
+        index = number - 1
+        # Insertions take no old lines; the block after one wins the tie.
+        at = bisect_right(self.starts, index) - 1
+        if at < 0:
+            return 1, True
+        tag, i1, i2, j1, _ = self.opcodes[at]
+        if index >= i2:
+            return last, True
+        if tag == "equal":
+            return j1 + index - i1 + 1, False
+        return min(j1 + 1, last), True
+
+    def anchor(self, start: int, end: int) -> Anchor:
+        new_start, start_changed = self.line(start)
+        new_end, end_changed = self.line(end)
+        outdated = start_changed or end_changed
+        first = max(bisect_right(self.starts, start - 1) - 1, 0)
+        for tag, i1, i2, _, _ in self.opcodes[first:]:
+            if i1 >= end or outdated:
+                break
+            if tag == "equal":
+                continue
+            # An insertion counts when it lands between two commented lines.
+            outdated = start - 1 < i1 if i1 == i2 else i2 > start - 1
+        return Anchor(new_start, max(new_end, new_start), outdated)
+
+
+def line_count(data: bytes) -> int:
+    """Lines in ``data`` as git counts them, a last unterminated one included."""
+    return data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
+
+
+class CommentStore:
+    """Review comments, kept in SQLite next to ``options.json``.
+
+    A comment stays anchored to the blob of the file version it was written
+    on. Where its lines are in any other version is worked out once and kept
+    in ``anchors``. Worktree versions, which git never stores, are kept in
+    ``snapshots`` for as long as a comment is anchored to them.
+
+    Every method blocks on disk and belongs in a worker thread.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self.path = path or Path.home() / ".towelie" / "comments.db"
+        self._db: "sqlite3.Connection | None" = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> "sqlite3.Connection":
+        if self._db is None:
+            # Most requests never touch comments; don't import sqlite on startup.
+            import sqlite3
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def find(
+        self, repo: str, scope: str, paths: list[str] | None = None
+    ) -> list[StoredComment]:
+        """Comments of one scope in the order they were written."""
+        query = f"SELECT {_COLUMNS} FROM comments WHERE repo = ? AND scope = ?"
+        params: list[object] = [repo, scope]
+        if paths is not None:
+            query += f" AND path IN ({', '.join('?' * len(paths))})"
+            params += paths
+        query += " ORDER BY created_at, rowid"
+        with self._lock:
+            rows = self._connection().execute(query, params).fetchall()
+        return [StoredComment.from_row(row) for row in rows]
+
+    def add(
+        self,
+        repo: str,
+        scope: str,
+        path: str,
+        side: DiffSide,
+        start_line: int,
+        end_line: int,
+        text: str,
+        blob: str = "",
+        snapshot: bytes | None = None,
+    ) -> StoredComment:
+        now = int(time.time() * 1000)
+        comment = StoredComment(
+            id=uuid.uuid4().hex,
+            repo=repo,
+            scope=scope,
+            path=path,
+            side=side,
+            start_line=start_line,
+            end_line=end_line,
+            blob=blob,
+            text=text,
+            created_at=now,
+            updated_at=now,
+        )
+        with self._lock, self._connection() as db:
+            if snapshot is not None:
+                self._save_snapshot(db, blob, snapshot)
+            db.execute(
+                f"INSERT INTO comments ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    comment.id,
+                    repo,
+                    scope,
+                    path,
+                    side.value,
+                    start_line,
+                    end_line,
+                    blob,
+                    text,
+                    now,
+                    now,
+                ),
+            )
+        return comment
+
+    def update(self, repo: str, comment_id: str, text: str) -> StoredComment | None:
+        with self._lock, self._connection() as db:
+            db.execute(
+                "UPDATE comments SET text = ?, updated_at = ? WHERE repo = ? AND id = ?",
+                (text, int(time.time() * 1000), repo, comment_id),
+            )
+            row = db.execute(
+                f"SELECT {_COLUMNS} FROM comments WHERE repo = ? AND id = ?",
+                (repo, comment_id),
+            ).fetchone()
+        return StoredComment.from_row(row) if row is not None else None
+
+    def remove(self, repo: str, comment_id: str) -> bool:
+        with self._lock, self._connection() as db:
+            removed = db.execute(
+                "DELETE FROM comments WHERE repo = ? AND id = ?", (repo, comment_id)
+            ).rowcount
+            self._prune_snapshots(db)
+        return removed > 0
+
+    def clear(self, repo: str, scope: str) -> int:
+        with self._lock, self._connection() as db:
+            removed = db.execute(
+                "DELETE FROM comments WHERE repo = ? AND scope = ?", (repo, scope)
+            ).rowcount
+            self._prune_snapshots(db)
+        return removed
+
+    def adopt(
+        self, comment_ids: list[str], blob: str, snapshot: bytes | None = None
+    ) -> None:
+        """Anchor comments written before their file was in a diff to ``blob``."""
+        with self._lock, self._connection() as db:
+            if snapshot is not None:
+                self._save_snapshot(db, blob, snapshot)
+            db.executemany(
+                "UPDATE comments SET blob = ? WHERE id = ? AND blob = ''",
+                [(blob, comment_id) for comment_id in comment_ids],
+            )
+
+    def anchors(self, blob: str, comment_ids: list[str]) -> dict[str, Anchor]:
+        """Anchors already worked out for ``blob``, by comment id."""
+        placeholders = ", ".join("?" * len(comment_ids))
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    "SELECT comment_id, start_line, end_line, outdated FROM anchors"
+                    f" WHERE blob = ? AND comment_id IN ({placeholders})",
+                    [blob, *comment_ids],
+                )
+                .fetchall()
+            )
+        return {row[0]: Anchor(row[1], row[2], bool(row[3])) for row in rows}
+
+    def save_anchors(self, blob: str, anchors: dict[str, Anchor]) -> None:
+        with self._lock, self._connection() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO anchors"
+                " (comment_id, blob, start_line, end_line, outdated)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [
+                    (comment_id, blob, a.start_line, a.end_line, int(a.outdated))
+                    for comment_id, a in anchors.items()
+                ],
+            )
+            # Every worktree edit is a new version; keep the latest few.
+            db.executemany(
+                "DELETE FROM anchors WHERE comment_id = ? AND rowid NOT IN"
+                " (SELECT rowid FROM anchors WHERE comment_id = ?"
+                " ORDER BY rowid DESC LIMIT ?)",
+                [
+                    (comment_id, comment_id, MAX_ANCHORS_PER_COMMENT)
+                    for comment_id in anchors
+                ],
+            )
+
+    def snapshot(self, sha: str) -> bytes | None:
+        with self._lock:
+            row = (
+                self._connection()
+                .execute("SELECT data FROM snapshots WHERE sha = ?", (sha,))
+                .fetchone()
+            )
+        return row[0] if row is not None else None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def _save_snapshot(db: "sqlite3.Connection", sha: str, data: bytes) -> None:
+        db.execute(
+            "INSERT OR IGNORE INTO snapshots (sha, data) VALUES (?, ?)", (sha, data)
+        )
+
+    @staticmethod
+    def _prune_snapshots(db: "sqlite3.Connection") -> None:
+        db.execute("DELETE FROM snapshots WHERE sha NOT IN (SELECT blob FROM comments)")
@@ -0,0 +1,204 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+import heapq
+import itertools
+import os
+from pathlib import Path
+import time
+
+from towelie.metrics import Metrics
+
+DEFAULT_MAX_PROCESSES = min(8, os.cpu_count() or 4)
+
+# Higher is newer; work done outside a request runs at the lowest priority.
+request_priority: ContextVar[int] = ContextVar("request_priority", default=0)
+_request_sequence = itertools.count(1)
+
+
+def begin_request() -> Token[int]:
+    """Give the current context a priority above every earlier request."""
+    return request_priority.set(next(_request_sequence))
+
+
+@dataclass
+class GitResult:
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+
+
+class PrioritySemaphore:
+    """Semaphore that hands a freed slot to the highest-priority waiter."""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._queued: set[asyncio.Future[None]] = set()
+        self._counter = itertools.count()
+
+    async def acquire(
+        self, priority: int, future: asyncio.Future[None] | None = None
+    ) -> None:
+        """Take a slot, queueing at ``priority`` while none is free.
+
+        Pass your own ``future`` to ``promote`` the wait later on.
+        """
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._counter), future))
+        self._queued.add(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled.
+                self.release()
+            raise
+        finally:
+            self._queued.discard(future)
+
+    def promote(self, future: asyncio.Future[None], priority: int) -> None:
+        """Move a queued ``acquire`` up to ``priority``.
+
+        The old entry stays in the heap; whichever is popped first hands
+        over the slot and ``release`` skips the other once it's done.
+        """
+        if future in self._queued and not future.done():
+            heapq.heappush(self._waiters, (-priority, next(self._counter), future))
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+    @asynccontextmanager
+    async def slot(
+        self, priority: int, future: asyncio.Future[None] | None = None
+    ) -> AsyncIterator[None]:
+        await self.acquire(priority, future)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+@dataclass
+class _Flight:
+    task: asyncio.Task[GitResult]
+    epoch: int | None
+    priority: int
+    # Resolved when the flight gets a process slot.
+    queued: asyncio.Future[None]
+    spawned: bool = False
+    waiters: int = 0
+
+
+class GitExecutor:
+    """Runs git subprocesses for every project with shared limits.
+
+    At most ``max_processes`` git processes run at once and queued commands
+    start newest request first. Identical commands are coalesced onto one
+    process, but only when that cannot hand back stale output: the process
+    has not been spawned yet, or the caller's ``epoch`` (a counter bumped on
+    every repository change) matches the one it was started under.
+    """
+
+    def __init__(
+        self,
+        max_processes: int = DEFAULT_MAX_PROCESSES,
+        metrics: Metrics | None = None,
+    ):
+        self.slots = PrioritySemaphore(max_processes)
+        self.metrics = metrics or Metrics()
+        self._inflight: dict[tuple, _Flight] = {}
+
+    async def run(
+        self,
+        cwd: Path,
+        args: tuple[str, ...],
+        input: bytes | None = None,
+        epoch: int | None = None,
+    ) -> GitResult:
+        key = (cwd, args, input)
+        flight = self._inflight.get(key)
+        if (
+            flight is None
+            or flight.task.cancelling()
+            or (flight.spawned and (epoch is None or epoch != flight.epoch))
+        ):
+            flight = self._start(key, epoch)
+        priority = request_priority.get()
+        if not flight.spawned and priority > flight.priority:
+            # A newer request joined; don't leave it queued behind older ones.
+            flight.priority = priority
+            self.slots.promote(flight.queued, priority)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every caller went away; don't leave git running for nobody.
+                flight.task.cancel()
+
+    def _start(self, key: tuple, epoch: int | None) -> _Flight:
+        cwd, args, input = key
+
+        async def spawn() -> GitResult:
+            async with self.slots.slot(flight.priority, flight.queued):
+                flight.spawned = True
+                cmd = ["git", *args]
+                start = time.perf_counter()
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    cwd=cwd,
+                    stdin=asyncio.subprocess.PIPE if input is not None else None,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                stdout = b""
+                try:
+                    stdout, stderr = await proc.communicate(input)
+                finally:
+                    if proc.returncode is None:
+                        proc.kill()
+                        await proc.wait()
+                    self.metrics.record_command(
+                        cmd,
+                        time.perf_counter() - start,
+                        len(stdout),
+                        proc.returncode or 0,
+                    )
+                return GitResult(
+                    returncode=proc.returncode or 0, stdout=stdout, stderr=stderr
+                )
+
+        flight = _Flight(
+            task=asyncio.create_task(spawn()),
+            epoch=epoch,
+            priority=request_priority.get(),
+            queued=asyncio.get_running_loop().create_future(),
+        )
+        self._inflight[key] = flight
+
+        def forget(_: asyncio.Task) -> None:
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+
+        flight.task.add_done_callback(forget)
+        return flight
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold a process slot, e.g. for the lifetime of a streamed command."""
+        async with self.slots.slot(request_priority.get()):
+            yield
@@ -0,0 +1,157 @@
+import asyncio
+from dataclasses import dataclass
+from pathlib import Path
+import time
+
+from towelie.metrics import Metrics
+
+BATCH = "--batch"
+BATCH_CHECK = "--batch-check"
+
+
+@dataclass(frozen=True)
+class ObjectInfo:
+    sha: str
+    type: str
+    size: int
+
+
+class _CatFileWorker:
+    """One long-lived ``git cat-file`` process answering a query at a time."""
+
+    def __init__(self, git_root: Path, mode: str, metrics: Metrics):
+        self.git_root = git_root
+        self.mode = mode
+        self.metrics = metrics
+        self.cmd = ["git", "cat-file", mode]
+        self.proc: asyncio.subprocess.Process | None = None
+
+    async def _ensure_started(self) -> asyncio.subprocess.Process:
+        if self.proc is None or self.proc.returncode is not None:
+            self.metrics.log_start(self.cmd)
+            self.proc = await asyncio.create_subprocess_exec(
+                *self.cmd,
+                cwd=self.git_root,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        return self.proc
+
+    async def query(self, name: str) -> tuple[ObjectInfo, bytes | None] | None:
+        start = time.perf_counter()
+        proc = await self._ensure_started()
+        assert proc.stdin is not None and proc.stdout is not None
+        received, returncode = 0, 1
+        try:
+            proc.stdin.write(name.encode() + b"\n")
+            await proc.stdin.drain()
+            header = await proc.stdout.readline()
+            if not header:
+                raise ConnectionError("git cat-file exited unexpectedly")
+            received = len(header)
+            if header.endswith((b" missing\n", b" ambiguous\n")):
+                returncode = 0
+                return None
+            sha, type_, size = header.decode().split()
+            info = ObjectInfo(sha=sha, type=type_, size=int(size))
+            body = None
+            if self.mode == BATCH:
+                body = (await proc.stdout.readexactly(info.size + 1))[:-1]
+                received += info.size + 1
+            returncode = 0
+            return info, body
+        except BaseException:
+            # A half-read reply would desync the pipe for the next caller.
+            self.kill()
+            raise
+        finally:
+            # Queries reuse one process, so they are recorded but not logged.
+            self.metrics.record_command(
+                self.cmd, time.perf_counter() - start, received, returncode, log=False
+            )
+
+    def kill(self) -> None:
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.kill()
+        self.proc = None
+
+    async def close(self) -> None:
+        proc = self.proc
+        self.proc = None
+        if proc is None or proc.returncode is not None:
+            return
+        assert proc.stdin is not None
+        proc.stdin.close()
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=2)
+        except TimeoutError:
+            proc.kill()
+            await proc.wait()
+
+
+class GitObjectPool:
+    """Pool of persistent ``git cat-file`` workers for object and ref lookups.
+
+    Lookups are written to an idle worker's stdin, so the hot path costs a
+    pipe round trip instead of a process spawn. Workers start on first use
+    and are restarted if they die.
+    """
+
+    def __init__(
+        self,
+        git_root: Path,
+        size: int = 2,
+        metrics: Metrics | None = None,
+    ):
+        self.git_root = git_root
+        self.size = size
+        self.metrics = metrics or Metrics()
+        self._workers: dict[str, list[_CatFileWorker]] = {}
+        self._idle: dict[str, asyncio.Queue[_CatFileWorker]] = {}
+
+    def _queue(self, mode: str) -> asyncio.Queue[_CatFileWorker]:
+        queue = self._idle.get(mode)
+        if queue is None:
+            queue = asyncio.Queue()
+            workers = [
+                _CatFileWorker(self.git_root, mode, self.metrics)
+                for _ in range(self.size)
+            ]
+            for worker in workers:
+                queue.put_nowait(worker)
+            self._workers[mode] = workers
+            self._idle[mode] = queue
+        return queue
+
+    async def _query(
+        self, mode: str, name: str
+    ) -> tuple[ObjectInfo, bytes | None] | None:
+        if not name or "\n" in name:
+            return None
+        queue = self._queue(mode)
+        worker = await queue.get()
+        try:
+            return await worker.query(name)
+        finally:
+            queue.put_nowait(worker)
+
+    async def info(self, name: str) -> ObjectInfo | None:
+        result = await self._query(BATCH_CHECK, name)
+        return result[0] if result else None
+
+    async def resolve(self, name: str) -> str | None:
+        info = await self.info(name)
+        return info.sha if info else None
+
+    async def read(self, name: str) -> tuple[ObjectInfo, bytes] | None:
+        result = await self._query(BATCH, name)
+        if result is None or result[1] is None:
+            return None
+        return result[0], result[1]
+
+    async def close(self) -> None:
+        workers = [w for pool in self._workers.values() for w in pool]
+        self._workers.clear()
+        self._idle.clear()
+        await asyncio.gather(*(worker.close() for worker in workers))
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import asyncio
+from functools import cache
+import importlib
+import importlib.util
+import os
+from pathlib import PurePosixPath
+from typing import TYPE_CHECKING
+
+# The parser and the process pool are only loaded once something is
+# highlighted, which keeps them off the server's startup path.
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+    from tree_sitter import Node, Parser, Query
+
+# (start column, end column, kind), in characters of the line's text.
+Span = tuple[int, int, str]
+LineSpans = list[list[Span]]
+
+MAX_HIGHLIGHT_BYTES = 1024 * 1024
+DEFAULT_MAX_WORKERS = min(4, os.cpu_count() or 2)
+
+# Grammars ship as separate packages. The common ones are dependencies;
+# languages whose package is missing are simply left unhighlighted.
+GRAMMARS: dict[str, tuple[str, str]] = {
+    ".py": ("tree_sitter_python", "language"),
+    ".pyi": ("tree_sitter_python", "language"),
+    ".js": ("tree_sitter_javascript", "language"),
+    ".mjs": ("tree_sitter_javascript", "language"),
+    ".cjs": ("tree_sitter_javascript", "language"),
+    ".jsx": ("tree_sitter_javascript", "language"),
+    ".ts": ("tree_sitter_typescript", "language_typescript"),
+    ".tsx": ("tree_sitter_typescript", "language_tsx"),
+    ".rs": ("tree_sitter_rust", "language"),
+    ".go": ("tree_sitter_go", "language"),
+    ".c": ("tree_sitter_c", "language"),
+    ".h": ("tree_sitter_c", "language"),
+    ".cc": ("tree_sitter_cpp", "language"),
+    ".cpp": ("tree_sitter_cpp", "language"),
+    ".hpp": ("tree_sitter_cpp", "language"),
+    ".java": ("tree_sitter_java", "language"),
+    ".rb": ("tree_sitter_ruby", "language"),
+    ".sh": ("tree_sitter_bash", "language"),
+    ".bash": ("tree_sitter_bash", "language"),
+    ".json": ("tree_sitter_json", "language"),
+    ".css": ("tree_sitter_css", "language"),
+    ".html": ("tree_sitter_html", "language"),
+    ".toml": ("tree_sitter_toml", "language"),
+    ".yaml": ("tree_sitter_yaml", "language"),
+    ".yml": ("tree_sitter_yaml", "language"),
+}
+# Grammars whose highlight query only adds to another grammar's.
+BASE_QUERIES = {
+    "tree_sitter_typescript": "tree_sitter_javascript",
+    "tree_sitter_cpp": "tree_sitter_c",
+}
+
+
+@cache
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def language_for(path: str) -> str | None:
+    """Grammar key for a file, or None when no installed grammar handles it."""
+    suffix = PurePosixPath(path).suffix.lower()
+    grammar = GRAMMARS.get(suffix)
+    if grammar is None or not _installed(grammar[0]):
+        return None
+    return suffix
+
+
+@cache
+def _load(lang: str) -> tuple[Parser, Query | None]:
+    from tree_sitter import Language, Parser, Query
+
+    module_name, function = GRAMMARS[lang]
+    module = importlib.import_module(module_name)
+    language = Language(getattr(module, function)())
+    source = getattr(module, "HIGHLIGHTS_QUERY", None)
+    base = BASE_QUERIES.get(module_name)
+    if source and base is not None and _installed(base):
+        base_source = importlib.import_module(base).HIGHLIGHTS_QUERY
+        source = base_source + "\n" + source
+    query = Query(language, source) if source else None
+    return Parser(language), query
+
+
+def _query_spans(query: Query, root: Node) -> list[tuple[int, int, str]]:
+    from tree_sitter import QueryCursor
+
+    # When several patterns capture the same node the later one is more
+    # specific, e.g. a builtin call after the generic identifier rule.
+    by_range: dict[tuple[int, int], tuple[int, str]] = {}
+    for pattern, captures in QueryCursor(query).matches(root):
+        for name, nodes in captures.items():
+            if name.startswith("_"):
+                continue
+            for node in nodes:
+                key = (node.start_byte, node.end_byte)
+                if key not in by_range or by_range[key][0] <= pattern:
+                    by_range[key] = (pattern, name.split(".")[0])
+    return [(start, end, name) for (start, end), (_, name) in by_range.items()]
+
+
+def _leaf_spans(root: Node) -> list[tuple[int, int, str]]:
+    """Coarse classes from node types, for grammars without a highlight query."""
+    spans = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        kind = node.type
+        if "comment" in kind:
+            spans.append((node.start_byte, node.end_byte, "comment"))
+        elif "string" in kind and node.is_named:
+            spans.append((node.start_byte, node.end_byte, "string"))
+        elif kind in ("integer", "float", "number", "number_literal"):
+            spans.append((node.start_byte, node.end_byte, "number"))
+        elif node.child_count == 0:
+            if not node.is_named and kind.isidentifier():
+                spans.append((node.start_byte, node.end_byte, "keyword"))
+        else:
+            stack.extend(node.children)
+    return spans
+
+
+def _flatten(spans: list[tuple[int, int, str]]) -> list[tuple[int, int, str]]:
+    """Turn nested spans into disjoint ones, with the innermost kind winning."""
+    spans.sort(key=lambda span: (span[0], -span[1]))
+    flat: list[tuple[int, int, str]] = []
+    open_spans: list[tuple[int, str]] = []
+    pos = 0
+
+    def emit(upto: int) -> None:
+        nonlocal pos
+        if open_spans and upto > pos:
+            flat.append((pos, upto, open_spans[-1][1]))
+        pos = max(pos, upto)
+
+    for start, end, kind in spans:
+        while open_spans and open_spans[-1][0] <= start:
+            emit(open_spans[-1][0])
+            open_spans.pop()
+        emit(start)
+        open_spans.append((end, kind))
+    while open_spans:
+        emit(open_spans[-1][0])
+        open_spans.pop()
+    return flat
+
+
+def highlight_source(lang: str, source: bytes) -> LineSpans:
+    """Token spans for every line of ``source``.
+
+    Runs in a worker process: parsers and compiled queries are cached per
+    process, so each worker pays for loading a grammar once.
+    """
+    parser, query = _load(lang)
+    root = parser.parse(source).root_node
+    spans = _query_spans(query, root) if query is not None else _leaf_spans(root)
+
+    lines = source.split(b"\n")
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line) + 1)
+
+    result: LineSpans = [[] for _ in lines]
+    row = 0
+    for start, end, kind in _flatten(spans):
+        while offsets[row + 1] <= start:
+            row += 1
+        # Multi-line tokens such as docstrings are split at line ends.
+        line_row = row
+        while line_row < len(lines) and offsets[line_row] < end:
+            line = lines[line_row]
+            begin = max(start - offsets[line_row], 0)
+            stop = min(end - offsets[line_row], len(line))
+            if stop > begin:
+                if not line.isascii():
+                    begin = len(line[:begin].decode(errors="replace"))
+                    stop = len(line[:stop].decode(errors="replace"))
+                result[line_row].append((begin, stop, kind))
+            line_row += 1
+    return result
+
+
+_DEFINITION_KINDS = ("function", "method", "class", "impl", "struct", "trait")
+
+
+def _is_definition(node: Node) -> bool:
+    kind = node.type
+    return kind.endswith(("_definition", "_declaration", "_item")) and any(
+        word in kind for word in _DEFINITION_KINDS
+    )
+
+
+def enclosing_definition(
+    lang: str, source: bytes, start: int, end: int
+) -> tuple[int, int] | None:
+    """Line span of the innermost function or class around lines start-end."""
+    parser, _ = _load(lang)
+    root = parser.parse(source).root_node
+    node = root.named_descendant_for_point_range((start - 1, 0), (end - 1, 0))
+    while node is not None and not _is_definition(node):
+        node = node.parent
+    if node is None:
+        return None
+    return node.start_point.row + 1, node.end_point.row + 1
+
+
+class Highlighter:
+    """Tokenizes files in a process pool so parsing never blocks the event loop.
+
+    The pool is started on first use with the ``forkserver`` method, since
+    forking a process that runs an event loop and worker threads is unsafe.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            import multiprocessing
+
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return self._pool
+
+    async def highlight(self, lang: str, source: bytes) -> LineSpans | None:
+        if len(source) > MAX_HIGHLIGHT_BYTES or b"\0" in source:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor(), highlight_source, lang, source
+        )
+
+    async def enclosing_definition(
+        self, lang: str, source: bytes, start: int, end: int
+    ) -> tuple[int, int] | None:
+        if len(source) > MAX_HIGHLIGHT_BYTES or b"\0" in source:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor(), enclosing_definition, lang, source, start, end
+        )
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
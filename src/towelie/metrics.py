@@ -0,0 +1,167 @@
+from bisect import bisect_left
+from collections.abc import Sequence
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import re
+import sys
+
+from towelie.models import CommandStats, LatencyBucket, MetricsResponse
+
+# Upper bounds in milliseconds; anything slower lands in a final open bucket.
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_TOKEN_UNSAFE = re.compile(r"[^\w-]")
+
+
+@dataclass
+class CommandTiming:
+    name: str
+    duration: float
+    output_bytes: int
+    returncode: int
+
+
+@dataclass
+class RequestTimings:
+    """Subprocesses run on behalf of one HTTP request."""
+
+    commands: list[CommandTiming] = field(default_factory=list)
+
+    def server_timing(self) -> str:
+        """``Server-Timing`` header value with one entry per command name."""
+        totals: dict[str, tuple[int, float, int]] = {}
+        for timing in self.commands:
+            count, duration, size = totals.get(timing.name, (0, 0.0, 0))
+            totals[timing.name] = (
+                count + 1,
+                duration + timing.duration,
+                size + timing.output_bytes,
+            )
+        return ", ".join(
+            f"{_TOKEN_UNSAFE.sub('-', name)};dur={duration * 1000:.1f};"
+            f'desc="{name} x{count}, {size} B"'
+            for name, (count, duration, size) in totals.items()
+        )
+
+
+# Set per request by middleware; tasks started from a request inherit it, so
+# a git process is charged to the request that started it.
+request_timings: ContextVar[RequestTimings | None] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def begin_timings() -> RequestTimings:
+    """Start collecting the subprocesses run from the current context."""
+    timings = RequestTimings()
+    request_timings.set(timings)
+    return timings
+
+
+def command_name(cmd: Sequence[str] | str) -> str:
+    """``git diff`` for any git invocation, the program name otherwise."""
+    if isinstance(cmd, str):
+        cmd = cmd.split()
+    if not cmd:
+        return ""
+    program = cmd[0].rsplit("/", 1)[-1]
+    if program == "git":
+        sub = next((arg for arg in cmd[1:] if not arg.startswith("-")), None)
+        return f"git {sub}" if sub else program
+    return program
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.failures = 0
+        self.output_bytes = 0
+
+    def add(self, duration: float, output_bytes: int = 0, failed: bool = False):
+        self.counts[bisect_left(BUCKETS_MS, duration * 1000)] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.failures += failed
+        self.output_bytes += output_bytes
+
+    def quantile(self, q: float) -> float:
+        """Upper bound in milliseconds of the bucket holding the q-quantile."""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max * 1000)
+        return self.max * 1000
+
+    def stats(self, name: str) -> CommandStats:
+        bounds: list[float | None] = [*BUCKETS_MS, None]
+        return CommandStats(
+            name=name,
+            count=self.count,
+            failures=self.failures,
+            total_ms=self.total * 1000,
+            max_ms=self.max * 1000,
+            p50_ms=self.quantile(0.5),
+            p90_ms=self.quantile(0.9),
+            p99_ms=self.quantile(0.99),
+            output_bytes=self.output_bytes,
+            buckets=[
+                LatencyBucket(le_ms=bound, count=count)
+                for bound, count in zip(bounds, self.counts)
+                if count
+            ],
+        )
+
+
+class Metrics:
+    """Timings of every subprocess and request since the server started."""
+
+    def __init__(self, log: bool = False):
+        self.log = log
+        self.commands: dict[str, Histogram] = {}
+        self.requests: dict[str, Histogram] = {}
+
+    def record_command(
+        self,
+        cmd: Sequence[str] | str,
+        duration: float,
+        output_bytes: int,
+        returncode: int,
+        log: bool = True,
+    ) -> None:
+        name = command_name(cmd)
+        self.commands.setdefault(name, Histogram()).add(
+            duration, output_bytes, returncode != 0
+        )
+        timings = request_timings.get()
+        if timings is not None:
+            timings.commands.append(
+                CommandTiming(name, duration, output_bytes, returncode)
+            )
+        if self.log and log:
+            shown = cmd if isinstance(cmd, str) else " ".join(cmd)
+            print(
+                f"  $ {shown}  [{duration * 1000:.1f} ms, {output_bytes} B,"
+                f" exit {returncode}]",
+                file=sys.stderr,
+            )
+
+    def log_start(self, cmd: Sequence[str]) -> None:
+        """Log a long-lived process, whose work is recorded per query."""
+        if self.log:
+            print(f"  $ {' '.join(cmd)}", file=sys.stderr)
+
+    def record_request(self, route: str, duration: float, failed: bool) -> None:
+        self.requests.setdefault(route, Histogram()).add(duration, failed=failed)
+
+    def snapshot(self) -> MetricsResponse:
+        def ordered(histograms: dict[str, Histogram]) -> list[CommandStats]:
+            stats = [h.stats(name) for name, h in histograms.items()]
+            return sorted(stats, key=lambda s: s.total_ms, reverse=True)
+
+        return MetricsResponse(
+            commands=ordered(self.commands), requests=ordered(self.requests)
+        )
@@ -1,14 +1,20 @@
 from enum import StrEnum
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 
-from towelie.options import DiffStyle
+from towelie.options import (
+    DEFAULT_COLLAPSE_GLOBS,
+    DEFAULT_MAX_CHANGED_LINES,
+    DEFAULT_MAX_FILE_BYTES,
+    DiffStyle,
+)
 
 
 class CheckStatus(StrEnum):
     PASS = "pass"
     FAIL = "fail"
     NO_CHECKS = "no_checks"
+    NO_FILES = "no_files"
 
 
 class Diff(BaseModel):
@@ -16,8 +22,88 @@ class Diff(BaseModel):
     files: list[str]
 
 
+class CollapseReason(StrEnum):
+    BINARY = "binary"
+    GENERATED = "generated"
+    VENDORED = "vendored"
+    LARGE = "large"
+
+
 class DiffResponse(BaseModel):
     diff: Diff
+    # Files whose patch was left out of ``diff.diff``, with the reason; ask
+    # /api/diff/files for them by path.
+    collapsed: dict[str, CollapseReason] = Field(default_factory=dict)
+
+
+class DiffFormat(StrEnum):
+    RAW = "raw"
+    STRUCTURED = "structured"
+
+
+class FileStatus(StrEnum):
+    MODIFIED = "M"
+    ADDED = "A"
+    DELETED = "D"
+    RENAMED = "R"
+    COPIED = "C"
+
+
+class DiffHunk(BaseModel):
+    old_start: int
+    old_lines: int
+    new_start: int
+    new_lines: int
+    header: str
+    lines: list[str]
+    # Per line, (start, end, kind) token spans over the text after the
+    # +/-/space marker; only present when highlighting was requested.
+    tokens: list[list[tuple[int, int, str]]] | None = None
+
+
+class DiffFile(BaseModel):
+    old_path: str
+    new_path: str
+    status: FileStatus
+    binary: bool
+    additions: int
+    deletions: int
+    old_oid: str
+    new_oid: str
+    hunks: list[DiffHunk]
+    # Set when the hunks were left out; ask /api/diff/files for the path.
+    collapsed: CollapseReason | None = None
+
+
+class DiffFileSummary(BaseModel):
+    old_path: str
+    new_path: str
+    status: FileStatus
+    binary: bool
+    additions: int
+    deletions: int
+    collapsed: CollapseReason | None = None
+
+
+class DiffSummaryResponse(BaseModel):
+    files: list[DiffFileSummary]
+
+
+class StructuredDiff(BaseModel):
+    files: list[DiffFile]
+
+
+class StructuredDiffResponse(BaseModel):
+    diff: StructuredDiff
+
+
+class FileLinesResponse(BaseModel):
+    path: str
+    oid: str
+    start: int
+    end: int
+    total_lines: int
+    lines: list[str]
 
 
 class PromptOptionsPayload(BaseModel):
@@ -33,6 +119,11 @@ class PromptOptionsPayload(BaseModel):
 
 class DiffOptionsPayload(BaseModel):
     style: DiffStyle = DiffStyle.TWO_SIDES
+    collapse_globs: list[str] = Field(
+        default_factory=lambda: list(DEFAULT_COLLAPSE_GLOBS)
+    )
+    max_file_bytes: int = Field(default=DEFAULT_MAX_FILE_BYTES, ge=1)
+    max_changed_lines: int = Field(default=DEFAULT_MAX_CHANGED_LINES, ge=1)
 
 
 class AppOptionsPayload(BaseModel):
@@ -45,6 +136,17 @@ class ParsedCheck(BaseModel):
     passed: bool
 
 
+class CheckHookEvent(BaseModel):
+    name: str
+    # Empty while the hook is still running.
+    status: str = ""
+    passed: bool = False
+    # Wall-clock seconds the hook took.
+    duration: float = 0.0
+    cached: bool = False
+    details: str = ""
+
+
 class ChecksResponse(BaseModel):
     status: CheckStatus
     checks: list[ParsedCheck] = Field(default_factory=list)
@@ -58,11 +160,119 @@ class CommitInfo(BaseModel):
 
 class Branch(BaseModel):
     name: str
+    # First page only; fetch the rest from /api/commits with ``next_cursor``.
+    commits: list[CommitInfo]
+    total_commits: int = 0
+    next_cursor: str | None = None
+
+
+class CommitPageResponse(BaseModel):
     commits: list[CommitInfo]
+    next_cursor: str | None = None
 
 
 class ProjectInfoResponse(BaseModel):
     project_name: str
     current_branch: str
     base_branch: str
+    # The current, base and requested branches plus the most recent ones;
+    # find the others with /api/branches.
     branches: list[Branch]
+    total_branches: int = 0
+
+
+class BranchMatch(BaseModel):
+    name: str
+    committed: int
+
+
+class BranchSearchResponse(BaseModel):
+    branches: list[BranchMatch]
+    total: int
+
+
+class DiffSide(StrEnum):
+    OLD = "old"
+    NEW = "new"
+
+
+class Comment(BaseModel):
+    id: str
+    path: str
+    side: DiffSide
+    # Lines of the file as the requested diff shows it, which may differ
+    # from where the comment was written.
+    start_line: int
+    end_line: int
+    text: str
+    # Milliseconds since the epoch.
+    created_at: int
+    updated_at: int
+    # The commented lines were changed or removed since.
+    outdated: bool = False
+
+
+class CommentsResponse(BaseModel):
+    comments: list[Comment]
+
+
+class CommentTextPayload(BaseModel):
+    text: str = Field(min_length=1)
+
+    @field_validator("text")
+    @classmethod
+    def validate_text(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("text must not be blank")
+        return value
+
+
+class CommentPayload(CommentTextPayload):
+    path: str = Field(min_length=1)
+    side: DiffSide
+    start_line: int = Field(ge=1)
+    end_line: int = Field(ge=1)
+
+    @model_validator(mode="after")
+    def validate_range(self) -> "CommentPayload":
+        if self.end_line < self.start_line:
+            raise ValueError("end_line must not be before start_line")
+        return self
+
+
+class LatencyBucket(BaseModel):
+    # Upper bound of the bucket; None for the open-ended last one.
+    le_ms: float | None
+    count: int
+
+
+class CommandStats(BaseModel):
+    name: str
+    count: int
+    # Non-zero exits, or error responses for requests.
+    failures: int
+    total_ms: float
+    max_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    output_bytes: int
+    buckets: list[LatencyBucket]
+
+
+class MetricsResponse(BaseModel):
+    commands: list[CommandStats]
+    requests: list[CommandStats]
+
+
+class RepoEntry(BaseModel):
+    # Used in URLs: /r/<id>/.
+    id: str
+    name: str
+    path: str
+    url: str
+    default: bool
+
+
+class ReposResponse(BaseModel):
+    repos: list[RepoEntry]
@@ -9,6 +9,21 @@ from pydantic import BaseModel, Field, field_validator
 
 DEFAULT_PROMPT_TEMPLATE = "Here's the review of the user:\n\n{{comments}}"
 
+# Lockfiles and build output. A glob without a slash matches the file name,
+# one with a slash the whole path.
+DEFAULT_COLLAPSE_GLOBS = [
+    "*.lock",
+    "package-lock.json",
+    "pnpm-lock.yaml",
+    "bun.lockb",
+    "go.sum",
+    "*.min.js",
+    "*.min.css",
+    "*.map",
+]
+DEFAULT_MAX_FILE_BYTES = 512 * 1024
+DEFAULT_MAX_CHANGED_LINES = 5000
+
 
 class DiffStyle(StrEnum):
     INLINE = "inline"
@@ -28,6 +43,12 @@ class PromptOptions(BaseModel):
 
 class DiffOptions(BaseModel):
     style: DiffStyle = DiffStyle.TWO_SIDES
+    # Files shown collapsed, as stats only, until asked for.
+    collapse_globs: list[str] = Field(
+        default_factory=lambda: list(DEFAULT_COLLAPSE_GLOBS)
+    )
+    max_file_bytes: int = DEFAULT_MAX_FILE_BYTES
+    max_changed_lines: int = DEFAULT_MAX_CHANGED_LINES
 
 
 class AppOptions(BaseModel):
@@ -51,16 +72,27 @@ class AppOptions(BaseModel):
             if isinstance(template, str) and template.strip():
                 prompt_template = template
 
-        diff_style = defaults.diff.style
+        diff_options = defaults.diff
         diff = data.get("diff")
         if isinstance(diff, dict):
             style = diff.get("style")
             if style in {DiffStyle.INLINE.value, DiffStyle.TWO_SIDES.value}:
-                diff_style = DiffStyle(style)
+                diff_options.style = DiffStyle(style)
+            globs = diff.get("collapse_globs")
+            if isinstance(globs, list):
+                diff_options.collapse_globs = [
+                    glob.strip()
+                    for glob in globs
+                    if isinstance(glob, str) and glob.strip()
+                ]
+            for name in ("max_file_bytes", "max_changed_lines"):
+                limit = diff.get(name)
+                if isinstance(limit, int) and not isinstance(limit, bool) and limit > 0:
+                    setattr(diff_options, name, limit)
 
         return cls(
             prompt=PromptOptions(template=prompt_template),
-            diff=DiffOptions(style=diff_style),
+            diff=diff_options,
         )
 
     def to_dict(self) -> dict:
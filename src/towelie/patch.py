@@ -0,0 +1,355 @@
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+import re
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+INDEX_LINE = re.compile(r"^index ([0-9a-f]+)\.\.([0-9a-f]+)")
+
+# Options every diff the parser reads must be run with: user config such as
+# color.diff, diff.noprefix, diff.mnemonicPrefix or diff.external would
+# otherwise change the format.
+DIFF_FORMAT = ("--no-color", "--no-ext-diff", "--src-prefix=a/", "--dst-prefix=b/")
+
+_ESCAPES = {"a": 7, "b": 8, "t": 9, "n": 10, "v": 11, "f": 12, "r": 13}
+
+
+def unquote_path(path: str) -> str:
+    """Decode a path git quoted because it contains unusual characters."""
+    if len(path) < 2 or not (path.startswith('"') and path.endswith('"')):
+        return path
+    raw = bytearray()
+    body = path[1:-1]
+    i = 0
+    while i < len(body):
+        ch = body[i]
+        if ch != "\\":
+            raw += ch.encode()
+            i += 1
+            continue
+        nxt = body[i + 1 : i + 2]
+        if nxt in _ESCAPES:
+            raw.append(_ESCAPES[nxt])
+            i += 2
+        elif nxt.isdigit():
+            raw.append(int(body[i + 1 : i + 4], 8))
+            i += 4
+        else:
+            raw += nxt.encode()
+            i += 2
+    return raw.decode(errors="replace")
+
+
+def _strip_prefix(path: str, prefix: str) -> str:
+    """Drop the side's prefix DIFF_FORMAT asks for; nothing else is guessed."""
+    return unquote_path(path).removeprefix(prefix)
+
+
+@dataclass(slots=True)
+class Hunk:
+    old_start: int
+    old_lines: int
+    new_start: int
+    new_lines: int
+    # Offsets of the hunk (header line included) inside FilePatch.text.
+    start: int
+    end: int
+
+
+@dataclass(slots=True)
+class FilePatch:
+    old_path: str
+    new_path: str
+    status: str = "M"
+    binary: bool = False
+    additions: int = 0
+    deletions: int = 0
+    old_oid: str = ""
+    new_oid: str = ""
+    text: str = ""
+    hunks: list[Hunk] = field(default_factory=list)
+
+    @property
+    def path(self) -> str:
+        return self.old_path if self.status == "D" else self.new_path
+
+    def hunk_text(self, hunk: Hunk) -> str:
+        return self.text[hunk.start : hunk.end]
+
+
+class PatchParser:
+    """Incremental parser for ``git diff`` output.
+
+    Lines are fed one at a time (with their trailing newline) and each
+    file is handed back as soon as the next one starts, so callers never
+    need to hold more than one file's patch in memory.
+    """
+
+    def __init__(self):
+        self._current: FilePatch | None = None
+        self._parts: list[str] = []
+        self._offset = 0
+        self._in_hunks = False
+
+    def feed(self, line: str) -> FilePatch | None:
+        done = None
+        if line.startswith("diff --git "):
+            done = self.finish()
+            old_path, new_path = self._paths_from_header(line[11:].rstrip("\n"))
+            self._current = FilePatch(old_path=old_path, new_path=new_path)
+        elif self._current is None:
+            return None
+        else:
+            self._parse_line(self._current, line)
+
+        self._parts.append(line)
+        self._offset += len(line)
+        return done
+
+    def finish(self) -> FilePatch | None:
+        patch = self._current
+        if patch is not None:
+            patch.text = "".join(self._parts)
+            if patch.hunks:
+                patch.hunks[-1].end = len(patch.text)
+        self._current = None
+        self._parts = []
+        self._offset = 0
+        self._in_hunks = False
+        return patch
+
+    def _parse_line(self, patch: FilePatch, line: str) -> None:
+        if self._in_hunks:
+            first = line[:1]
+            if first == "+":
+                patch.additions += 1
+                return
+            if first == "-":
+                patch.deletions += 1
+                return
+            if first in (" ", "\\"):
+                return
+
+        match = HUNK_HEADER.match(line)
+        if match:
+            if patch.hunks:
+                patch.hunks[-1].end = self._offset
+            patch.hunks.append(
+                Hunk(
+                    old_start=int(match[1]),
+                    old_lines=int(match[2]) if match[2] is not None else 1,
+                    new_start=int(match[3]),
+                    new_lines=int(match[4]) if match[4] is not None else 1,
+                    start=self._offset,
+                    end=self._offset,
+                )
+            )
+            self._in_hunks = True
+            return
+
+        line = line.rstrip("\n")
+        if line.startswith("new file mode "):
+            patch.status = "A"
+        elif line.startswith("deleted file mode "):
+            patch.status = "D"
+        elif line.startswith("rename from "):
+            patch.status = "R"
+            patch.old_path = unquote_path(line[12:])
+        elif line.startswith("rename to "):
+            patch.new_path = unquote_path(line[10:])
+        elif line.startswith("copy from "):
+            patch.status = "C"
+            patch.old_path = unquote_path(line[10:])
+        elif line.startswith("copy to "):
+            patch.new_path = unquote_path(line[8:])
+        elif line.startswith("--- ") and line[4:] != "/dev/null":
+            # Paths containing spaces are terminated by a tab.
+            patch.old_path = _strip_prefix(line[4:].removesuffix("\t"), "a/")
+        elif line.startswith("+++ ") and line[4:] != "/dev/null":
+            patch.new_path = _strip_prefix(line[4:].removesuffix("\t"), "b/")
+        elif line.startswith(("Binary files ", "GIT binary patch")):
+            patch.binary = True
+        else:
+            index = INDEX_LINE.match(line)
+            if index:
+                patch.old_oid, patch.new_oid = index[1], index[2]
+
+    @staticmethod
+    def _paths_from_header(header: str) -> tuple[str, str]:
+        if header.startswith('"'):
+            end = header.index('"', 1)
+            while header[end - 1] == "\\":
+                end = header.index('"', end + 1)
+            old, new = header[: end + 1], header[end + 2 :]
+            return _strip_prefix(old, "a/"), _strip_prefix(new, "b/")
+        # Without renames both halves name the same path, so split evenly.
+        half = (len(header) - 1) // 2
+        if header[half] == " " and header[2:half] == header[half + 3 :]:
+            return header[2:half], header[half + 3 :]
+        old, _, new = header.partition(" b/")
+        return _strip_prefix(old, "a/"), new
+
+
+def iter_lines(text: str) -> Iterator[str]:
+    """Split on ``\\n`` only; patches may carry ``\\r`` or form feeds in content."""
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start)
+        end = len(text) if end == -1 else end + 1
+        yield text[start:end]
+        start = end
+
+
+@dataclass
+class LineIndex:
+    """Start offset of every line of a blob, for cheap line-range reads."""
+
+    data: bytes
+    offsets: list[int]
+
+    @classmethod
+    def build(cls, data: bytes) -> "LineIndex":
+        offsets = [0]
+        pos = data.find(b"\n")
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = data.find(b"\n", pos + 1)
+        if offsets[-1] == len(data) and len(offsets) > 1:
+            # A trailing newline ends the last line rather than starting one.
+            offsets.pop()
+        return cls(data=data, offsets=offsets)
+
+    @property
+    def line_count(self) -> int:
+        return len(self.offsets) if self.data else 0
+
+    def lines(self, start: int, end: int) -> list[str]:
+        """Lines ``start`` to ``end`` inclusive, numbered from 1."""
+        start = max(start, 1)
+        end = min(end, self.line_count)
+        if start > end:
+            return []
+        stop = self.offsets[end] if end < len(self.offsets) else len(self.data)
+        text = self.data[self.offsets[start - 1] : stop].decode(errors="replace")
+        return text.removesuffix("\n").split("\n")
+
+
+def parse_patch(text: str) -> list[FilePatch]:
+    parser = PatchParser()
+    files = []
+    for line in iter_lines(text):
+        done = parser.feed(line)
+        if done is not None:
+            files.append(done)
+    last = parser.finish()
+    if last is not None:
+        files.append(last)
+    return files
+
+
+def patches_size(patches: list[FilePatch]) -> int:
+    """Rough bytes ``patches`` keep alive, without walking every hunk."""
+    return sum(
+        len(patch.text)
+        + len(patch.old_path)
+        + len(patch.new_path)
+        + 200
+        + 100 * len(patch.hunks)
+        for patch in patches
+    )
+
+
+@dataclass(slots=True)
+class FileStat:
+    old_path: str
+    new_path: str
+    status: str
+    binary: bool
+    additions: int
+    deletions: int
+    old_oid: str
+    new_oid: str
+
+    @property
+    def path(self) -> str:
+        return self.old_path if self.status == "D" else self.new_path
+
+
+def patch_stats(patches: list[FilePatch], worktree: bool = False) -> list[FileStat]:
+    """File records for patches already parsed, without a second diff.
+
+    ``worktree`` says the new side is the working tree. Its ``index`` line
+    then names a blob git never wrote, so the oid is zeroed as ``--raw``
+    would print it.
+    """
+    return [
+        FileStat(
+            old_path=patch.old_path,
+            new_path=patch.new_path,
+            status=patch.status,
+            binary=patch.binary,
+            additions=patch.additions,
+            deletions=patch.deletions,
+            old_oid=patch.old_oid,
+            new_oid="0" * len(patch.new_oid) if worktree else patch.new_oid,
+        )
+        for patch in patches
+    ]
+
+
+def parse_summary(output: bytes) -> list[FileStat]:
+    """Parse ``git diff --raw --numstat -z`` output.
+
+    Git prints every raw record first and then one numstat record per file
+    in the same order, so the two halves are zipped together.
+    """
+    tokens = output.decode(errors="replace").split("\0")
+    stats: list[FileStat] = []
+    i = 0
+    while i < len(tokens) and tokens[i].startswith(":"):
+        _, _, old_oid, new_oid, status = tokens[i][1:].split(" ")
+        letter = status[:1]
+        if letter in ("R", "C"):
+            old_path, new_path = tokens[i + 1], tokens[i + 2]
+            i += 3
+        else:
+            old_path = new_path = tokens[i + 1]
+            i += 2
+        if letter not in ("A", "D", "R", "C"):
+            letter = "M"
+        stats.append(
+            FileStat(
+                old_path=old_path,
+                new_path=new_path,
+                status=letter,
+                binary=False,
+                additions=0,
+                deletions=0,
+                old_oid=old_oid,
+                new_oid=new_oid,
+            )
+        )
+
+    for stat in stats:
+        if i >= len(tokens) or not tokens[i]:
+            break
+        added, deleted, path = tokens[i].split("\t", 2)
+        # Renames and copies leave the path empty and list both names after.
+        i += 1 if path else 3
+        if added == "-":
+            stat.binary = True
+        else:
+            stat.additions, stat.deletions = int(added), int(deleted)
+    return stats
+
+
+def parse_raw_patch(output: bytes) -> tuple[list[FileStat], str]:
+    """Split ``git diff --raw -z -p`` output into file records and patch text.
+
+    Raw records come first, each field NUL-terminated, and an empty record
+    separates them from the patch. Line counts are left at zero.
+    """
+    boundary = output.find(b"\0\0")
+    if boundary == -1:
+        return parse_summary(output), ""
+    stats = parse_summary(output[: boundary + 1])
+    return stats, output[boundary + 2 :].decode(errors="replace")
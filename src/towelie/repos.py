@@ -0,0 +1,99 @@
+import os
+from pathlib import Path
+import re
+import subprocess
+
+# Worktree roots the server hosts, joined with os.pathsep; set by the CLI.
+REPOS_ENV = "TOWELIE_REPOS"
+
+# When any of these is set git may not look for ``.git`` the usual way.
+_GIT_DISCOVERY_ENV = ("GIT_DIR", "GIT_WORK_TREE", "GIT_CEILING_DIRECTORIES")
+
+
+def _gitdir_of(dot_git: Path) -> Path | None:
+    """The git dir a ``.git`` directory or ``gitdir:`` file points to."""
+    if dot_git.is_dir():
+        return dot_git if (dot_git / "HEAD").is_file() else None
+    try:
+        content = dot_git.read_text().strip()
+    except (OSError, UnicodeDecodeError):
+        return None
+    if not content.startswith("gitdir:"):
+        return None
+    target = Path(content.removeprefix("gitdir:").strip())
+    return (dot_git.parent / target).resolve()
+
+
+def find_git_root(start: Path) -> Path | None:
+    """Top of the worktree containing ``start``, found without running git.
+
+    Covers plain checkouts, linked worktrees and submodules. Returns None
+    whenever git's own discovery could disagree, e.g. inside a git dir or
+    with ``GIT_DIR`` set, so callers can fall back to asking git.
+    """
+    if any(name in os.environ for name in _GIT_DISCOVERY_ENV):
+        return None
+    start = start.resolve()
+    if ".git" in start.parts:
+        return None
+    for directory in (start, *start.parents):
+        if _gitdir_of(directory / ".git") is not None:
+            return directory
+    return None
+
+
+def git_toplevel(start: Path) -> Path | None:
+    """``find_git_root``, falling back to ``git rev-parse`` when it can't tell."""
+    root = find_git_root(start)
+    if root is not None:
+        return root
+    result = subprocess.run(
+        ["git", "rev-parse", "--show-toplevel"],
+        cwd=start,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return None
+    return Path(result.stdout.strip())
+
+
+def list_worktrees(git_root: Path) -> list[Path]:
+    """Every worktree of the repository ``git_root`` belongs to, main first.
+
+    Read from the common git dir, like ``git worktree list``; worktrees
+    whose directory has gone missing are skipped.
+    """
+    git_dir = _gitdir_of(git_root / ".git")
+    if git_dir is None:
+        return [git_root]
+    try:
+        common = (git_dir / (git_dir / "commondir").read_text().strip()).resolve()
+    except OSError:
+        common = git_dir
+    roots = []
+    if common.name == ".git" and (common.parent / ".git").is_dir():
+        roots.append(common.parent)
+    try:
+        entries = sorted((common / "worktrees").iterdir())
+    except OSError:
+        entries = []
+    for entry in entries:
+        try:
+            dot_git = Path((entry / "gitdir").read_text().strip())
+        except OSError:
+            continue
+        if dot_git.exists():
+            roots.append(dot_git.parent)
+    if git_root not in roots:
+        roots.insert(0, git_root)
+    return roots
+
+
+def repo_slug(git_root: Path, taken: set[str]) -> str:
+    """URL-safe id for a repository, unique among ``taken``."""
+    base = re.sub(r"[^A-Za-z0-9._-]+", "-", git_root.name).strip("-.") or "repo"
+    slug, n = base, 2
+    while slug in taken:
+        slug, n = f"{base}-{n}", n + 1
+    return slug
@@ -0,0 +1,77 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+import importlib
+import sys
+import time
+
+# Imported in this order so each line shows only what it adds on top of the
+# previous ones; towelie.app's share is then the app itself.
+PROFILED_IMPORTS = ("uvicorn", "pydantic", "starlette", "fastapi", "towelie.app")
+
+
+class StartupProfile:
+    """Phase timings from CLI entry until the first page's data is ready."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases: list[tuple[str, float, float]] = []
+        self.reported = False
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, start - self.origin, time.perf_counter() - start))
+
+    def mark(self, name: str) -> None:
+        """Record a moment rather than a span, e.g. the server accepting."""
+        self.phases.append((name, time.perf_counter() - self.origin, 0.0))
+
+    def import_modules(self) -> None:
+        for module in PROFILED_IMPORTS:
+            with self.phase(f"import {module}"):
+                importlib.import_module(module)
+
+    def report(self) -> None:
+        if self.reported:
+            return
+        self.reported = True
+        print("\n  startup profile (ms since launch / duration)", file=sys.stderr)
+        for name, offset, duration in self.phases:
+            spent = f"{duration * 1000:8.1f}" if duration else " " * 8
+            print(f"  {offset * 1000:8.1f} {spent}  {name}", file=sys.stderr)
+        print(
+            "  per-module import detail: python -X importtime -m towelie\n",
+            file=sys.stderr,
+        )
+
+
+PROFILE: StartupProfile | None = None
+
+
+def enable() -> StartupProfile:
+    global PROFILE
+    PROFILE = StartupProfile()
+    return PROFILE
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time ``name`` when --profile-startup is on; free otherwise."""
+    if PROFILE is None:
+        yield
+        return
+    with PROFILE.phase(name):
+        yield
+
+
+def mark(name: str) -> None:
+    if PROFILE is not None:
+        PROFILE.mark(name)
+
+
+def report() -> None:
+    if PROFILE is not None:
+        PROFILE.report()
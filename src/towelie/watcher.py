@@ -0,0 +1,460 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Coroutine, Iterable
+from dataclasses import dataclass
+import errno
+import os
+from pathlib import Path
+import struct
+
+from towelie.cache import RepoState
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+# Files under the git dir whose changes affect diffs; lock files are skipped
+# because git renames them over the real file when it is done.
+_GIT_DIR_FILES = {"HEAD", "index", "packed-refs", "ORIG_HEAD", "MERGE_HEAD"}
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    generation: int
+    paths: tuple[str, ...] = ()
+    # HEAD, a ref or the index changed, so commit lists may be stale too.
+    refs: bool = False
+    # Changes were dropped; everything should be refetched.
+    full: bool = False
+
+    def to_dict(self) -> dict:
+        return {
+            "generation": self.generation,
+            "paths": list(self.paths),
+            "refs": self.refs,
+            "full": self.full,
+        }
+
+
+InotifyListener = Callable[[Path, str, int], None]
+
+
+class _Inotify:
+    """One inotify instance whose watches can be shared by several listeners.
+
+    Watching a directory twice, e.g. the common git dir of two worktrees,
+    reuses the existing watch and delivers its events to both listeners.
+    """
+
+    def __init__(self):
+        # Imported here so servers that never watch skip loading ctypes.
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._get_errno = ctypes.get_errno
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs: dict[int, Path] = {}
+        self.watched: dict[Path, int] = {}
+        self.listeners: dict[int, set[InotifyListener]] = {}
+
+    def watch(self, directory: Path, listener: InotifyListener) -> None:
+        wd = self.watched.get(directory)
+        if wd is None:
+            wd = self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                error = self._get_errno()
+                raise OSError(error, os.strerror(error), str(directory))
+            self.dirs[wd] = directory
+            self.watched[directory] = wd
+        self.listeners.setdefault(wd, set()).add(listener)
+
+    def unwatch(self, listener: InotifyListener) -> None:
+        """Drop ``listener``'s watches, removing those nobody else uses."""
+        for wd, listeners in list(self.listeners.items()):
+            listeners.discard(listener)
+            if not listeners:
+                self._forget(wd)
+                self._rm_watch(self.fd, wd)
+
+    def _forget(self, wd: int) -> None:
+        directory = self.dirs.pop(wd, None)
+        if directory is not None:
+            self.watched.pop(directory, None)
+        self.listeners.pop(wd, None)
+
+    def read(self) -> None:
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(buf, offset)
+            start = offset + _EVENT_HEADER.size
+            name = os.fsdecode(buf[start : start + length].rstrip(b"\0"))
+            offset = start + length
+            if mask & IN_IGNORED:
+                self._forget(wd)
+                continue
+            if mask & IN_Q_OVERFLOW:
+                for listener in set().union(*self.listeners.values()):
+                    listener(Path(), name, mask)
+                continue
+            directory = self.dirs.get(wd)
+            if directory is not None:
+                for listener in list(self.listeners.get(wd, ())):
+                    listener(directory, name, mask)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class WatchHub:
+    """The inotify instance and event-loop reader shared by repo watchers.
+
+    Serving many worktrees then costs one file descriptor and one reader
+    instead of one per repository, and directories they share are watched
+    once.
+    """
+
+    def __init__(self):
+        self._inotify: _Inotify | None = None
+        self._users = 0
+
+    def acquire(self) -> _Inotify:
+        if self._inotify is None:
+            inotify = _Inotify()
+            asyncio.get_running_loop().add_reader(inotify.fd, inotify.read)
+            self._inotify = inotify
+        self._users += 1
+        return self._inotify
+
+    def release(self, listener: InotifyListener) -> None:
+        if self._inotify is None:
+            return
+        self._inotify.unwatch(listener)
+        self._users -= 1
+        if self._users == 0:
+            self.close()
+
+    def close(self) -> None:
+        if self._inotify is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+            self._users = 0
+
+
+class RepoWatcher:
+    """Watches the worktree and git dir and publishes debounced change events.
+
+    Uses inotify where available and falls back to polling file stats.
+    ``generation`` is bumped as soon as a change is seen, so caches keyed on
+    it go stale before the debounced event is even published.
+    """
+
+    def __init__(
+        self,
+        state: RepoState,
+        tracked_files: Callable[[], Awaitable[list[str]]],
+        debounce: float = 0.15,
+        max_delay: float = 1.0,
+        poll_interval: float = 1.0,
+        hub: WatchHub | None = None,
+    ):
+        self.state = state
+        self.tracked_files = tracked_files
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.generation = 0
+        self.active = False
+        self._hub = hub or WatchHub()
+        self._inotify: _Inotify | None = None
+        self._poll_task: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+        # Worktree directories holding tracked files; others are not watched.
+        self._tracked_dirs: set[Path] = set()
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._first_pending = 0.0
+        self._pending_paths: set[str] = set()
+        self._pending_refs = False
+        self._pending_full = False
+        self._subscribers: set[asyncio.Queue[ChangeEvent]] = set()
+
+    @property
+    def mode(self) -> str:
+        if not self.active:
+            return "off"
+        return "inotify" if self._inotify is not None else "polling"
+
+    async def start(self) -> None:
+        try:
+            self._inotify = self._hub.acquire()
+            await self._watch_tree()
+        except (OSError, AttributeError):
+            self._fall_back_to_polling()
+        self.active = True
+
+    def _fall_back_to_polling(self) -> None:
+        if self._inotify is not None:
+            self._hub.release(self._on_inotify_event)
+            self._inotify = None
+        if self._poll_task is None:
+            self._poll_task = asyncio.create_task(self._poll())
+
+    async def close(self) -> None:
+        self.active = False
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        if self._inotify is not None:
+            self._hub.release(self._on_inotify_event)
+            self._inotify = None
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+        for task in self._tasks:
+            task.cancel()
+
+    def current_generation(self) -> int:
+        """Generation including writes the event loop hasn't read yet."""
+        if self._inotify is not None:
+            self._inotify.read()
+        return self.generation
+
+    def subscribe(self) -> asyncio.Queue[ChangeEvent]:
+        queue: asyncio.Queue[ChangeEvent] = asyncio.Queue(maxsize=64)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue[ChangeEvent]) -> None:
+        self._subscribers.discard(queue)
+
+    async def _watch_tree(self) -> None:
+        tracked = await self.tracked_files()
+        dirs = await asyncio.to_thread(self._parent_dirs, tracked)
+        self._tracked_dirs = set(dirs)
+        self._watch(await asyncio.to_thread(self._existing_dirs, dirs))
+
+    def _parent_dirs(self, tracked: list[str]) -> set[Path]:
+        """The root and every directory holding a tracked file."""
+        git_root = self.state.git_root
+        dirs = {git_root}
+        for rel in tracked:
+            parent = (git_root / rel).parent
+            while parent not in dirs:
+                dirs.add(parent)
+                parent = parent.parent
+        return dirs
+
+    def _existing_dirs(self, dirs: set[Path]) -> list[Path]:
+        dirs = dirs | {self.state.git_dir, self.state.common_dir}
+        for dirpath, _, _ in os.walk(self.state.common_dir / "refs"):
+            dirs.add(Path(dirpath))
+        return [directory for directory in dirs if directory.is_dir()]
+
+    def _watch(self, directories: Iterable[Path]) -> None:
+        """Watch ``directories``; running out of watches raises ENOSPC."""
+        if self._inotify is None:
+            return
+        failed = False
+        for directory in directories:
+            try:
+                self._inotify.watch(directory, self._on_inotify_event)
+            except OSError as error:
+                if error.errno == errno.ENOSPC:
+                    raise
+                failed = True
+        if failed:
+            # Changes in a directory we couldn't watch would go unseen.
+            self._record(full=True)
+
+    def _wanted_dir(self, directory: Path) -> bool:
+        """Ignored and untracked-only directories can't change a diff."""
+        return directory in self._tracked_dirs or directory.is_relative_to(
+            self.state.common_dir / "refs"
+        )
+
+    def _on_inotify_event(self, directory: Path, name: str, mask: int) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self._record(full=True)
+            return
+        path = directory / name if name else directory
+        created = bool(mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO))
+        if created and self._wanted_dir(path):
+            self._spawn(self._watch_new_dir(path))
+        git_dirs = (self.state.git_dir, self.state.common_dir)
+        if directory in git_dirs or directory.is_relative_to(
+            self.state.common_dir / "refs"
+        ):
+            if name.endswith(".lock"):
+                return
+            if directory in git_dirs and name not in _GIT_DIR_FILES:
+                return
+            self._record(refs=True)
+            return
+
+        if mask & IN_ISDIR or not name:
+            return
+        try:
+            rel = path.relative_to(self.state.git_root)
+        except ValueError:
+            return
+        self._record(paths=[rel.as_posix()])
+
+    async def _watch_new_dir(self, directory: Path) -> None:
+        in_refs = directory.is_relative_to(self.state.common_dir / "refs")
+        pending = [directory]
+        try:
+            while pending and self._inotify is not None:
+                # Watch before listing: files may land in a new directory
+                # before its watch exists.
+                self._watch(pending)
+                pending, files = await asyncio.to_thread(self._scan, pending)
+                if in_refs and files:
+                    self._record(refs=True)
+                elif files:
+                    self._record(
+                        paths=[
+                            path.relative_to(self.state.git_root).as_posix()
+                            for path in files
+                        ]
+                    )
+        except OSError:
+            self._fall_back_to_polling()
+            self._record(full=True)
+
+    def _scan(self, directories: list[Path]) -> tuple[list[Path], list[Path]]:
+        """Subdirectories worth watching and files directly in ``directories``."""
+        subdirs = []
+        files = []
+        for directory in directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                # Gone again; its parent's events cover it.
+                continue
+            for entry in entries:
+                path = Path(entry.path)
+                if not entry.is_dir(follow_symlinks=False):
+                    files.append(path)
+                elif self._wanted_dir(path):
+                    subdirs.append(path)
+        return subdirs, files
+
+    async def _rewatch_tree(self) -> None:
+        try:
+            await self._watch_tree()
+        except OSError:
+            self._fall_back_to_polling()
+            self._record(full=True)
+
+    def _spawn(self, coro: Coroutine[None, None, None]) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _record(
+        self, paths: list[str] | None = None, refs: bool = False, full: bool = False
+    ) -> None:
+        self.generation += 1
+        if paths:
+            self._pending_paths.update(paths)
+        self._pending_refs |= refs
+        self._pending_full |= full
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._flush_handle is None:
+            self._first_pending = now
+        else:
+            self._flush_handle.cancel()
+        delay = min(self.debounce, self._first_pending + self.max_delay - now)
+        self._flush_handle = loop.call_later(max(delay, 0), self._flush)
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        event = ChangeEvent(
+            generation=self.generation,
+            paths=tuple(sorted(self._pending_paths)),
+            refs=self._pending_refs,
+            full=self._pending_full,
+        )
+        self._pending_paths.clear()
+        self._pending_refs = self._pending_full = False
+        if event.refs and self._inotify is not None:
+            # Newly tracked files may live in directories we don't watch yet.
+            self._spawn(self._rewatch_tree())
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(ChangeEvent(generation=self.generation, full=True))
+
+    async def _poll(self) -> None:
+        refs = (
+            await asyncio.to_thread(self.state.refs_token),
+            self.state.index_token(),
+        )
+        stats = await asyncio.to_thread(self._stat_tracked, await self.tracked_files())
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            next_refs = (
+                await asyncio.to_thread(self.state.refs_token),
+                self.state.index_token(),
+            )
+            tracked = await self.tracked_files()
+            next_stats = await asyncio.to_thread(self._stat_tracked, tracked)
+            changed = [
+                path
+                for path in stats.keys() | next_stats.keys()
+                if stats.get(path) != next_stats.get(path)
+            ]
+            if changed or next_refs != refs:
+                self._record(paths=changed, refs=next_refs != refs)
+            refs, stats = next_refs, next_stats
+
+    def _stat_tracked(self, tracked: list[str]) -> dict[str, tuple[int, int, int]]:
+        stats = {}
+        for rel in tracked:
+            try:
+                st = os.lstat(self.state.git_root / rel)
+            except OSError:
+                continue
+            stats[rel] = (st.st_ino, st.st_size, st.st_mtime_ns)
+        return stats
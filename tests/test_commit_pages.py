@@ -0,0 +1,192 @@
+"""Commit listing: cursors, the in-process log walk, and ``--skip`` paging."""
+
+import asyncio
+import os
+from pathlib import Path
+import subprocess
+
+import pytest
+
+from towelie.app import ALL_CHANGES, CommitCursor, Project, _walk_by_date
+
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "Towelie",
+    "GIT_AUTHOR_EMAIL": "towelie@example.com",
+    "GIT_COMMITTER_NAME": "Towelie",
+    "GIT_COMMITTER_EMAIL": "towelie@example.com",
+    "GIT_CONFIG_NOSYSTEM": "1",
+}
+
+SHA_A = "a" * 40
+SHA_B = "0123456789abcdef0123456789abcdef01234567"
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        CommitCursor(tip=SHA_A, base=SHA_B, offset=0),
+        CommitCursor(tip=SHA_B, base=SHA_A, offset=50),
+        CommitCursor(tip=SHA_A, base=SHA_A, offset=123456789),
+    ],
+)
+def test_cursor_round_trip(cursor: CommitCursor):
+    encoded = cursor.encode()
+    assert "=" not in encoded
+    assert CommitCursor.decode(encoded) == cursor
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "",
+        "not a cursor",
+        CommitCursor(tip="abc", base=SHA_B, offset=0).encode(),
+        CommitCursor(tip=SHA_A, base="HEAD", offset=0).encode(),
+        CommitCursor(tip=SHA_A, base=SHA_B, offset=-1).encode(),
+        CommitCursor(tip="g" * 40, base=SHA_B, offset=0).encode(),
+    ],
+)
+def test_cursor_rejects_garbage(cursor: str):
+    with pytest.raises(ValueError):
+        CommitCursor.decode(cursor)
+
+
+# (case, tip, {commit: (date, parents)}, expected order)
+WALKS = [
+    ("linear", "c", {"c": (3, ["b"]), "b": (2, ["a"]), "a": (1, [])}, ["c", "b", "a"]),
+    (
+        "merge interleaves by date",
+        "m",
+        {
+            "m": (9, ["x2", "y2"]),
+            "x2": (8, ["x1"]),
+            "y2": (7, ["y1"]),
+            "x1": (6, ["base"]),
+            "y1": (5, ["base"]),
+        },
+        ["m", "x2", "y2", "x1", "y1"],
+    ),
+    (
+        "date ties keep insertion order",
+        "m",
+        {"m": (5, ["p", "q"]), "p": (4, []), "q": (4, [])},
+        ["m", "p", "q"],
+    ),
+    (
+        "older parent reached twice is listed once",
+        "m",
+        {"m": (5, ["p", "q"]), "p": (4, ["r"]), "q": (3, ["r"]), "r": (1, [])},
+        ["m", "p", "q", "r"],
+    ),
+    ("tip outside the range", "z", {"a": (1, [])}, []),
+]
+
+
+@pytest.mark.parametrize(
+    ("tip", "graph", "order"),
+    [walk[1:] for walk in WALKS],
+    ids=[walk[0] for walk in WALKS],
+)
+def test_walk_by_date(
+    tip: str, graph: dict[str, tuple[int, list[str]]], order: list[str]
+):
+    dates = {commit: date for commit, (date, _) in graph.items()}
+    parents = {commit: parents for commit, (_, parents) in graph.items()}
+    assert list(_walk_by_date(tip, dates, parents)) == order
+
+
+def git(repo: Path, *args: str, input: bytes | None = None) -> str:
+    env = {**os.environ, **GIT_ENV, "HOME": str(repo.parent)}
+    result = subprocess.run(
+        ["git", *args], cwd=repo, env=env, input=input, capture_output=True, check=True
+    )
+    return result.stdout.decode()
+
+
+@pytest.fixture(scope="module")
+def repo(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """``feature`` forks ``main``, merges a side branch, and sees date ties."""
+    repo = tmp_path_factory.mktemp("commits") / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q", "-b", "main")
+    commands = []
+
+    def commit(ref: str, mark: int, date: int, parents: list[int]) -> None:
+        commands.extend([f"commit {ref}", f"mark :{mark}"])
+        commands.append(f"committer Towelie <towelie@example.com> {date} +0000")
+        commands.append(f"data {len(str(mark))}\n{mark}")
+        commands.extend(
+            f"{'from' if i == 0 else 'merge'} :{p}" for i, p in enumerate(parents)
+        )
+        commands.extend([f"M 644 inline file-{mark}.txt", "data 2\nx\n", ""])
+
+    commit("refs/heads/main", 1, 1700000000, [])
+    # Seven commits on feature, two of them on a side branch merged back in,
+    # with a date tie so git's insertion order decides.
+    commit("refs/heads/feature", 2, 1700000010, [1])
+    commit("refs/heads/side", 3, 1700000020, [2])
+    commit("refs/heads/side", 4, 1700000040, [3])
+    commit("refs/heads/feature", 5, 1700000030, [2])
+    commit("refs/heads/feature", 6, 1700000040, [5])
+    commit("refs/heads/feature", 7, 1700000050, [6, 4])
+    commit("refs/heads/feature", 8, 1700000060, [7])
+    commit("refs/heads/main", 9, 1700000070, [1])
+    git(repo, "fast-import", "--quiet", input="\n".join(commands).encode())
+    git(repo, "checkout", "-q", "main")
+    return repo
+
+
+def test_walk_matches_git_log(repo: Path):
+    expected = git(repo, "log", "--format=%H", "feature", "^main").split()
+    output = git(repo, "log", "--format=%H %P %ct", "feature", "^main")
+    dates, parents = {}, {}
+    for line in output.splitlines():
+        commit, *rest, date = line.split()
+        dates[commit], parents[commit] = int(date), rest
+    tip = git(repo, "rev-parse", "feature").strip()
+    assert list(_walk_by_date(tip, dates, parents)) == expected
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7, 10])
+def test_pages_follow_git_log(repo: Path, limit: int):
+    expected = git(repo, "log", "--format=%H", "feature", "^main").split()
+
+    async def pages() -> tuple[list[str], list[int]]:
+        project = Project(git_root=repo)
+        try:
+            listed, sizes, cursor = [], [], None
+            while True:
+                commits, cursor = await project.get_commit_page(
+                    "feature", "main", cursor, limit
+                )
+                # The first page leads with the "All changes" pseudo-commit.
+                hashes = [c.hash for c in commits if c.hash != ALL_CHANGES]
+                listed += hashes
+                sizes.append(len(hashes))
+                if cursor is None:
+                    return listed, sizes
+                # Clients only ever hold the encoded form.
+                cursor = CommitCursor.decode(cursor.encode())
+        finally:
+            await project.close()
+
+    listed, sizes = asyncio.run(pages())
+    assert listed == expected
+    assert all(size == limit for size in sizes[:-1])
+    assert 0 < sizes[-1] <= limit
+
+
+def test_first_page_matches_branch_listing(repo: Path):
+    async def listings():
+        project = Project(git_root=repo)
+        try:
+            (branch,) = await project.get_branch_commits("main", ["feature"], 3)
+            page, cursor = await project.get_commit_page("feature", "main", None, 3)
+            return branch, page, cursor
+        finally:
+            await project.close()
+
+    branch, page, cursor = asyncio.run(listings())
+    assert branch.commits == page
+    assert branch.total_commits == 7
+    assert cursor is not None and branch.next_cursor == cursor.encode()
@@ -0,0 +1,92 @@
+"""``/api/info`` must cost the same number of processes however many
+branches the repository has."""
+
+import asyncio
+from pathlib import Path
+import subprocess
+
+from fastapi.testclient import TestClient
+import pytest
+
+import towelie.app as towelie_app
+
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "Towelie",
+    "GIT_AUTHOR_EMAIL": "towelie@example.com",
+    "GIT_COMMITTER_NAME": "Towelie",
+    "GIT_COMMITTER_EMAIL": "towelie@example.com",
+}
+
+
+def make_repo(root: Path, branch_count: int) -> Path:
+    """A repository with ``main`` and ``branch_count`` one-commit branches."""
+    repo = root / "repo"
+    repo.mkdir()
+    subprocess.run(["git", "init", "-q", "-b", "main"], cwd=repo, check=True)
+    # One fast-import keeps building a thousand branches quick.
+    commands = [
+        "commit refs/heads/main",
+        "mark :1",
+        "committer Towelie <towelie@example.com> 1700000000 +0000",
+        "data 4\nmain",
+        "M 644 inline README.md",
+        "data 6\nhello\n",
+        "",
+    ]
+    for index in range(branch_count):
+        commands += [
+            f"commit refs/heads/feature-{index}",
+            f"committer Towelie <towelie@example.com> {1700000001 + index} +0000",
+            f"data {len(str(index)) + 8}\nfeature {index}",
+            "from :1",
+            f"M 644 inline feature-{index}.txt",
+            "data 2\nx\n",
+            "",
+        ]
+    subprocess.run(
+        ["git", "fast-import", "--quiet"],
+        cwd=repo,
+        input="\n".join(commands).encode(),
+        check=True,
+    )
+    subprocess.run(["git", "checkout", "-q", "main"], cwd=repo, check=True)
+    return repo
+
+
+def info_spawns(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, branch_count: int
+) -> int:
+    repo = make_repo(tmp_path, branch_count)
+    for name, value in GIT_ENV.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv(towelie_app.REPOS_ENV, str(repo))
+    monkeypatch.setenv(towelie_app.CACHE_DIR_ENV, str(tmp_path / "cache"))
+
+    async def no_warm_up(_: towelie_app.Project) -> None:
+        pass
+
+    # Prefetching would spawn git in the background while we count.
+    monkeypatch.setattr(towelie_app, "warm_up", no_warm_up)
+
+    spawns = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def counting(*args, **kwargs):
+        spawns.append(args)
+        return await create_subprocess_exec(*args, **kwargs)
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", counting)
+    with TestClient(towelie_app.app) as client:
+        response = client.get("/api/info")
+    assert response.status_code == 200
+    assert response.json()["total_branches"] == branch_count + 1
+    return len(spawns)
+
+
+def test_info_spawns_do_not_grow_with_branches(
+    tmp_path_factory: pytest.TempPathFactory, monkeypatch: pytest.MonkeyPatch
+):
+    small = info_spawns(tmp_path_factory.mktemp("small"), monkeypatch, 3)
+    large = info_spawns(tmp_path_factory.mktemp("large"), monkeypatch, 1000)
+    assert small == large
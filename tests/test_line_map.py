@@ -0,0 +1,138 @@
+"""Re-anchoring comments onto another version of their file."""
+
+from pathlib import Path
+import subprocess
+
+import pytest
+
+from towelie.comments import Anchor, LineMap, line_count
+from towelie.patch import DIFF_FORMAT, parse_patch
+
+BEFORE = "".join(f"line {i}\n" for i in range(1, 11))
+
+
+def edit(text: str, old: str, new: str) -> str:
+    assert old in text
+    return text.replace(old, new, 1)
+
+
+def line_map(tmp_path: Path, old: bytes, new: bytes) -> LineMap:
+    """Map ``old`` onto ``new`` from a zero-context diff, as the app does."""
+    paths = tmp_path / "old", tmp_path / "new"
+    paths[0].write_bytes(old)
+    paths[1].write_bytes(new)
+    result = subprocess.run(
+        ["git", "diff", *DIFF_FORMAT, "--no-index", "--text", "--unified=0", *paths],
+        capture_output=True,
+    )
+    assert result.returncode in (0, 1)
+    hunks = [
+        hunk for patch in parse_patch(result.stdout.decode()) for hunk in patch.hunks
+    ]
+    return LineMap.from_hunks(hunks, line_count(old), line_count(new))
+
+
+# (case, new version, commented range, expected anchor)
+CASES = [
+    ("unchanged", BEFORE, (4, 5), Anchor(4, 5)),
+    (
+        "insert far above",
+        edit(BEFORE, "line 1\n", "a\nb\nline 1\n"),
+        (4, 5),
+        Anchor(6, 7),
+    ),
+    (
+        "insert just before",
+        edit(BEFORE, "line 4\n", "a\nline 4\n"),
+        (4, 5),
+        Anchor(5, 6),
+    ),
+    (
+        "insert just after",
+        edit(BEFORE, "line 6\n", "a\nline 6\n"),
+        (4, 5),
+        Anchor(4, 5),
+    ),
+    ("insert far below", edit(BEFORE, "line 9\n", "a\nline 9\n"), (4, 5), Anchor(4, 5)),
+    (
+        "insert inside",
+        edit(BEFORE, "line 5\n", "a\nline 5\n"),
+        (4, 5),
+        Anchor(4, 6, True),
+    ),
+    ("delete above", edit(BEFORE, "line 2\nline 3\n", ""), (4, 5), Anchor(2, 3)),
+    ("delete below", edit(BEFORE, "line 7\n", ""), (4, 5), Anchor(4, 5)),
+    ("edit in place", edit(BEFORE, "line 5\n", "five\n"), (4, 5), Anchor(4, 5, True)),
+    ("delete the line", edit(BEFORE, "line 4\n", ""), (4, 4), Anchor(4, 4, True)),
+    (
+        "delete the range",
+        edit(BEFORE, "line 4\nline 5\n", ""),
+        (4, 5),
+        Anchor(4, 4, True),
+    ),
+    (
+        "delete part of the range",
+        edit(BEFORE, "line 5\n", ""),
+        (4, 6),
+        Anchor(4, 5, True),
+    ),
+    (
+        "delete the last lines",
+        edit(BEFORE, "line 9\nline 10\n", ""),
+        (9, 10),
+        Anchor(8, 8, True),
+    ),
+    ("delete everything", "", (4, 5), Anchor(1, 1, True)),
+    (
+        "move the line down",
+        edit(edit(BEFORE, "line 4\n", ""), "line 8\n", "line 8\nline 4\n"),
+        (4, 4),
+        Anchor(4, 4, True),
+    ),
+    (
+        "move another line past it",
+        edit(edit(BEFORE, "line 2\n", ""), "line 8\n", "line 8\nline 2\n"),
+        (4, 5),
+        Anchor(3, 4),
+    ),
+    (
+        "drop the final newline",
+        BEFORE.removesuffix("\n"),
+        (10, 10),
+        Anchor(10, 10, True),
+    ),
+]
+
+
+@pytest.mark.parametrize(
+    ("new", "lines", "anchor"),
+    [case[1:] for case in CASES],
+    ids=[case[0] for case in CASES],
+)
+def test_anchor(tmp_path: Path, new: str, lines: tuple[int, int], anchor: Anchor):
+    mapping = line_map(tmp_path, BEFORE.encode(), new.encode())
+    assert mapping.anchor(*lines) == anchor
+
+
+SURVIVING = [case for case in CASES if not case[3].outdated]
+
+
+@pytest.mark.parametrize(
+    ("new", "lines", "anchor"),
+    [case[1:] for case in SURVIVING],
+    ids=[case[0] for case in SURVIVING],
+)
+def test_unchanged_lines_round_trip(
+    tmp_path: Path, new: str, lines: tuple[int, int], anchor: Anchor
+):
+    """Mapping back from the new version returns unchanged lines home."""
+    back = line_map(tmp_path, new.encode(), BEFORE.encode())
+    assert back.anchor(anchor.start_line, anchor.end_line) == Anchor(*lines)
+
+
+@pytest.mark.parametrize(
+    ("data", "count"),
+    [(b"", 0), (b"a", 1), (b"a\n", 1), (b"a\nb", 2), (b"\n\n", 2)],
+)
+def test_line_count(data: bytes, count: int):
+    assert line_count(data) == count
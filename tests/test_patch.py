@@ -0,0 +1,216 @@
+"""Parsing ``git diff`` output: patches, raw records and numstat."""
+
+import os
+from pathlib import Path
+import subprocess
+
+import pytest
+
+from towelie.patch import (
+    DIFF_FORMAT,
+    FilePatch,
+    FileStat,
+    parse_patch,
+    parse_raw_patch,
+    parse_summary,
+    unquote_path,
+)
+
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "Towelie",
+    "GIT_AUTHOR_EMAIL": "towelie@example.com",
+    "GIT_COMMITTER_NAME": "Towelie",
+    "GIT_COMMITTER_EMAIL": "towelie@example.com",
+    "GIT_CONFIG_NOSYSTEM": "1",
+}
+
+TEN_LINES = "".join(f"line {i}\n" for i in range(10))
+
+# path: (contents before, contents after); None means the file is absent.
+CHANGES: dict[str, tuple[bytes | None, bytes | None]] = {
+    "modified.txt": (b"one\ntwo\nthree\n", b"one\n2\nthree\n"),
+    "added.txt": (None, b"new\n"),
+    "deleted.txt": (b"gone\n", None),
+    "old name.txt": (TEN_LINES.encode(), None),
+    "new name.txt": (None, TEN_LINES.replace("line 5", "five").encode()),
+    "naïve.txt": (b"a\n", b"b\n"),
+    "tab\there.txt": (b"a\n", b"a\nb\n"),
+    'quote"d.txt': (b"a\nb\n", b"a\n"),
+    # Prefixes look like directories; only the first "a/" or "b/" is git's.
+    "a/b/c.txt": (b"a\n", b"b\n"),
+    "b/a.txt": (b"a\n", b"b\n"),
+    "image.bin": (b"\0\1\2", b"\0\1\3"),
+    "no-eol.txt": (b"x\ny", b"x\nz"),
+    "gains-eol.txt": (b"x", b"x\n"),
+}
+
+# (path, old_path, status, binary, additions, deletions)
+EXPECTED = [
+    ("modified.txt", "modified.txt", "M", False, 1, 1),
+    ("added.txt", "added.txt", "A", False, 1, 0),
+    ("deleted.txt", "deleted.txt", "D", False, 0, 1),
+    ("new name.txt", "old name.txt", "R", False, 1, 1),
+    ("naïve.txt", "naïve.txt", "M", False, 1, 1),
+    ("tab\there.txt", "tab\there.txt", "M", False, 1, 0),
+    ('quote"d.txt', 'quote"d.txt', "M", False, 0, 1),
+    ("a/b/c.txt", "a/b/c.txt", "M", False, 1, 1),
+    ("b/a.txt", "b/a.txt", "M", False, 1, 1),
+    ("image.bin", "image.bin", "M", True, 0, 0),
+    ("no-eol.txt", "no-eol.txt", "M", False, 1, 1),
+    ("gains-eol.txt", "gains-eol.txt", "M", False, 1, 1),
+]
+
+
+def git(repo: Path, *args: str) -> bytes:
+    env = {**os.environ, **GIT_ENV, "HOME": str(repo.parent)}
+    result = subprocess.run(
+        ["git", *args], cwd=repo, env=env, capture_output=True, check=True
+    )
+    return result.stdout
+
+
+def write(repo: Path, side: int) -> None:
+    for path, versions in CHANGES.items():
+        target = repo / path
+        if versions[side] is None:
+            target.unlink(missing_ok=True)
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(versions[side])
+
+
+@pytest.fixture(scope="module")
+def repo(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """A repository whose last commit makes every change in ``CHANGES``."""
+    repo = tmp_path_factory.mktemp("patch") / "repo"
+    repo.mkdir()
+    git(repo, "init", "-q", "-b", "main")
+    for side in (0, 1):
+        write(repo, side)
+        git(repo, "add", "-A")
+        git(repo, "commit", "-q", "-m", f"side {side}")
+    return repo
+
+
+@pytest.fixture(scope="module")
+def patches(repo: Path) -> dict[str, FilePatch]:
+    output = git(repo, "diff", *DIFF_FORMAT, "HEAD~", "HEAD")
+    return {patch.path: patch for patch in parse_patch(output.decode())}
+
+
+@pytest.fixture(scope="module")
+def stats(repo: Path) -> dict[str, FileStat]:
+    output = git(repo, "diff", "--raw", "--numstat", "-z", "HEAD~", "HEAD")
+    return {stat.path: stat for stat in parse_summary(output)}
+
+
+def test_every_file_is_parsed(
+    patches: dict[str, FilePatch], stats: dict[str, FileStat]
+):
+    paths = {row[0] for row in EXPECTED}
+    assert patches.keys() == paths
+    assert stats.keys() == paths
+
+
+@pytest.mark.parametrize(
+    ("path", "old_path", "status", "binary", "additions", "deletions"), EXPECTED
+)
+def test_parse_patch(
+    patches: dict[str, FilePatch],
+    path: str,
+    old_path: str,
+    status: str,
+    binary: bool,
+    additions: int,
+    deletions: int,
+):
+    patch = patches[path]
+    assert (patch.old_path, patch.new_path, patch.status) == (old_path, path, status)
+    assert (patch.binary, patch.additions, patch.deletions) == (
+        binary,
+        additions,
+        deletions,
+    )
+    assert patch.text.startswith("diff --git ")
+    if binary:
+        assert patch.hunks == []
+    else:
+        # The hunks tile the patch after its header.
+        assert patch.hunks[0].start == patch.text.index("\n@@ ") + 1
+        assert patch.hunks[-1].end == len(patch.text)
+        for hunk in patch.hunks:
+            assert patch.hunk_text(hunk).startswith("@@ ")
+
+
+@pytest.mark.parametrize(
+    ("path", "old_path", "status", "binary", "additions", "deletions"), EXPECTED
+)
+def test_parse_summary(
+    stats: dict[str, FileStat],
+    patches: dict[str, FilePatch],
+    path: str,
+    old_path: str,
+    status: str,
+    binary: bool,
+    additions: int,
+    deletions: int,
+):
+    stat = stats[path]
+    assert (stat.old_path, stat.new_path, stat.status) == (old_path, path, status)
+    assert (stat.binary, stat.additions, stat.deletions) == (
+        binary,
+        additions,
+        deletions,
+    )
+    # The patch's index line abbreviates the same object names.
+    patch = patches[path]
+    assert stat.old_oid.startswith(patch.old_oid)
+    assert stat.new_oid.startswith(patch.new_oid)
+
+
+def test_parse_raw_patch(repo: Path, patches: dict[str, FilePatch]):
+    output = git(repo, "diff", *DIFF_FORMAT, "--raw", "-z", "-p", "HEAD~", "HEAD")
+    raw_stats, text = parse_raw_patch(output)
+    assert {stat.path: (stat.old_path, stat.status) for stat in raw_stats} == {
+        path: (old_path, status) for path, old_path, status, *_ in EXPECTED
+    }
+    # Line counts come from the patch, not the raw records.
+    assert all(stat.additions == stat.deletions == 0 for stat in raw_stats)
+    assert {patch.path: patch.text for patch in parse_patch(text)} == {
+        path: patch.text for path, patch in patches.items()
+    }
+
+
+def test_parse_raw_patch_without_patch(repo: Path):
+    output = git(repo, "diff", "--raw", "-z", "HEAD", "HEAD")
+    assert parse_raw_patch(output) == ([], "")
+
+
+@pytest.mark.parametrize(
+    ("quoted", "path"),
+    [
+        ("plain.txt", "plain.txt"),
+        ("with space.txt", "with space.txt"),
+        ('"na\\303\\257ve.txt"', "naïve.txt"),
+        ('"tab\\there.txt"', "tab\there.txt"),
+        ('"quote\\"d.txt"', 'quote"d.txt'),
+        ('"back\\\\slash.txt"', "back\\slash.txt"),
+        ('"new\\nline.txt"', "new\nline.txt"),
+    ],
+)
+def test_unquote_path(quoted: str, path: str):
+    assert unquote_path(quoted) == path
+
+
+@pytest.mark.parametrize(
+    ("line", "old_path", "new_path"),
+    [
+        ("diff --git a/x.txt b/x.txt", "x.txt", "x.txt"),
+        ("diff --git a/a b/c b/a b/c", "a b/c", "a b/c"),
+        ("diff --git a/b/x b/b/x", "b/x", "b/x"),
+        ('diff --git "a/na\\303\\257ve" "b/na\\303\\257ve"', "naïve", "naïve"),
+    ],
+)
+def test_header_paths(line: str, old_path: str, new_path: str):
+    (patch,) = parse_patch(f"{line}\nindex 1234567..89abcde 100644\n")
+    assert (patch.old_path, patch.new_path) == (old_path, new_path)
@@ -8,6 +8,13 @@ export interface CommitInfo {
 export interface Branch {
   name: string;
   commits: CommitInfo[];
+  total_commits: number;
+  next_cursor: string | null;
+}
+
+export interface CommitPage {
+  commits: CommitInfo[];
+  next_cursor: string | null;
 }
 
 export interface Diff {
@@ -19,13 +26,121 @@ export interface DiffResponse {
   diff: Diff;
 }
 
-export type CheckStatus = "pass" | "fail" | "no_checks";
+export type FileStatus = "M" | "A" | "D" | "R" | "C";
+
+export type CollapseReason = "binary" | "generated" | "vendored" | "large";
+
+export interface DiffFileSummary {
+  old_path: string;
+  new_path: string;
+  status: FileStatus;
+  binary: boolean;
+  additions: number;
+  deletions: number;
+  collapsed: CollapseReason | null;
+}
+
+export interface DiffSummaryResponse {
+  files: DiffFileSummary[];
+}
+
+// (start, end, kind) over a line's text, in characters.
+export type TokenSpan = [number, number, string];
+
+export interface DiffHunk {
+  old_start: number;
+  old_lines: number;
+  new_start: number;
+  new_lines: number;
+  header: string;
+  lines: string[];
+  // Per line, spans over the text after the +/-/space marker.
+  tokens: TokenSpan[][] | null;
+}
+
+export interface DiffFile {
+  old_path: string;
+  new_path: string;
+  status: FileStatus;
+  binary: boolean;
+  additions: number;
+  deletions: number;
+  old_oid: string;
+  new_oid: string;
+  hunks: DiffHunk[];
+  collapsed: CollapseReason | null;
+}
+
+export type DiffSide = "old" | "new";
+
+export interface Comment {
+  id: string;
+  path: string;
+  side: DiffSide;
+  // Lines in the diff the comments were requested for.
+  start_line: number;
+  end_line: number;
+  text: string;
+  created_at: number;
+  updated_at: number;
+  outdated: boolean;
+}
+
+export interface CommentDraft {
+  path: string;
+  side: DiffSide;
+  start_line: number;
+  end_line: number;
+  text: string;
+}
+
+export interface DiffSelection {
+  branch?: string;
+  base?: string;
+  commit?: string;
+}
+
+export interface FileLinesRequest {
+  path: string;
+  start: number;
+  end: number;
+  oid?: string;
+  rev?: string;
+  snap?: boolean;
+}
+
+export interface FileLines {
+  path: string;
+  oid: string;
+  start: number;
+  end: number;
+  total_lines: number;
+  lines: string[];
+}
+
+export interface ChangeEvent {
+  generation: number;
+  paths: string[];
+  refs: boolean;
+  full: boolean;
+}
+
+export type CheckStatus = "pass" | "fail" | "no_checks" | "no_files";
 
 export interface ParsedCheck {
   name: string;
   passed: boolean;
 }
 
+export interface CheckHookEvent {
+  name: string;
+  status: string;
+  passed: boolean;
+  duration: number;
+  cached: boolean;
+  details: string;
+}
+
 export interface ChecksResponse {
   status: CheckStatus;
   checks: ParsedCheck[];
@@ -37,36 +152,62 @@ export interface ProjectInfo {
   current_branch: string;
   base_branch: string;
   branches: Branch[];
+  total_branches: number;
+}
+
+export interface BranchMatch {
+  name: string;
+  committed: number;
+}
+
+export interface BranchSearch {
+  branches: BranchMatch[];
+  total: number;
 }
 
 async function parseJson(res: Response): Promise<any> {
+  checkStatus(res);
+  return res.json();
+}
+
+function checkStatus(res: Response) {
   if (!res.ok) {
     throw new Error(`Request failed with status ${res.status}`);
   }
-  return res.json();
 }
 
-export async function getInfo(): Promise<ProjectInfo> {
-  const data = await parseJson(await fetch("/api/info"));
+export async function getInfo(branch?: string): Promise<ProjectInfo> {
+  const qs = new URLSearchParams();
+  if (branch) qs.set("branch", branch);
+  const data = await parseJson(await fetch(withQuery("api/info", qs)));
   return {
     project_name: data.project_name,
     current_branch: data.current_branch,
     base_branch: data.base_branch,
     branches: data.branches,
+    total_branches: data.total_branches,
   };
 }
 
-export async function getDiff(params: {
-  branch?: string;
-  base?: string;
-  commit?: string;
-}): Promise<DiffResponse> {
+export async function searchBranches(query: string): Promise<BranchSearch> {
+  const qs = new URLSearchParams({ q: query });
+  return parseJson(await fetch(withQuery("api/branches", qs)));
+}
+
+function selectionQuery(params: DiffSelection): URLSearchParams {
   const qs = new URLSearchParams();
   if (params.branch) qs.set("branch", params.branch);
   if (params.base) qs.set("base", params.base);
   if (params.commit) qs.set("commit", params.commit);
+  return qs;
+}
 
-  const url = qs.toString() ? `/api/diff?${qs.toString()}` : "/api/diff";
+function withQuery(path: string, qs: URLSearchParams): string {
+  return qs.toString() ? `${path}?${qs.toString()}` : path;
+}
+
+export async function getDiff(params: DiffSelection): Promise<DiffResponse> {
+  const url = withQuery("api/diff", selectionQuery(params));
   const data = await parseJson(await fetch(url));
   return {
     diff: {
@@ -76,8 +217,132 @@ export async function getDiff(params: {
   };
 }
 
-export async function getChecks(): Promise<ChecksResponse> {
-  const data = await parseJson(await fetch("/api/checks"));
+export async function getDiffSummary(
+  params: DiffSelection,
+): Promise<DiffSummaryResponse> {
+  const url = withQuery("api/diff/summary", selectionQuery(params));
+  const data = await parseJson(await fetch(url));
+  return {
+    files: data.files,
+  };
+}
+
+export async function getDiffFiles(
+  params: DiffSelection,
+  paths: string[],
+): Promise<DiffResponse> {
+  const qs = selectionQuery(params);
+  paths.forEach((path) => qs.append("path", path));
+  const data = await parseJson(await fetch(withQuery("api/diff/files", qs)));
+  return {
+    diff: {
+      diff: data.diff.diff,
+      files: data.diff.files,
+    },
+  };
+}
+
+// Like getDiffFiles, with the server's syntax highlighting of each line.
+export async function getHighlightedDiffFiles(
+  params: DiffSelection,
+  paths: string[],
+): Promise<DiffFile[]> {
+  const qs = selectionQuery(params);
+  paths.forEach((path) => qs.append("path", path));
+  qs.set("format", "structured");
+  qs.set("highlight", "true");
+  const data = await parseJson(await fetch(withQuery("api/diff/files", qs)));
+  return data.diff.files;
+}
+
+export async function getCommits(cursor: string): Promise<CommitPage> {
+  const qs = new URLSearchParams({ cursor });
+  return parseJson(await fetch(withQuery("api/commits", qs)));
+}
+
+export async function getComments(
+  params: DiffSelection,
+  paths: string[] = [],
+): Promise<Comment[]> {
+  const qs = selectionQuery(params);
+  paths.forEach((path) => qs.append("path", path));
+  const data = await parseJson(await fetch(withQuery("api/comments", qs)));
+  return data.comments;
+}
+
+export async function addComment(
+  params: DiffSelection,
+  draft: CommentDraft,
+): Promise<Comment> {
+  const url = withQuery("api/comments", selectionQuery(params));
+  return parseJson(
+    await fetch(url, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify(draft),
+    }),
+  );
+}
+
+export async function updateComment(
+  id: string,
+  text: string,
+): Promise<Comment> {
+  return parseJson(
+    await fetch(`api/comments/${encodeURIComponent(id)}`, {
+      method: "PATCH",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ text }),
+    }),
+  );
+}
+
+export async function deleteComment(id: string): Promise<void> {
+  checkStatus(
+    await fetch(`api/comments/${encodeURIComponent(id)}`, {
+      method: "DELETE",
+    }),
+  );
+}
+
+export async function clearComments(branch?: string): Promise<void> {
+  const qs = selectionQuery({ branch });
+  checkStatus(await fetch(withQuery("api/comments", qs), { method: "DELETE" }));
+}
+
+export async function getFileLines(
+  request: FileLinesRequest,
+): Promise<FileLines> {
+  const qs = new URLSearchParams({
+    path: request.path,
+    start: String(request.start),
+    end: String(request.end),
+  });
+  if (request.oid) qs.set("oid", request.oid);
+  if (request.rev) qs.set("rev", request.rev);
+  if (request.snap) qs.set("snap", "true");
+  return parseJson(await fetch(withQuery("api/file/lines", qs)));
+}
+
+export function subscribeChanges(
+  onChange: (event: ChangeEvent) => void,
+): EventSource {
+  const source = new EventSource("api/events");
+  source.addEventListener("change", (event) => {
+    onChange(JSON.parse((event as MessageEvent<string>).data));
+  });
+  return source;
+}
+
+export async function getChecks(
+  params: DiffSelection = {},
+): Promise<ChecksResponse> {
+  const url = withQuery("api/checks", selectionQuery(params));
+  const data = await parseJson(await fetch(url));
   return {
     status: data.status,
     error: data.error,
@@ -85,8 +350,32 @@ export async function getChecks(): Promise<ChecksResponse> {
   };
 }
 
+export function streamChecks(
+  params: DiffSelection,
+  handlers: {
+    onHook: (hook: CheckHookEvent) => void;
+    onDone: (response: ChecksResponse) => void;
+    onError: () => void;
+  },
+): EventSource {
+  const url = withQuery("api/checks/stream", selectionQuery(params));
+  const source = new EventSource(url);
+  source.addEventListener("hook", (event) => {
+    handlers.onHook(JSON.parse((event as MessageEvent<string>).data));
+  });
+  source.addEventListener("done", (event) => {
+    source.close();
+    handlers.onDone(JSON.parse((event as MessageEvent<string>).data));
+  });
+  source.onerror = () => {
+    source.close();
+    handlers.onError();
+  };
+  return source;
+}
+
 export async function getOptions(): Promise<AppOptions> {
-  const data = await parseJson(await fetch("/api/options"));
+  const data = await parseJson(await fetch("api/options"));
   return {
     prompt: data.prompt,
     diff: data.diff,
@@ -95,7 +384,7 @@ export async function getOptions(): Promise<AppOptions> {
 
 export async function updateOptions(payload: AppOptions): Promise<AppOptions> {
   const data = await parseJson(
-    await fetch("/api/options", {
+    await fetch("api/options", {
       method: "PUT",
       headers: {
         "Content-Type": "application/json",
@@ -1,5 +1,10 @@
 import { Controller } from "@hotwired/stimulus";
-import { getChecks, type CheckStatus } from "../api";
+import {
+  streamChecks,
+  type CheckHookEvent,
+  type CheckStatus,
+  type DiffSelection,
+} from "../api";
 
 export default class ChecksController extends Controller {
   static targets = ["status", "output"];
@@ -7,37 +12,68 @@ export default class ChecksController extends Controller {
   declare readonly statusTarget: HTMLElement;
   declare readonly outputTarget: HTMLElement;
 
-  connect() {
-    this.refresh();
+  private selection: DiffSelection | null = null;
+  private source: EventSource | null = null;
+
+  disconnect() {
+    this.source?.close();
+    this.source = null;
+  }
+
+  // Checks cover the files of the diff the review shows, so they start
+  // once the review controller announces its selection.
+  selectionChanged(event: CustomEvent<DiffSelection>) {
+    const previous = JSON.stringify(this.selection);
+    this.selection = event.detail;
+    if (JSON.stringify(this.selection) !== previous) this.refresh();
   }
 
-  async refresh() {
-    this.statusTarget.textContent = "loading…";
+  refresh() {
+    this.source?.close();
+    this.statusTarget.textContent = "running…";
     this.statusTarget.className = "text-xs text-[var(--color-text-faint)]";
     this.outputTarget.textContent = "";
 
-    try {
-      const data = await getChecks();
-      this.statusTarget.textContent = data.status;
-      this.statusTarget.className = this.statusClasses(data.status);
-
-      let output = "";
-      if (data.checks.length > 0) {
-        output = data.checks
-          .map((check) => `${check.passed ? "✓" : "✗"} ${check.name}`)
-          .join("\n");
-      }
+    const hooks = new Map<string, CheckHookEvent>();
+    this.source = streamChecks(this.selection ?? {}, {
+      onHook: (hook) => {
+        hooks.set(hook.name, hook);
+        this.outputTarget.textContent = this.formatHooks(hooks);
+      },
+      onDone: (data) => {
+        this.source = null;
+        this.statusTarget.textContent = data.status;
+        this.statusTarget.className = this.statusClasses(data.status);
 
-      if (data.error) {
-        if (output) output += "\n\n─── Error Details ───\n";
-        output += data.error;
-      }
+        let output = this.formatHooks(hooks);
+        if (data.error) {
+          if (output) output += "\n\n─── Error Details ───\n";
+          output += data.error;
+        }
+        this.outputTarget.textContent = output;
+      },
+      onError: () => {
+        this.source = null;
+        this.statusTarget.textContent = "error";
+        this.statusTarget.className = "text-xs text-[var(--color-del)]";
+      },
+    });
+  }
 
-      this.outputTarget.textContent = output;
-    } catch {
-      this.statusTarget.textContent = "error";
-      this.statusTarget.className = "text-xs text-[var(--color-del)]";
-    }
+  private formatHooks(hooks: Map<string, CheckHookEvent>): string {
+    return Array.from(hooks.values())
+      .map((hook) => {
+        if (!hook.status) return `… ${hook.name}`;
+        const timing = hook.cached ? "cached" : `${hook.duration.toFixed(2)}s`;
+        const line = `${hook.passed ? "✓" : "✗"} ${hook.name}  ${timing}`;
+        if (!hook.details) return line;
+        const details = hook.details
+          .split("\n")
+          .map((detail) => `    ${detail}`)
+          .join("\n");
+        return `${line}\n${details}`;
+      })
+      .join("\n");
   }
 
   async copyOutput(e: Event) {
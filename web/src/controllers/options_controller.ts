@@ -3,17 +3,26 @@ import { getOptions, updateOptions } from "../api";
 import { type AppOptions, type DiffStyle } from "../options";
 
 export default class OptionsController extends Controller {
-  static targets = ["promptTemplate", "diffStyle", "status", "saveButton"];
+  static targets = [
+    "promptTemplate",
+    "diffStyle",
+    "collapseGlobs",
+    "maxFileKib",
+    "maxChangedLines",
+    "status",
+    "saveButton",
+  ];
 
   declare readonly promptTemplateTarget: HTMLTextAreaElement;
   declare readonly diffStyleTarget: HTMLSelectElement;
+  declare readonly collapseGlobsTarget: HTMLTextAreaElement;
+  declare readonly maxFileKibTarget: HTMLInputElement;
+  declare readonly maxChangedLinesTarget: HTMLInputElement;
   declare readonly statusTarget: HTMLElement;
   declare readonly saveButtonTarget: HTMLButtonElement;
 
   async connect() {
-    const options = await getOptions();
-    this.promptTemplateTarget.value = options.prompt.template;
-    this.diffStyleTarget.value = options.diff.style;
+    this.fill(await getOptions());
   }
 
   async save(event: Event) {
@@ -28,13 +37,18 @@ export default class OptionsController extends Controller {
       },
       diff: {
         style: this.diffStyleTarget.value as DiffStyle,
+        collapse_globs: this.collapseGlobsTarget.value
+          .split("\n")
+          .map((glob) => glob.trim())
+          .filter(Boolean),
+        max_file_bytes: Math.round(this.maxFileKibTarget.valueAsNumber * 1024),
+        max_changed_lines: this.maxChangedLinesTarget.valueAsNumber,
       },
     };
 
     try {
       const saved = await updateOptions(payload);
-      this.promptTemplateTarget.value = saved.prompt.template;
-      this.diffStyleTarget.value = saved.diff.style;
+      this.fill(saved);
 
       const tag = document.getElementById("towelie-options-data");
       if (tag) {
@@ -49,6 +63,16 @@ export default class OptionsController extends Controller {
     }
   }
 
+  private fill(options: AppOptions) {
+    this.promptTemplateTarget.value = options.prompt.template;
+    this.diffStyleTarget.value = options.diff.style;
+    this.collapseGlobsTarget.value = options.diff.collapse_globs.join("\n");
+    this.maxFileKibTarget.value = String(
+      Math.round(options.diff.max_file_bytes / 1024),
+    );
+    this.maxChangedLinesTarget.value = String(options.diff.max_changed_lines);
+  }
+
   private setStatus(text: string, classes: string) {
     this.statusTarget.textContent = text;
     this.statusTarget.className = classes;
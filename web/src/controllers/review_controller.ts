@@ -1,14 +1,82 @@
 import { Controller } from "@hotwired/stimulus";
 import { Diff2HtmlUI } from "diff2html/lib/ui/js/diff2html-ui-slim.js";
-import { getDiff, getInfo, getOptions } from "../api";
+import {
+  addComment,
+  clearComments,
+  deleteComment,
+  getComments,
+  getCommits,
+  getDiffFiles,
+  getDiffSummary,
+  getFileLines,
+  getHighlightedDiffFiles,
+  getInfo,
+  getOptions,
+  searchBranches,
+  subscribeChanges,
+  updateComment,
+  type ChangeEvent,
+  type Comment,
+  type CommitInfo,
+  type DiffFile,
+  type DiffFileSummary,
+  type DiffSelection,
+  type FileStatus,
+  type TokenSpan,
+} from "../api";
+
+type OutputFormat = "line-by-line" | "side-by-side";
+
+const FILE_BATCH_SIZE = 8;
+
+// Files with this many changed lines are highlighted by the server, which
+// parses them once with tree-sitter, instead of by highlight.js in the page.
+const SERVER_HIGHLIGHT_LINES = 1000;
+
+// Server token kinds that highlight.js names differently; the rest map to
+// `hljs-<kind>`, which the diff2html stylesheet colours.
+const HIGHLIGHT_CLASSES: Record<string, string> = {
+  attribute: "hljs-attr",
+  boolean: "hljs-literal",
+  constant: "hljs-literal",
+  constructor: "hljs-title class_",
+  delimiter: "hljs-punctuation",
+  embedded: "hljs-subst",
+  escape: "hljs-char escape_",
+  function: "hljs-title function_",
+  label: "hljs-symbol",
+  module: "hljs-title class_",
+  tag: "hljs-name",
+};
+
+// Context lines revealed above a hunk per click on its header.
+const EXPAND_LINES = 20;
+
+// Commit selections whose diff includes the working tree.
+const WORKTREE_COMMITS = new Set([
+  "__all__",
+  "__uncommitted__",
+  "__staged__",
+  "__unstaged__",
+]);
+
+// Value of the commit selector's last option, which fetches the next page.
+const LOAD_MORE_COMMITS = "__more__";
+
+// Commits of the selected branch fetched past the first page /api/info
+// embeds, kept so that reloading the info doesn't drop them.
+interface CommitPages {
+  // The first page's cursor; it pins the branch tip and base they belong to.
+  after: string;
+  commits: CommitInfo[];
+  next: string | null;
+}
 
 enum DiffSide {
   Old = "old",
   New = "new",
 }
 
-type FileStatus = "M" | "A" | "D";
-
 interface Selection {
   fileName: string;
   startLine: number;
@@ -20,10 +88,11 @@ interface CommentRecord {
   id: string;
   selection: Selection;
   text: string;
-  branch: string;
   author: "You";
   createdAt: number;
   updatedAt: number;
+  // The commented lines changed since the comment was written.
+  outdated: boolean;
 }
 
 interface SelectionState {
@@ -52,6 +121,31 @@ interface FileEntry {
   status: FileStatus;
   anchorId: string;
   wrapper: HTMLElement;
+  summary: DiffFileSummary;
+  loaded: boolean;
+  patch: string;
+  // Server highlighting of the patch's lines, by side and line number.
+  tokens: LineTokens | null;
+}
+
+interface LineTokens {
+  old: Map<number, TokenSpan[]>;
+  new: Map<number, TokenSpan[]>;
+}
+
+interface PatchHunk {
+  oldStart: number;
+  oldLines: number;
+  newStart: number;
+  newLines: number;
+  section: string;
+  body: string[];
+}
+
+interface ParsedPatch {
+  head: string[];
+  hunks: PatchHunk[];
+  newOid: string | null;
 }
 
 interface FileTreeNode {
@@ -83,153 +177,357 @@ function flashButton(btn: HTMLButtonElement, message: string, ms: number) {
   }, ms);
 }
 
-function makeId(): string {
-  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 8)}`;
+function legacyStorageKey(): string {
+  // Each repository served from the same origin kept its own comments.
+  const scope = document.documentElement.dataset.commentScope;
+  return scope ? `towelie-comments:${scope}` : "towelie-comments";
 }
 
-class CommentStorage {
-  private static KEY = "towelie-comments";
-  private comments: CommentRecord[] = [];
+interface LegacyComment {
+  selection?: Selection;
+  text?: string;
+  branch?: string;
+}
 
-  load() {
-    const stored = localStorage.getItem(CommentStorage.KEY);
-    if (!stored) {
-      this.comments = [];
-      return;
+// Comments used to live in localStorage; hand them to the server once. Each
+// is anchored to its file as the branch's full diff shows it now.
+async function migrateLegacyComments() {
+  const key = legacyStorageKey();
+  const stored = localStorage.getItem(key);
+  if (!stored) return;
+  let pending: LegacyComment[];
+  try {
+    pending = JSON.parse(stored);
+  } catch {
+    localStorage.removeItem(key);
+    return;
+  }
+  try {
+    for (const item of pending) {
+      if (item?.selection && item.text) {
+        const branch = item.branch === "current" ? undefined : item.branch;
+        await addComment({ branch }, toDraft(item.selection, item.text));
+      }
+      // Sent ones are dropped right away, so a failure never duplicates.
+      pending = pending.slice(1);
+      localStorage.setItem(key, JSON.stringify(pending));
     }
+  } catch {
+    // The rest is sent on the next page load.
+    return;
+  }
+  localStorage.removeItem(key);
+}
 
-    try {
-      const raw = JSON.parse(stored) as Array<Partial<CommentRecord>>;
-      const now = Date.now();
-      this.comments = raw
-        .filter(
-          (item): item is Partial<CommentRecord> & { selection: Selection } =>
-            Boolean(item?.selection && item.text && item.branch),
-        )
-        .map((item) => {
-          const createdAt =
-            typeof item.createdAt === "number" ? item.createdAt : now;
-          const updatedAt =
-            typeof item.updatedAt === "number" ? item.updatedAt : createdAt;
-          return {
-            id: typeof item.id === "string" ? item.id : makeId(),
-            selection: item.selection,
-            text: item.text ?? "",
-            branch: item.branch ?? "current",
-            author: "You",
-            createdAt,
-            updatedAt,
-          };
-        });
-      this.save();
-    } catch {
-      this.comments = [];
-      localStorage.removeItem(CommentStorage.KEY);
+function toDraft(selection: Selection, text: string) {
+  return {
+    path: selection.fileName,
+    side: selection.diffSide,
+    start_line: selection.startLine,
+    end_line: selection.endLine,
+    text,
+  };
+}
+
+function toRecord(comment: Comment): CommentRecord {
+  return {
+    id: comment.id,
+    selection: {
+      fileName: comment.path,
+      startLine: comment.start_line,
+      endLine: comment.end_line,
+      diffSide: comment.side === "old" ? DiffSide.Old : DiffSide.New,
+    },
+    text: comment.text,
+    author: "You",
+    createdAt: comment.created_at,
+    updatedAt: comment.updated_at,
+    outdated: comment.outdated,
+  };
+}
+
+// The selected branch's comments, kept by the server and placed on the
+// lines of the diff being viewed. Indexed by file, so drawing a file only
+// looks at its own comments.
+class CommentStore {
+  private byFile = new Map<string, CommentRecord[]>();
+
+  get size(): number {
+    let count = 0;
+    this.byFile.forEach((comments) => (count += comments.length));
+    return count;
+  }
+
+  // Replace all comments, or only those on `paths`.
+  replace(comments: Comment[], paths?: Iterable<string>) {
+    if (paths) {
+      Array.from(paths).forEach((path) => this.byFile.delete(path));
+    } else {
+      this.byFile.clear();
     }
+    comments.forEach((comment) => this.insert(toRecord(comment)));
   }
 
-  add(selection: Selection, text: string, branch: string): CommentRecord {
-    const now = Date.now();
-    const comment: CommentRecord = {
-      id: makeId(),
-      selection,
-      text,
-      branch,
-      author: "You",
-      createdAt: now,
-      updatedAt: now,
-    };
-    this.comments.push(comment);
-    this.save();
-    return comment;
+  all(): CommentRecord[] {
+    return Array.from(this.byFile.values())
+      .flat()
+      .sort((a, b) => a.createdAt - b.createdAt);
   }
 
-  remove(id: string) {
-    this.comments = this.comments.filter((comment) => comment.id !== id);
-    this.save();
+  files(): Set<string> {
+    return new Set(this.byFile.keys());
   }
 
-  update(id: string, text: string) {
-    const comment = this.comments.find((entry) => entry.id === id);
-    if (!comment) return;
-    comment.text = text;
-    comment.updatedAt = Date.now();
-    comment.author = "You";
-    this.save();
+  forFile(fileName: string): CommentRecord[] {
+    return this.byFile.get(fileName) ?? [];
   }
 
-  forBranch(branch: string): CommentRecord[] {
-    return this.comments.filter((comment) => comment.branch === branch);
+  async add(scope: DiffSelection, selection: Selection, text: string) {
+    this.insert(toRecord(await addComment(scope, toDraft(selection, text))));
   }
 
-  clearBranch(branch: string) {
-    this.comments = this.comments.filter(
-      (comment) => comment.branch !== branch,
-    );
-    this.save();
+  async update(comment: CommentRecord, text: string) {
+    const updated = await updateComment(comment.id, text);
+    comment.text = updated.text;
+    comment.updatedAt = updated.updated_at;
+  }
+
+  async remove(comment: CommentRecord) {
+    await deleteComment(comment.id);
+    const fileName = comment.selection.fileName;
+    const rest = this.forFile(fileName).filter((c) => c.id !== comment.id);
+    if (rest.length > 0) {
+      this.byFile.set(fileName, rest);
+    } else {
+      this.byFile.delete(fileName);
+    }
+  }
+
+  async clear(branch: string) {
+    await clearComments(branch || undefined);
+    this.byFile.clear();
   }
 
-  private save() {
-    localStorage.setItem(CommentStorage.KEY, JSON.stringify(this.comments));
+  private insert(comment: CommentRecord) {
+    const fileName = comment.selection.fileName;
+    if (!this.byFile.has(fileName)) this.byFile.set(fileName, []);
+    this.byFile.get(fileName)!.push(comment);
   }
 }
 
-function parseFileStatuses(diffText: string): Map<string, FileStatus> {
-  const statuses = new Map<string, FileStatus>();
-  const lines = diffText.split("\n");
+// Both names of a renamed file, so its patch is found either way.
+function filePaths(entries: FileEntry[]): string[] {
+  return entries.flatMap((entry) =>
+    entry.summary.old_path === entry.summary.new_path
+      ? [entry.summary.new_path]
+      : [entry.summary.new_path, entry.summary.old_path],
+  );
+}
 
-  let oldPath = "";
-  let newPath = "";
-  let status: FileStatus = "M";
+function splitPatches(diffText: string, files: string[]): Map<string, string> {
+  const patches = new Map<string, string>();
+  diffText
+    .split(/^(?=diff --git )/m)
+    .filter((chunk) => chunk.startsWith("diff --git "))
+    .forEach((chunk, index) => {
+      const fileName = files[index];
+      if (fileName !== undefined) patches.set(fileName, chunk);
+    });
+  return patches;
+}
 
-  const flush = () => {
-    if (status === "D") {
-      if (oldPath) statuses.set(oldPath, "D");
-      return;
-    }
-    if (newPath) statuses.set(newPath, status);
-    else if (oldPath) statuses.set(oldPath, status);
-  };
+// Raw patch text for a structured file, as much as diff2html and parseHunks
+// read of it.
+function structuredPatch(file: DiffFile): string {
+  if (file.hunks.length === 0) return "";
+  const lines = [`diff --git a/${file.old_path} b/${file.new_path}`];
+  if (file.status === "R" || file.status === "C") {
+    const verb = file.status === "R" ? "rename" : "copy";
+    lines.push(`${verb} from ${file.old_path}`, `${verb} to ${file.new_path}`);
+  }
+  lines.push(
+    `index ${file.old_oid}..${file.new_oid}`,
+    file.status === "A" ? "--- /dev/null" : `--- a/${file.old_path}`,
+    file.status === "D" ? "+++ /dev/null" : `+++ b/${file.new_path}`,
+  );
+  file.hunks.forEach((hunk) => lines.push(hunk.header, ...hunk.lines));
+  return `${lines.join("\n")}\n`;
+}
 
-  for (const line of lines) {
-    if (line.startsWith("diff --git ")) {
-      if (oldPath || newPath) flush();
-      const match = line.match(/^diff --git a\/(.+) b\/(.+)$/);
-      oldPath = match?.[1] ?? "";
-      newPath = match?.[2] ?? "";
-      status = "M";
-      continue;
-    }
-    if (!oldPath && !newPath) continue;
+function lineTokens(file: DiffFile): LineTokens | null {
+  if (!file.hunks.some((hunk) => hunk.tokens)) return null;
+  const tokens: LineTokens = { old: new Map(), new: new Map() };
+  file.hunks.forEach((hunk) => {
+    let oldLine = hunk.old_start;
+    let newLine = hunk.new_start;
+    hunk.lines.forEach((line, index) => {
+      const spans = hunk.tokens?.[index] ?? [];
+      const marker = line[0];
+      if (marker === "-" || marker === " ") tokens.old.set(oldLine++, spans);
+      if (marker === "+" || marker === " ") tokens.new.set(newLine++, spans);
+    });
+  });
+  return tokens;
+}
 
-    if (line.startsWith("new file mode ")) status = "A";
-    if (line.startsWith("deleted file mode ")) status = "D";
-    if (line.startsWith("rename from ")) oldPath = line.slice(12).trim();
-    if (line.startsWith("rename to ")) newPath = line.slice(10).trim();
+// Spans of the diff line a rendered row shows, in either output format.
+function rowSpans(
+  row: HTMLTableRowElement,
+  tokens: LineTokens,
+): TokenSpan[] | undefined {
+  const sideCell = row.querySelector("td.d2h-code-side-linenumber");
+  if (sideCell) {
+    const side = row.closest(".d2h-file-side-diff");
+    const isOld = side?.parentElement?.firstElementChild === side;
+    return (isOld ? tokens.old : tokens.new).get(Number(sideCell.textContent));
   }
+  const newLine = Number(row.querySelector(".line-num2")?.textContent);
+  if (newLine > 0) return tokens.new.get(newLine);
+  return tokens.old.get(Number(row.querySelector(".line-num1")?.textContent));
+}
+
+// Wrap the characters of each span in highlight.js's classes. Spans are cut
+// per text node, so diff2html's word-level <ins>/<del> marks survive.
+function paintSpans(element: HTMLElement, spans: TokenSpan[]) {
+  const walker = document.createTreeWalker(element, NodeFilter.SHOW_TEXT);
+  const nodes: Text[] = [];
+  while (walker.nextNode()) nodes.push(walker.currentNode as Text);
+
+  let offset = 0;
+  let next = 0;
+  nodes.forEach((node) => {
+    const start = offset;
+    const end = start + node.data.length;
+    offset = end;
+    const fragment = document.createDocumentFragment();
+    let pos = start;
+    while (next < spans.length) {
+      const [from, to, kind] = spans[next]!;
+      if (from >= end) break;
+      if (to > pos) {
+        const first = Math.max(from, pos);
+        const last = Math.min(to, end);
+        if (first > pos) {
+          fragment.append(node.data.slice(pos - start, first - start));
+        }
+        const span = document.createElement("span");
+        span.className = HIGHLIGHT_CLASSES[kind] ?? `hljs-${kind}`;
+        span.textContent = node.data.slice(first - start, last - start);
+        fragment.append(span);
+        pos = last;
+      }
+      // A span running into the next text node is finished there.
+      if (to > end) break;
+      next++;
+    }
+    if (pos === start) return;
+    if (pos < end) fragment.append(node.data.slice(pos - start));
+    node.replaceWith(fragment);
+  });
+}
+
+const HUNK_HEADER = /^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$/;
+
+function parseHunks(patch: string): ParsedPatch {
+  const head: string[] = [];
+  const hunks: PatchHunk[] = [];
+  let newOid: string | null = null;
+  patch
+    .replace(/\n$/, "")
+    .split("\n")
+    .forEach((line) => {
+      const match = HUNK_HEADER.exec(line);
+      if (match) {
+        hunks.push({
+          oldStart: Number(match[1]),
+          oldLines: match[2] === undefined ? 1 : Number(match[2]),
+          newStart: Number(match[3]),
+          newLines: match[4] === undefined ? 1 : Number(match[4]),
+          section: match[5] ?? "",
+          body: [],
+        });
+      } else if (hunks.length > 0) {
+        hunks[hunks.length - 1]!.body.push(line);
+      } else {
+        const index = /^index [0-9a-f]+\.\.([0-9a-f]+)/.exec(line);
+        if (index) newOid = index[1]!;
+        head.push(line);
+      }
+    });
+  return { head, hunks, newOid };
+}
+
+function formatHunks({ head, hunks }: ParsedPatch): string {
+  const lines = [...head];
+  hunks.forEach((hunk) => {
+    lines.push(
+      `@@ -${hunk.oldStart},${hunk.oldLines} ` +
+        `+${hunk.newStart},${hunk.newLines} @@${hunk.section}`,
+      ...hunk.body,
+    );
+  });
+  return `${lines.join("\n")}\n`;
+}
 
-  if (oldPath || newPath) flush();
-  return statuses;
+// An empty side's start names the line before the hunk, not its first line.
+function firstLine(start: number, count: number): number {
+  return count === 0 ? start + 1 : start;
 }
 
-function detectStatus(
-  fileName: string,
-  statuses: Map<string, FileStatus>,
-  diffFiles: string[],
-): FileStatus {
-  if (statuses.has(fileName)) return statuses.get(fileName) ?? "M";
+// New-side lines hidden between hunk `index` and the one before it.
+function hiddenAbove(
+  parsed: ParsedPatch,
+  index: number,
+): { start: number; end: number } | null {
+  const hunk = parsed.hunks[index];
+  if (!hunk) return null;
+  const previous = parsed.hunks[index - 1];
+  const previousEnd = previous
+    ? firstLine(previous.newStart, previous.newLines) + previous.newLines - 1
+    : 0;
+  const end = firstLine(hunk.newStart, hunk.newLines) - 1;
+  const start = Math.max(previousEnd + 1, end - EXPAND_LINES + 1);
+  return start <= end ? { start, end } : null;
+}
 
-  if (fileName.includes(" -> ")) {
-    const [from, to] = fileName.split(" -> ").map((part) => part.trim());
-    if (statuses.has(to)) return statuses.get(to) ?? "M";
-    if (statuses.has(from)) return statuses.get(from) ?? "M";
+// Prepend unchanged lines to a hunk, merging it into the previous hunk once
+// the gap between them is closed.
+function widenHunk(patch: string, index: number, context: string[]): string {
+  const parsed = parseHunks(patch);
+  const hunk = parsed.hunks[index];
+  if (!hunk || context.length === 0) return patch;
+
+  hunk.oldStart = firstLine(hunk.oldStart, hunk.oldLines) - context.length;
+  hunk.newStart = firstLine(hunk.newStart, hunk.newLines) - context.length;
+  hunk.oldLines += context.length;
+  hunk.newLines += context.length;
+  hunk.body = [...context.map((line) => ` ${line}`), ...hunk.body];
+
+  const previous = parsed.hunks[index - 1];
+  if (previous && previous.newStart + previous.newLines === hunk.newStart) {
+    previous.oldLines += hunk.oldLines;
+    previous.newLines += hunk.newLines;
+    previous.body.push(...hunk.body);
+    parsed.hunks.splice(index, 1);
   }
+  return formatHunks(parsed);
+}
 
-  const bySuffix = diffFiles.find(
-    (candidate) => candidate.endsWith(fileName) || fileName.endsWith(candidate),
+function sameSummary(a: DiffFileSummary, b: DiffFileSummary): boolean {
+  return (
+    a.old_path === b.old_path &&
+    a.new_path === b.new_path &&
+    a.status === b.status &&
+    a.binary === b.binary &&
+    a.additions === b.additions &&
+    a.deletions === b.deletions
   );
-  if (bySuffix && statuses.has(bySuffix)) return statuses.get(bySuffix) ?? "M";
-  return "M";
+}
+
+function estimatedSlotHeight(file: DiffFileSummary): number {
+  if (file.binary || file.collapsed) return 80;
+  const lines = Math.min(file.additions + file.deletions + 10, 400);
+  return 48 + lines * 18;
 }
 
 export default class ReviewController extends Controller {
@@ -242,6 +540,8 @@ export default class ReviewController extends Controller {
     "output",
     "fileExplorer",
     "branchSelect",
+    "branchSearch",
+    "branchMatches",
     "baseBranchSelect",
     "commitSelect",
     "fileCount",
@@ -257,16 +557,38 @@ export default class ReviewController extends Controller {
   declare readonly outputTarget: HTMLElement;
   declare readonly fileExplorerTarget: HTMLElement;
   declare readonly branchSelectTarget: HTMLSelectElement;
+  declare readonly branchSearchTarget: HTMLInputElement;
+  declare readonly branchMatchesTarget: HTMLDataListElement;
   declare readonly baseBranchSelectTarget: HTMLSelectElement;
   declare readonly commitSelectTarget: HTMLSelectElement;
   declare readonly fileCountTarget: HTMLElement;
   declare readonly commentCountTarget: HTMLElement;
   declare readonly submitNotesTarget: HTMLTextAreaElement;
 
-  private storage = new CommentStorage();
+  private storage = new CommentStore();
   private currentBranchName = "current";
+  private firstCommits: CommitInfo[] = [];
+  private commitPages: CommitPages | null = null;
+  private totalCommits = 0;
+  private selectedCommit = "";
+  private pickedBranch = "";
+  private branchSearchSequence = 0;
   private sidebarVisible = true;
   private fileEntries: FileEntry[] = [];
+  private fileEntriesById = new Map<string, FileEntry>();
+  private fileObserver: IntersectionObserver | null = null;
+  private pendingLoads = new Set<FileEntry>();
+  // Collapsed files the user opened; they stay open across reloads.
+  private expandedFiles = new Set<string>();
+  private loadTimer = 0;
+  private loadGeneration = 0;
+  private diffSelection: DiffSelection = {};
+  private outputFormat: OutputFormat = "side-by-side";
+  private changeSource: EventSource | null = null;
+  private changedPaths = new Set<string>();
+  private deferredPaths = new Set<string>();
+  private reloadPending = false;
+  private applyingChanges = false;
   private fileButtons = new Map<string, HTMLButtonElement>();
   private activeFileId = "";
   private scrollTicking = false;
@@ -282,65 +604,78 @@ export default class ReviewController extends Controller {
   };
 
   async connect() {
-    this.storage.load();
+    await migrateLegacyComments();
     await this.reloadReview();
     this.outputTarget.addEventListener("mousedown", this.onMouseDown);
     this.outputTarget.addEventListener("mousemove", this.onMouseMove);
     document.addEventListener("mouseup", this.onMouseUp);
     this.mainScrollTarget.addEventListener("scroll", this.onMainScroll);
+    this.changeSource = subscribeChanges(this.onRepoChange);
   }
 
   disconnect() {
+    this.changeSource?.close();
+    this.changeSource = null;
+    this.fileObserver?.disconnect();
     this.outputTarget.removeEventListener("mousedown", this.onMouseDown);
     this.outputTarget.removeEventListener("mousemove", this.onMouseMove);
     document.removeEventListener("mouseup", this.onMouseUp);
     this.mainScrollTarget.removeEventListener("scroll", this.onMainScroll);
   }
 
+  switchRepo(event: Event) {
+    window.location.assign((event.currentTarget as HTMLSelectElement).value);
+  }
+
   async reloadReview() {
     await this.populateInfo();
     this.closePanel();
     this.clearSelectionHighlight();
 
-    const branch = this.branchSelectTarget.value;
-    const base = this.baseBranchSelectTarget.value;
-    const commit = this.commitSelectTarget.value;
-    const [diff, options] = await Promise.all([
-      getDiff({ branch, base, commit }),
+    const selection: DiffSelection = {
+      branch: this.branchSelectTarget.value,
+      base: this.baseBranchSelectTarget.value,
+      commit: this.commitSelectTarget.value,
+    };
+    const generation = ++this.loadGeneration;
+    const [summary, options, comments] = await Promise.all([
+      getDiffSummary(selection),
       getOptions(),
+      getComments(selection),
     ]);
+    if (generation !== this.loadGeneration) return;
 
-    const outputFormat =
+    this.diffSelection = selection;
+    this.storage.replace(comments);
+    this.dispatch("selection", { detail: selection });
+    this.outputFormat =
       options.diff.style === "inline" ? "line-by-line" : "side-by-side";
 
+    this.fileObserver?.disconnect();
+    this.pendingLoads.clear();
+    this.deferredPaths.clear();
     this.outputTarget.innerHTML = "";
-    const diff2htmlUi = new Diff2HtmlUI(this.outputTarget, diff.diff.diff, {
-      drawFileList: false,
-      matching: "lines",
-      outputFormat,
-      fileContentToggle: true,
-      stickyFileHeaders: false,
-      diffMaxChanges: 50000,
-    });
-    diff2htmlUi.draw();
-
-    const statusMap = parseFileStatuses(diff.diff.diff);
-    this.fileEntries = this.collectFileEntries(statusMap, diff.diff.files);
+    this.fileEntries = this.sortedFiles(summary.files).map(
+      ({ file, fileName }) => this.createFileSlot(file, fileName),
+    );
+    this.placeFileSlots();
     this.fileCountTarget.textContent = String(this.fileEntries.length);
 
     this.renderFileTree();
-    this.normalizeDiffRows();
     this.renderComments();
+    this.observeFileSlots();
     this.updateActiveFileFromScroll();
   }
 
   async populateInfo() {
-    const info = await getInfo();
-    this.currentBranchName = info.current_branch;
     const branchSelect = this.branchSelectTarget;
     const baseBranchSelect = this.baseBranchSelectTarget;
     const commitSelect = this.commitSelectTarget;
-    const savedBranch = branchSelect.value;
+    // Only recent branches are listed; ask for the selected one explicitly.
+    const savedBranch = this.pickedBranch || branchSelect.value;
+    this.pickedBranch = "";
+    const info = await getInfo(savedBranch);
+    this.currentBranchName = info.current_branch;
     const savedBase = baseBranchSelect.value;
     const savedCommit = commitSelect.value;
     const branchNames = info.branches.map((branch) => branch.name);
@@ -359,6 +694,11 @@ export default class ReviewController extends Controller {
     });
     branchSelect.value =
       savedBranch && branchNames.includes(savedBranch) ? savedBranch : "";
+    this.branchSearchTarget.classList.toggle(
+      "hidden",
+      info.total_branches <= branchNames.length,
+    );
+    this.branchSearchTarget.placeholder = `Find among ${info.total_branches} branches`;
 
     baseBranchSelect.innerHTML = "";
     branchNames.forEach((branchName) => {
@@ -378,8 +718,68 @@ export default class ReviewController extends Controller {
     const selectedBranch = info.branches.find(
       (branch) => branch.name === selectedBranchName,
     );
-    const commits = selectedBranch?.commits ?? [];
+    this.firstCommits = selectedBranch?.commits ?? [];
+    this.totalCommits = selectedBranch?.total_commits ?? 0;
+    const after = selectedBranch?.next_cursor ?? null;
+    if (after === null) {
+      this.commitPages = null;
+    } else if (this.commitPages?.after !== after) {
+      this.commitPages = { after, commits: [], next: after };
+    }
+    const commits = this.renderCommitOptions();
+
+    commitSelect.value = commits.some((commit) => commit.hash === savedCommit)
+      ? savedCommit
+      : commits.length > 0
+        ? commits[0].hash
+        : "";
+    this.selectedCommit = commitSelect.value;
+  }
+
+  async findBranches() {
+    const sequence = ++this.branchSearchSequence;
+    const found = await searchBranches(this.branchSearchTarget.value);
+    if (sequence !== this.branchSearchSequence) return;
+    this.branchMatchesTarget.innerHTML = "";
+    found.branches.forEach((branch) => {
+      const option = document.createElement("option");
+      option.value = branch.name;
+      this.branchMatchesTarget.appendChild(option);
+    });
+  }
+
+  async pickBranch() {
+    const name = this.branchSearchTarget.value.trim();
+    if (!name) return;
+    this.branchSearchTarget.value = "";
+    this.pickedBranch = name;
+    await this.reloadReview();
+  }
 
+  async selectCommit() {
+    if (this.commitSelectTarget.value !== LOAD_MORE_COMMITS) {
+      this.selectedCommit = this.commitSelectTarget.value;
+      await this.reloadReview();
+      return;
+    }
+    this.commitSelectTarget.value = this.selectedCommit;
+    const pages = this.commitPages;
+    if (!pages?.next) return;
+    const page = await getCommits(pages.next);
+    // The info may have been reloaded for another branch meanwhile.
+    if (this.commitPages !== pages) return;
+    pages.commits.push(...page.commits);
+    pages.next = page.next_cursor;
+    this.renderCommitOptions();
+    this.commitSelectTarget.value = this.selectedCommit;
+  }
+
+  private renderCommitOptions(): CommitInfo[] {
+    const commitSelect = this.commitSelectTarget;
+    const commits = [
+      ...this.firstCommits,
+      ...(this.commitPages?.commits ?? []),
+    ];
     commitSelect.innerHTML = "";
     commits.forEach((commit) => {
       const option = document.createElement("option");
@@ -387,12 +787,16 @@ export default class ReviewController extends Controller {
       option.textContent = commit.label;
       commitSelect.appendChild(option);
     });
-
-    commitSelect.value = commits.some((commit) => commit.hash === savedCommit)
-      ? savedCommit
-      : commits.length > 0
-        ? commits[0].hash
-        : "";
+    if (this.commitPages?.next) {
+      const shown = commits.filter(
+        (commit) => !WORKTREE_COMMITS.has(commit.hash),
+      ).length;
+      const option = document.createElement("option");
+      option.value = LOAD_MORE_COMMITS;
+      option.textContent = `Load more commits (${shown} of ${this.totalCommits})`;
+      commitSelect.appendChild(option);
+    }
+    return commits;
   }
 
   toggleSidebar() {
@@ -415,9 +819,8 @@ export default class ReviewController extends Controller {
   async finishReview(e: Event) {
     const btn = e.currentTarget as HTMLButtonElement;
     const selectedBranch = this.branchSelectTarget.value;
-    const storageBranch = selectedBranch || "current";
     const renderedBranch = selectedBranch || this.currentBranchName;
-    const branchComments = this.storage.forBranch(storageBranch);
+    const branchComments = this.storage.all();
     const overallNotes = this.submitNotesTarget.value.trim();
 
     if (branchComments.length === 0 && !overallNotes) {
@@ -458,47 +861,373 @@ export default class ReviewController extends Controller {
     }
 
     await navigator.clipboard.writeText(reviewText);
-    this.storage.clearBranch(storageBranch);
+    await this.storage.clear(selectedBranch);
     this.renderComments();
     flashButton(btn, "Copied to clipboard!", 2000);
   }
 
-  private collectFileEntries(
-    statuses: Map<string, FileStatus>,
-    diffFiles: string[],
-  ): FileEntry[] {
-    return Array.from(
-      this.outputTarget.querySelectorAll<HTMLElement>(".d2h-file-wrapper"),
-    )
-      .map((wrapper, index) => {
-        const fileName =
-          wrapper.querySelector(".d2h-file-name")?.textContent?.trim() ||
-          `file-${index + 1}`;
-        const anchorId = `towelie-file-${index + 1}`;
-        wrapper.id = anchorId;
-        wrapper.dataset.fileName = fileName;
-
-        const split = fileName.split("/");
-
-        return {
-          fileName,
-          pathParts: split,
-          status: detectStatus(fileName, statuses, diffFiles),
-          anchorId,
-          wrapper,
-        };
+  private sortedFiles(
+    files: DiffFileSummary[],
+  ): { file: DiffFileSummary; fileName: string }[] {
+    return files
+      .map((file) => {
+        const fileName = file.status === "D" ? file.old_path : file.new_path;
+        return { file, fileName };
       })
       .sort((a, b) => a.fileName.localeCompare(b.fileName));
   }
 
+  private createFileSlot(file: DiffFileSummary, fileName: string): FileEntry {
+    const wrapper = document.createElement("section");
+    wrapper.className = "towelie-file-slot";
+    wrapper.dataset.fileName = fileName;
+    wrapper.style.minHeight = `${estimatedSlotHeight(file)}px`;
+
+    const placeholder = document.createElement("div");
+    placeholder.className = "towelie-file-placeholder";
+    placeholder.textContent = file.binary
+      ? `${fileName} · binary`
+      : `${fileName} · +${file.additions} −${file.deletions}`;
+    wrapper.appendChild(placeholder);
+
+    const entry: FileEntry = {
+      fileName,
+      pathParts: fileName.split("/"),
+      status: file.status,
+      anchorId: "",
+      wrapper,
+      summary: file,
+      loaded: false,
+      patch: "",
+      tokens: null,
+    };
+    if (this.isCollapsed(entry) && file.collapsed !== "binary") {
+      placeholder.append(` · ${file.collapsed}`);
+      const expand = document.createElement("button");
+      expand.type = "button";
+      expand.className = "towelie-file-expand";
+      expand.textContent = "Show diff";
+      expand.addEventListener("click", () => {
+        this.expandedFiles.add(fileName);
+        expand.remove();
+        this.queueFileLoad(entry);
+      });
+      placeholder.appendChild(expand);
+    }
+    return entry;
+  }
+
+  // Collapsed files ship as stats only and load when the user asks.
+  private isCollapsed(entry: FileEntry): boolean {
+    return (
+      !!entry.summary.collapsed && !this.expandedFiles.has(entry.fileName)
+    );
+  }
+
+  private placeFileSlots() {
+    this.fileEntriesById.clear();
+    this.fileEntries.forEach((entry, index) => {
+      entry.anchorId = `towelie-file-${index + 1}`;
+      entry.wrapper.id = entry.anchorId;
+      this.fileEntriesById.set(entry.anchorId, entry);
+      // Appending an existing slot moves it, keeping its rendered diff.
+      this.outputTarget.appendChild(entry.wrapper);
+    });
+  }
+
+  private onRepoChange = (event: ChangeEvent) => {
+    if (event.refs || event.full) {
+      this.reloadPending = true;
+    } else if (this.showsWorktree()) {
+      event.paths.forEach((path) => this.changedPaths.add(path));
+    } else {
+      return;
+    }
+    if (!this.applyingChanges) void this.applyRepoChanges();
+  };
+
+  private showsWorktree(): boolean {
+    return (
+      !this.branchSelectTarget.value &&
+      WORKTREE_COMMITS.has(this.commitSelectTarget.value)
+    );
+  }
+
+  private async applyRepoChanges() {
+    this.applyingChanges = true;
+    try {
+      while (this.reloadPending || this.changedPaths.size > 0) {
+        const reload = this.reloadPending;
+        const paths = new Set(this.changedPaths);
+        this.reloadPending = false;
+        this.changedPaths.clear();
+        if (reload) {
+          const scrollTop = this.mainScrollTarget.scrollTop;
+          await this.reloadReview();
+          this.mainScrollTarget.scrollTop = scrollTop;
+        } else {
+          await this.refreshChangedFiles(paths);
+        }
+      }
+    } catch {
+      // The next change event retries; the page keeps its last good state.
+    } finally {
+      this.applyingChanges = false;
+    }
+  }
+
+  private async refreshChangedFiles(paths: Set<string>) {
+    const generation = this.loadGeneration;
+    // Comments on edited files may have moved; only those are re-placed.
+    const [summary, comments] = await Promise.all([
+      getDiffSummary(this.diffSelection),
+      getComments(this.diffSelection, Array.from(paths)),
+    ]);
+    if (generation !== this.loadGeneration) return;
+    this.storage.replace(comments, paths);
+
+    const previous = new Map(
+      this.fileEntries.map((entry) => [entry.fileName, entry]),
+    );
+    const kept = new Set<FileEntry>();
+    this.fileEntries = this.sortedFiles(summary.files).map(
+      ({ file, fileName }) => {
+        const old = previous.get(fileName);
+        if (!old) return this.createFileSlot(file, fileName);
+
+        const touched = paths.has(file.new_path) || paths.has(file.old_path);
+        if (!touched && sameSummary(old.summary, file)) {
+          kept.add(old);
+          return old;
+        }
+        if (this.openPanelRow && old.wrapper.contains(this.openPanelRow)) {
+          // Don't discard a comment being typed; refresh once it closes.
+          this.deferredPaths.add(fileName);
+          kept.add(old);
+          return old;
+        }
+        const entry = this.createFileSlot(file, fileName);
+        if (old.loaded) {
+          entry.wrapper.style.minHeight = `${old.wrapper.offsetHeight}px`;
+        }
+        return entry;
+      },
+    );
+
+    previous.forEach((entry) => {
+      if (kept.has(entry)) return;
+      this.fileObserver?.unobserve(entry.wrapper);
+      this.pendingLoads.delete(entry);
+      entry.wrapper.remove();
+    });
+    this.placeFileSlots();
+    this.fileCountTarget.textContent = String(this.fileEntries.length);
+    this.commentCountTarget.textContent = `${this.storage.size} notes`;
+    this.renderFileTree();
+    this.fileEntries.forEach((entry) => {
+      if (!kept.has(entry)) this.fileObserver?.observe(entry.wrapper);
+    });
+    this.updateActiveFileFromScroll();
+  }
+
+  private observeFileSlots() {
+    this.fileObserver = new IntersectionObserver(
+      (records) => {
+        records.forEach((record) => {
+          if (!record.isIntersecting) return;
+          const entry = this.fileEntriesById.get(record.target.id);
+          if (entry && !entry.loaded && !this.isCollapsed(entry)) {
+            this.queueFileLoad(entry);
+          }
+        });
+      },
+      { root: this.mainScrollTarget, rootMargin: "800px 0px" },
+    );
+    this.fileEntries.forEach((entry) =>
+      this.fileObserver?.observe(entry.wrapper),
+    );
+  }
+
+  private queueFileLoad(entry: FileEntry) {
+    this.pendingLoads.add(entry);
+    if (this.loadTimer) return;
+    this.loadTimer = window.setTimeout(() => this.flushFileLoads(), 0);
+  }
+
+  private async flushFileLoads() {
+    this.loadTimer = 0;
+    const batch = Array.from(this.pendingLoads).slice(0, FILE_BATCH_SIZE);
+    batch.forEach((entry) => {
+      this.pendingLoads.delete(entry);
+      this.fileObserver?.unobserve(entry.wrapper);
+      entry.loaded = true;
+    });
+    if (this.pendingLoads.size > 0) {
+      this.loadTimer = window.setTimeout(() => this.flushFileLoads(), 0);
+    }
+    if (batch.length === 0) return;
+
+    const generation = this.loadGeneration;
+    const large = (entry: FileEntry) =>
+      entry.summary.additions + entry.summary.deletions >=
+      SERVER_HIGHLIGHT_LINES;
+    await Promise.all([
+      this.loadFiles(batch.filter((entry) => !large(entry)), generation),
+      this.loadHighlightedFiles(batch.filter(large), generation),
+    ]);
+  }
+
+  private async loadFiles(entries: FileEntry[], generation: number) {
+    if (entries.length === 0) return;
+    try {
+      const response = await getDiffFiles(
+        this.diffSelection,
+        filePaths(entries),
+      );
+      if (generation !== this.loadGeneration) return;
+      const patches = splitPatches(response.diff.diff, response.diff.files);
+      entries.forEach((entry) =>
+        this.renderFilePatch(entry, patches.get(entry.fileName) ?? ""),
+      );
+    } catch {
+      this.failFileLoads(entries, generation);
+    }
+  }
+
+  private async loadHighlightedFiles(
+    entries: FileEntry[],
+    generation: number,
+  ) {
+    if (entries.length === 0) return;
+    try {
+      const files = await getHighlightedDiffFiles(
+        this.diffSelection,
+        filePaths(entries),
+      );
+      if (generation !== this.loadGeneration) return;
+      const byName = new Map(
+        files.map((file) => [
+          file.status === "D" ? file.old_path : file.new_path,
+          file,
+        ]),
+      );
+      entries.forEach((entry) => {
+        const file = byName.get(entry.fileName);
+        entry.tokens = file ? lineTokens(file) : null;
+        this.renderFilePatch(entry, file ? structuredPatch(file) : "");
+      });
+    } catch {
+      this.failFileLoads(entries, generation);
+    }
+  }
+
+  private failFileLoads(entries: FileEntry[], generation: number) {
+    if (generation !== this.loadGeneration) return;
+    entries.forEach((entry) => {
+      entry.loaded = false;
+      const placeholder = entry.wrapper.querySelector(
+        ".towelie-file-placeholder",
+      );
+      if (placeholder) {
+        placeholder.textContent = `${entry.fileName} · failed to load`;
+      }
+      this.fileObserver?.observe(entry.wrapper);
+    });
+  }
+
+  private renderFilePatch(entry: FileEntry, patch: string) {
+    entry.patch = patch;
+    entry.wrapper.innerHTML = "";
+    entry.wrapper.style.minHeight = "";
+    if (!patch) {
+      const placeholder = document.createElement("div");
+      placeholder.className = "towelie-file-placeholder";
+      placeholder.textContent = `${entry.fileName} · no textual changes`;
+      entry.wrapper.appendChild(placeholder);
+      return;
+    }
+
+    const diff2htmlUi = new Diff2HtmlUI(entry.wrapper, patch, {
+      drawFileList: false,
+      matching: "lines",
+      outputFormat: this.outputFormat,
+      fileContentToggle: true,
+      stickyFileHeaders: false,
+      diffMaxChanges: 50000,
+      highlight: !entry.tokens,
+    });
+    diff2htmlUi.draw();
+    if (entry.tokens) this.paintTokens(entry.wrapper, entry.tokens);
+
+    entry.wrapper
+      .querySelectorAll<HTMLElement>(".d2h-file-wrapper")
+      .forEach((wrapper) => {
+        wrapper.dataset.fileName = entry.fileName;
+      });
+    this.normalizeDiffRows(entry.wrapper);
+    this.bindHunkExpanders(entry);
+    this.storage
+      .forFile(entry.fileName)
+      .forEach((comment) => this.highlightComment(comment));
+  }
+
+  private paintTokens(root: HTMLElement, tokens: LineTokens) {
+    root
+      .querySelectorAll<HTMLTableRowElement>(".d2h-diff-tbody tr")
+      .forEach((row) => {
+        const code = row.querySelector<HTMLElement>(".d2h-code-line-ctn");
+        const spans = rowSpans(row, tokens);
+        if (!code || !spans || spans.length === 0) return;
+        // As diff2html marks the lines highlight.js has coloured.
+        code.classList.add("hljs");
+        paintSpans(code, spans);
+      });
+  }
+
+  private bindHunkExpanders(entry: FileEntry) {
+    const parsed = parseHunks(entry.patch);
+    if (!parsed.newOid || !/[^0]/.test(parsed.newOid)) return;
+
+    entry.wrapper
+      .querySelectorAll<HTMLElement>(".d2h-diff-tbody")
+      .forEach((tbody) => {
+        const headers = Array.from(tbody.rows).filter((row) =>
+          row.querySelector("td.d2h-info"),
+        );
+        headers.forEach((row, index) => {
+          if (!hiddenAbove(parsed, index)) return;
+          row.classList.add("towelie-hunk-expander");
+          row.title = "Show more context";
+          row.addEventListener("click", () => this.expandHunk(entry, index));
+        });
+      });
+  }
+
+  private async expandHunk(entry: FileEntry, index: number) {
+    const patch = entry.patch;
+    const parsed = parseHunks(patch);
+    const range = hiddenAbove(parsed, index);
+    if (!range || !parsed.newOid) return;
+
+    try {
+      const response = await getFileLines({
+        path: entry.summary.new_path,
+        oid: parsed.newOid,
+        ...range,
+      });
+      // The file was reloaded while the lines were in flight.
+      if (entry.patch !== patch) return;
+      this.renderFilePatch(entry, widenHunk(patch, index, response.lines));
+    } catch {
+      // The file changed on disk; the change event reloads it.
+    }
+  }
+
   private renderFileTree() {
     this.fileButtons.clear();
     this.fileExplorerTarget.innerHTML = "";
 
-    const comments = this.storage.forBranch(this.currentStorageBranch());
-    const commentedFiles = new Set(
-      comments.map((comment) => comment.selection.fileName),
-    );
+    const commentedFiles = this.storage.files();
 
     const root: FileTreeNode = {
       path: "",
@@ -581,15 +1310,14 @@ export default class ReviewController extends Controller {
     renderNode(root, 0);
   }
 
-  private normalizeDiffRows() {
-    this.outputTarget
+  private normalizeDiffRows(root: HTMLElement = this.outputTarget) {
+    root
       .querySelectorAll<HTMLTableRowElement>(".towelie-comment-panel-row")
       .forEach((row) => row.remove());
 
-    const rows =
-      this.outputTarget.querySelectorAll<HTMLTableRowElement>(
-        ".d2h-diff-tbody tr",
-      );
+    const rows = root.querySelectorAll<HTMLTableRowElement>(
+      ".d2h-diff-tbody tr",
+    );
     rows.forEach((row) => {
       row.classList.remove("towelie-diff-row", "has-comment");
       row
@@ -637,10 +1365,7 @@ export default class ReviewController extends Controller {
   }
 
   private renderComments() {
-    const branch = this.currentStorageBranch();
-    const comments = this.storage.forBranch(branch);
-
-    this.commentCountTarget.textContent = `${comments.length} notes`;
+    this.commentCountTarget.textContent = `${this.storage.size} notes`;
     this.closePanel();
 
     this.outputTarget
@@ -656,54 +1381,55 @@ export default class ReviewController extends Controller {
           .forEach((button) => button.classList.remove("has-comment"));
       });
 
-    const commentsByFile = new Map<string, CommentRecord[]>();
-    comments.forEach((comment) => {
-      if (!commentsByFile.has(comment.selection.fileName)) {
-        commentsByFile.set(comment.selection.fileName, []);
-      }
-      commentsByFile.get(comment.selection.fileName)?.push(comment);
-    });
-
+    const commentedFiles = this.storage.files();
     this.fileEntries.forEach((entry) => {
       const button = this.fileButtons.get(entry.anchorId);
       if (!button) return;
       const dot = button.querySelector(".towelie-tree-comment-dot");
       if (!dot) return;
-      dot.classList.toggle("hidden", !commentsByFile.has(entry.fileName));
+      dot.classList.toggle("hidden", !commentedFiles.has(entry.fileName));
     });
 
-    comments.forEach((comment) => {
-      const rows = this.findRowsForSelection(comment.selection);
-      rows.forEach((row) => row.classList.add("towelie-comment-range"));
-
-      const anchorRow = rows[0];
-      if (!anchorRow) return;
-      anchorRow.classList.add("has-comment", "towelie-comment-anchor");
-
-      const triggers = Array.from(
-        anchorRow.querySelectorAll<HTMLElement>(
-          `.towelie-comment-trigger[data-file-name="${CSS.escape(comment.selection.fileName)}"][data-diff-side="${comment.selection.diffSide}"]`,
-        ),
-      );
-      const anchorTrigger =
-        triggers.find(
-          (trigger) =>
-            Number(trigger.dataset.line) === comment.selection.startLine,
-        ) ??
-        triggers.find((trigger) => {
-          const line = Number(trigger.dataset.line);
-          return (
-            !Number.isNaN(line) &&
-            line >= comment.selection.startLine &&
-            line <= comment.selection.endLine
-          );
-        });
-      anchorTrigger?.classList.add("has-comment");
+    // Files not drawn yet highlight their comments once they load.
+    this.fileEntries.forEach((entry) => {
+      if (!entry.patch) return;
+      this.storage
+        .forFile(entry.fileName)
+        .forEach((comment) => this.highlightComment(comment));
     });
 
     this.updateActiveFileFromScroll();
   }
 
+  private highlightComment(comment: CommentRecord) {
+    const rows = this.findRowsForSelection(comment.selection);
+    rows.forEach((row) => row.classList.add("towelie-comment-range"));
+
+    const anchorRow = rows[0];
+    if (!anchorRow) return;
+    anchorRow.classList.add("has-comment", "towelie-comment-anchor");
+
+    const triggers = Array.from(
+      anchorRow.querySelectorAll<HTMLElement>(
+        `.towelie-comment-trigger[data-file-name="${CSS.escape(comment.selection.fileName)}"][data-diff-side="${comment.selection.diffSide}"]`,
+      ),
+    );
+    const anchorTrigger =
+      triggers.find(
+        (trigger) =>
+          Number(trigger.dataset.line) === comment.selection.startLine,
+      ) ??
+      triggers.find((trigger) => {
+        const line = Number(trigger.dataset.line);
+        return (
+          !Number.isNaN(line) &&
+          line >= comment.selection.startLine &&
+          line <= comment.selection.endLine
+        );
+      });
+    anchorTrigger?.classList.add("has-comment");
+  }
+
   private findRowsForSelection(selection: Selection): HTMLTableRowElement[] {
     const rows: HTMLTableRowElement[] = [];
     const wrapper = this.outputTarget.querySelector<HTMLElement>(
@@ -776,7 +1502,7 @@ export default class ReviewController extends Controller {
       block.className = "towelie-comment-block";
       block.innerHTML = `
         <p class="towelie-comment-text"></p>
-        <div class="towelie-comment-meta">${comment.author} · lines ${lineLabel}</div>
+        <div class="towelie-comment-meta">${comment.author} · lines ${lineLabel}${comment.outdated ? " · outdated" : ""}</div>
       `;
       const textNode = block.querySelector<HTMLElement>(
         ".towelie-comment-text",
@@ -809,10 +1535,10 @@ export default class ReviewController extends Controller {
         cancelBtn.className = "towelie-comment-cancel";
         cancelBtn.textContent = "Cancel";
 
-        saveBtn.addEventListener("click", () => {
+        saveBtn.addEventListener("click", async () => {
           const next = textarea.value.trim();
           if (!next) return;
-          this.storage.update(comment.id, next);
+          await this.storage.update(comment, next);
           this.renderComments();
           this.openSavedPanel(
             diffRow,
@@ -841,8 +1567,8 @@ export default class ReviewController extends Controller {
       deleteBtn.type = "button";
       deleteBtn.className = "towelie-comment-action towelie-comment-delete";
       deleteBtn.textContent = "Delete";
-      deleteBtn.addEventListener("click", () => {
-        this.storage.remove(comment.id);
+      deleteBtn.addEventListener("click", async () => {
+        await this.storage.remove(comment);
         this.renderComments();
       });
 
@@ -898,10 +1624,10 @@ export default class ReviewController extends Controller {
     cancelBtn.className = "towelie-comment-cancel";
     cancelBtn.textContent = "Cancel";
 
-    saveBtn.addEventListener("click", () => {
+    saveBtn.addEventListener("click", async () => {
       const text = textarea.value.trim();
       if (!text) return;
-      this.storage.add(selection, text, this.currentStorageBranch());
+      await this.storage.add(this.diffSelection, selection, text);
       this.renderComments();
     });
 
@@ -944,24 +1670,22 @@ export default class ReviewController extends Controller {
     this.openPanelRow.remove();
     this.openPanelRow = null;
     this.openPanelKey = "";
+    if (this.deferredPaths.size > 0) {
+      this.deferredPaths.forEach((path) => this.changedPaths.add(path));
+      this.deferredPaths.clear();
+      if (!this.applyingChanges) void this.applyRepoChanges();
+    }
   }
 
   private commentsForLocation(location: LineLocation): CommentRecord[] {
-    return this.storage
-      .forBranch(this.currentStorageBranch())
-      .filter((comment) => {
-        const selection = comment.selection;
-        return (
-          selection.fileName === location.fileName &&
-          selection.diffSide === location.diffSide &&
-          location.lineNumber >= selection.startLine &&
-          location.lineNumber <= selection.endLine
-        );
-      });
-  }
-
-  private currentStorageBranch(): string {
-    return this.branchSelectTarget.value || "current";
+    return this.storage.forFile(location.fileName).filter((comment) => {
+      const selection = comment.selection;
+      return (
+        selection.diffSide === location.diffSide &&
+        location.lineNumber >= selection.startLine &&
+        location.lineNumber <= selection.endLine
+      );
+    });
   }
 
   private scrollToFile(anchorId: string) {
@@ -6,5 +6,8 @@ export interface AppOptions {
   };
   diff: {
     style: DiffStyle;
+    collapse_globs: string[];
+    max_file_bytes: number;
+    max_changed_lines: number;
   };
 }